@@ -0,0 +1,63 @@
+"""
+Result caching for analytics endpoints.
+
+Each cached result is keyed by its parameters plus a data watermark. The
+watermark is a version number kept in the cache and bumped by signal
+handlers whenever rows feeding that family of metrics are written (see
+signals.py), so stale results never need to be deleted explicitly.
+
+Watermarks are only as shared as the cache. With a shared backend
+(CACHE_REDIS_URL), a write in any process retires the results every
+process cached before it. The local-memory fallback has one cache per
+process, so a write is only seen by the process that made it. The others
+serve their results for up to ANALYTICS_LOCAL_CACHE_TIMEOUT seconds,
+which caps every timeout in that setup.
+"""
+from django.conf import settings
+from django.core.cache import cache
+import hashlib
+import json
+import time
+
+WATERMARK_KEY = 'analytics:watermark:{}'
+DEFAULT_TIMEOUT = 60 * 60
+LOCAL_TIMEOUT = getattr(settings, 'ANALYTICS_LOCAL_CACHE_TIMEOUT', 60)
+
+
+def cache_is_shared():
+    return not settings.CACHES['default']['BACKEND'].endswith(('LocMemCache', 'DummyCache'))
+
+
+def get_watermark(name):
+    key = WATERMARK_KEY.format(name)
+    watermark = cache.get(key)
+    if watermark is None:
+        # Seed from the clock so an evicted watermark never reuses an old version
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        watermark = cache.get(key)
+    return watermark
+
+
+def bump_watermark(name):
+    key = WATERMARK_KEY.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def cached_result(name, params, compute, timeout=DEFAULT_TIMEOUT, depends_on=None):
+    """
+    Return compute() for `params`, cached until one of the `depends_on`
+    watermarks (default: just `name`) moves.
+    """
+    watermarks = ':'.join(str(get_watermark(watermark)) for watermark in (depends_on or [name]))
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    key = f'analytics:{name}:{watermarks}:{digest}'
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        if not cache_is_shared():
+            timeout = LOCAL_TIMEOUT if timeout is None else min(timeout, LOCAL_TIMEOUT)
+        cache.set(key, result, timeout)
+    return result
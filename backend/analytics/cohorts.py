@@ -0,0 +1,66 @@
+"""Cohort retention matrices built in one vectorized pass."""
+from django.db.models.functions import TruncMonth
+import numpy as np
+
+from users.models import UserActivityLog
+from events.models import EventRegistration
+from resources.models import ResourceBooking
+
+# source name -> (model, activity timestamp field, extra filters)
+COHORT_SOURCES = {
+    'registrations': (EventRegistration, 'registered_at', {'status__in': ['registered', 'attended']}),
+    'bookings': (ResourceBooking, 'created_at', {'status__in': ['approved', 'confirmed', 'ongoing', 'completed']}),
+    'logs': (UserActivityLog, 'created_at', {}),
+}
+
+
+def month_number(value):
+    """Months since 1970-01 for a date/datetime (already truncated to its month)."""
+    return value.year * 12 + value.month - 1 - 1970 * 12
+
+
+def user_months(queryset, user_field, time_field):
+    """
+    Distinct (user_id, activity month) pairs for `queryset`. Truncation and
+    de-duplication happen in the database, so a user's hundreds of rows in
+    a month arrive as a single pair.
+    """
+    return queryset.annotate(
+        activity_month=TruncMonth(time_field)
+    ).values_list(user_field, 'activity_month').distinct()
+
+
+def retention_matrix(users, activity, periods):
+    """
+    Build the cohort x period matrix.
+
+    `users` is an iterable of (user_id, joined month datetime) and `activity`
+    an iterable of (user_id, activity month datetime) pairs, possibly from
+    several sources. Returns (first cohort month number, cohort sizes,
+    active user counts of shape [cohorts, periods]).
+    """
+    users = list(users)
+    if not users:
+        return None, np.zeros(0, dtype=np.int64), np.zeros((0, periods), dtype=np.int64)
+
+    index = {user_id: i for i, (user_id, _) in enumerate(users)}
+    joined = np.fromiter((month_number(month) for _, month in users), dtype=np.int64, count=len(users))
+    first_cohort = int(joined.min())
+    cohort_row = joined - first_cohort
+    sizes = np.bincount(cohort_row)
+
+    activity = [(index.get(user_id, -1), month) for user_id, month in activity if month is not None]
+    user_idx = np.fromiter((i for i, _ in activity), dtype=np.int64, count=len(activity))
+    months = np.fromiter((month_number(month) for _, month in activity), dtype=np.int64, count=len(activity))
+
+    known = user_idx >= 0
+    user_idx, months = user_idx[known], months[known]
+    period = months - joined[user_idx]
+    in_window = (period >= 0) & (period < periods)
+    user_idx, period = user_idx[in_window], period[in_window]
+
+    # A user counts once per period however many sources saw them
+    unique_keys = np.unique(user_idx * periods + period)
+    active = np.zeros((len(sizes), periods), dtype=np.int64)
+    np.add.at(active, (cohort_row[unique_keys // periods], unique_keys % periods), 1)
+    return first_cohort, sizes, active
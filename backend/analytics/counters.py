@@ -0,0 +1,206 @@
+"""
+Write-behind aggregation for UserActivity counters.
+
+Request handlers call ``activity_counter.increment(user, 'event_views')``,
+which only touches an in-process dict. A background thread periodically
+flushes the coalesced deltas as multi-row upserts keyed on the
+(user, date) unique constraint, so a burst of N increments for the same
+user and day costs one row write instead of N read-modify-writes.
+
+Loss bound: increments live only in memory until the next flush, so a
+hard crash loses at most ``ACTIVITY_COUNTER_FLUSH_INTERVAL`` seconds of
+activity. At most ``ACTIVITY_COUNTER_MAX_PENDING`` (user, day) keys are
+held; half that triggers an early flush, and while flushes keep failing
+(the deltas are kept for the next attempt) increments for new keys past
+the cap are dropped and counted. A graceful shutdown flushes everything
+through ``atexit``. ``stats()`` reports what is at risk and what was
+dropped.
+"""
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import connection, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+from .models import UserActivity
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = (
+    'login_count', 'event_views', 'event_registrations', 'resource_bookings',
+    'messages_sent', 'announcements_viewed', 'total_session_time',
+)
+
+
+class ActivityCounter:
+    def __init__(self, flush_interval=10, max_pending_keys=5000, upsert_batch_size=500):
+        self.flush_interval = flush_interval
+        self.max_pending_keys = max_pending_keys
+        self.upsert_batch_size = upsert_batch_size
+        self._pending = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_flush = None
+        self._flushed_rows = 0
+        self._failed_flushes = 0
+        self._dropped_increments = 0
+
+    def increment(self, user, field, amount=1):
+        """Record `amount` more `field` activity for `user` today. Never touches the database."""
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Unknown activity counter: {field}")
+        if user is None or not getattr(user, 'is_authenticated', False):
+            return
+
+        key = (user.pk, timezone.localdate())
+        with self._lock:
+            if key in self._pending or len(self._pending) < self.max_pending_keys:
+                self._pending[key][field] += amount
+            else:
+                self._dropped_increments += amount
+            pending_keys = len(self._pending)
+
+        self._ensure_started()
+        if pending_keys >= self.max_pending_keys // 2:
+            self._wake.set()
+
+    def flush(self):
+        """Write all pending deltas to the database. Returns the number of (user, day) rows upserted."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, defaultdict(Counter)
+            if not batch:
+                return 0
+
+            try:
+                self._upsert(batch)
+            except Exception as e:
+                # Put the deltas back so a transient database error doesn't drop them, up to the cap
+                with self._lock:
+                    for key, deltas in batch.items():
+                        if key in self._pending or len(self._pending) < self.max_pending_keys:
+                            self._pending[key].update(deltas)
+                        else:
+                            self._dropped_increments += sum(deltas.values())
+                self._failed_flushes += 1
+                logger.error(f"Error flushing {len(batch)} activity counters: {e}")
+                return 0
+
+            self._last_flush = timezone.now()
+            self._flushed_rows += len(batch)
+            return len(batch)
+
+    def shutdown(self):
+        """Stop the flusher thread and write out everything still pending."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        """Current in-memory state: what a crash right now would lose."""
+        with self._lock:
+            pending_keys = len(self._pending)
+            pending_increments = sum(sum(deltas.values()) for deltas in self._pending.values())
+        return {
+            'pending_keys': pending_keys,
+            'pending_increments': pending_increments,
+            'max_pending_keys': self.max_pending_keys,
+            'flush_interval': self.flush_interval,
+            'last_flush': self._last_flush,
+            'flushed_rows': self._flushed_rows,
+            'failed_flushes': self._failed_flushes,
+            'dropped_increments': self._dropped_increments,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='activity-counter-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.shutdown)
+        logger.info(
+            f"Activity counter flusher started; crash loss bounded by {self.flush_interval}s "
+            f"or {self.max_pending_keys} pending user-days"
+        )
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            started = time.monotonic()
+            failed = self._failed_flushes
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+            logger.debug(f"Activity counter flush took {time.monotonic() - started:.3f}s")
+            if self._failed_flushes > failed:
+                # Early-flush wakeups would otherwise retry a failing database in a tight loop
+                self._stopping.wait(self.flush_interval)
+
+    def _upsert(self, batch):
+        items = list(batch.items())
+        with transaction.atomic():
+            for i in range(0, len(items), self.upsert_batch_size):
+                chunk = items[i:i + self.upsert_batch_size]
+                if connection.vendor in ('sqlite', 'postgresql'):
+                    self._upsert_on_conflict(chunk)
+                else:
+                    self._upsert_fallback(chunk)
+
+    def _upsert_on_conflict(self, chunk):
+        """One INSERT ... ON CONFLICT (user_id, date) DO UPDATE SET col = col + excluded.col per chunk."""
+        meta = UserActivity._meta
+        qn = connection.ops.quote_name
+        table = qn(meta.db_table)
+        columns = ['id', 'user', 'date', *COUNTER_FIELDS, 'created_at', 'updated_at']
+        fields = [meta.get_field(name) for name in columns]
+        now = timezone.now()
+
+        params = []
+        for (user_id, date), deltas in chunk:
+            values = [uuid.uuid4(), user_id, date, *(deltas.get(name, 0) for name in COUNTER_FIELDS), now, now]
+            params.extend(field.get_db_prep_value(value, connection) for field, value in zip(fields, values))
+
+        row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        updates = ', '.join(
+            f"{qn(name)} = {table}.{qn(name)} + EXCLUDED.{qn(name)}" for name in COUNTER_FIELDS
+        )
+        sql = (
+            f"INSERT INTO {table} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES {', '.join([row] * len(chunk))} "
+            f"ON CONFLICT ({qn(meta.get_field('user').column)}, {qn('date')}) "
+            f"DO UPDATE SET {updates}, {qn('updated_at')} = EXCLUDED.{qn('updated_at')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _upsert_fallback(self, chunk):
+        UserActivity.objects.bulk_create(
+            [UserActivity(user_id=user_id, date=date) for (user_id, date), _ in chunk],
+            ignore_conflicts=True
+        )
+        for (user_id, date), deltas in chunk:
+            UserActivity.objects.filter(user_id=user_id, date=date).update(
+                **{name: F(name) + value for name, value in deltas.items()},
+                updated_at=timezone.now()
+            )
+
+
+activity_counter = ActivityCounter(
+    flush_interval=getattr(settings, 'ACTIVITY_COUNTER_FLUSH_INTERVAL', 10),
+    max_pending_keys=getattr(settings, 'ACTIVITY_COUNTER_MAX_PENDING', 5000),
+)
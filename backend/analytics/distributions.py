@@ -0,0 +1,114 @@
+"""
+Streaming histograms and percentiles for analytics distributions.
+
+Values are pulled with values_list() in fixed-size chunks and folded into a
+fixed-bin histogram plus a bounded uniform sample, so memory stays
+O(bins + sample_size) no matter how many rows the table has. Percentiles
+are exact while the row count fits in the sample and estimated from the
+sample beyond that.
+"""
+from django.db.models import DurationField, ExpressionWrapper, F, Max, Min
+from itertools import islice
+import numpy as np
+
+CHUNK_SIZE = 50000
+SAMPLE_SIZE = 100000
+PERCENTILES = (5, 25, 50, 75, 90, 95, 99)
+
+
+class StreamingDistribution:
+    def __init__(self, edges, sample_size=SAMPLE_SIZE, seed=0):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.sample_size = sample_size
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._rng = np.random.default_rng(seed)
+        self._sample = np.empty(0, dtype=np.float64)
+        self._sample_keys = np.empty(0, dtype=np.float64)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+
+        # Out-of-range values land in the edge bins instead of being dropped
+        clipped = np.clip(values, self.edges[0], self.edges[-1])
+        self.counts += np.histogram(clipped, bins=self.edges)[0]
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+        # Priority sampling: keeping the k smallest random keys is a uniform sample of everything seen
+        keys = np.concatenate([self._sample_keys, self._rng.random(len(values))])
+        sample = np.concatenate([self._sample, values])
+        if len(sample) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            keys, sample = keys[keep], sample[keep]
+        self._sample_keys, self._sample = keys, sample
+
+    def summary(self, percentiles=PERCENTILES):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 4),
+            'min': round(self.min, 4),
+            'max': round(self.max, 4),
+            'percentiles': {
+                f'p{p}': round(float(value), 4)
+                for p, value in zip(percentiles, np.percentile(self._sample, percentiles))
+            },
+            'sampled': self.count > self.sample_size,
+            'histogram': {
+                'edges': [round(float(edge), 4) for edge in self.edges],
+                'counts': self.counts.tolist(),
+            },
+        }
+
+
+def duration_expression(end_field, start_field):
+    return ExpressionWrapper(F(end_field) - F(start_field), output_field=DurationField())
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def duration_distribution(queryset, expression, bins, unit_seconds=3600, chunk_size=CHUNK_SIZE):
+    """
+    Distribution of a duration expression over `queryset`, in units of `unit_seconds`.
+    One aggregate query fixes the bin edges, then rows are streamed in chunks.
+    """
+    queryset = queryset.annotate(value=expression).filter(value__isnull=False)
+    bounds = queryset.aggregate(low=Min('value'), high=Max('value'))
+    if bounds['low'] is None:
+        return StreamingDistribution([0, 1]).summary()
+
+    low = bounds['low'].total_seconds() / unit_seconds
+    high = bounds['high'].total_seconds() / unit_seconds
+    distribution = StreamingDistribution(np.linspace(low, max(high, low + 1e-9), bins + 1))
+
+    rows = queryset.values_list('value', flat=True).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        distribution.add(np.fromiter(
+            (value.total_seconds() / unit_seconds for value in chunk), dtype=np.float64, count=len(chunk)
+        ))
+    return distribution.summary()
+
+
+def value_distribution(queryset, field, edges, chunk_size=CHUNK_SIZE):
+    """Distribution of a numeric column over fixed `edges`."""
+    distribution = StreamingDistribution(edges)
+    rows = queryset.values_list(field, flat=True).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        distribution.add(np.array(chunk, dtype=np.float64))
+    return distribution.summary()
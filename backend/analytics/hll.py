@@ -0,0 +1,114 @@
+"""
+Vectorized HyperLogLog for approximate distinct counting.
+
+A sketch is 2**precision one-byte registers (16 KiB at the default
+precision of 14, ~0.8% standard error). Sketches built over disjoint
+periods or groups merge losslessly with an element-wise max, which is what
+lets per-day sketches answer arbitrary date ranges.
+"""
+import numpy as np
+import zlib
+
+DEFAULT_PRECISION = 14
+
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_ints(values):
+    """splitmix64 finalizer over a uint64 array: cheap, well-mixed 64-bit hashes."""
+    with np.errstate(over='ignore'):
+        z = np.asarray(values, dtype=np.uint64) + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX1
+        z = (z ^ (z >> np.uint64(27))) * _MIX2
+        return z ^ (z >> np.uint64(31))
+
+
+def hash_uuids(uuids):
+    """Hash a sequence of uuid.UUID objects to uint64 without a Python-level loop per hash."""
+    if not len(uuids):
+        return np.empty(0, dtype=np.uint64)
+    halves = np.frombuffer(b''.join(u.bytes for u in uuids), dtype='<u8').reshape(-1, 2)
+    return hash_ints(halves[:, 0] ^ hash_ints(halves[:, 1]))
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = np.zeros(self.m, dtype=np.uint8)
+        self.registers = registers
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+
+        # Rank of the leftmost 1-bit in the remaining (64 - p) bits
+        _, exponent = np.frexp(remainder.astype(np.float64))
+        rank = (64 - self.precision) - exponent + 1
+        rank[remainder == 0] = 64 - self.precision + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """
+        Ertl's improved estimator ("New cardinality estimation algorithms for
+        HyperLogLog sketches", 2017): no bias-correction tables and no switch
+        to linear counting, accurate from empty to very large cardinalities.
+        """
+        q = 64 - self.precision
+        histogram = np.bincount(self.registers, minlength=q + 2).astype(np.float64)
+        m = float(self.m)
+
+        z = m * _tau(1 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * _sigma(histogram[0] / m)
+        if z == float('inf'):
+            return 0
+        return int(round(m * m / (2 * np.log(2)) / z))
+
+    def to_bytes(self):
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data, precision=DEFAULT_PRECISION):
+        registers = np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8).copy()
+        return cls(precision=precision, registers=registers)
+
+
+def _sigma(x):
+    if x == 1:
+        return float('inf')
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = np.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+import numpy as np
+import sqlite3
+import time
+
+from analytics.hll import HyperLogLog, hash_ints
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark HyperLogLog distinct active-user counts against exact COUNT(DISTINCT) '
+        'on a synthetic activity log held in an in-memory SQLite database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--users', type=int, default=200_000)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--precision', type=int, default=14)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rows, days = options['rows'], options['days']
+        rng = np.random.default_rng(options['seed'])
+
+        # Zipf-ish activity: a minority of users produce most of the log rows
+        user_ids = (rng.pareto(1.2, rows) * options['users'] / 20).astype(np.int64) % options['users']
+        log_days = rng.integers(0, days, rows)
+        self.stdout.write(f'Generated {rows:,} log rows for {options["users"]:,} users over {days} days.')
+
+        started = time.perf_counter()
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE log (day INTEGER, user_id INTEGER)')
+        db.executemany('INSERT INTO log VALUES (?, ?)', zip(log_days.tolist(), user_ids.tolist()))
+        db.execute('CREATE INDEX log_day_user ON log (day, user_id)')
+        self.stdout.write(f'Loaded and indexed SQLite table in {time.perf_counter() - started:.1f}s.')
+
+        started = time.perf_counter()
+        hashes = hash_ints(user_ids.astype(np.uint64))
+        order = np.argsort(log_days, kind='stable')
+        boundaries = np.searchsorted(log_days[order], np.arange(days + 1))
+        sketches = []
+        for day in range(days):
+            sketch = HyperLogLog(options['precision'])
+            sketch.add_hashes(hashes[order[boundaries[day]:boundaries[day + 1]]])
+            sketches.append(sketch)
+        build_time = time.perf_counter() - started
+        size = sum(len(sketch.to_bytes()) for sketch in sketches)
+        self.stdout.write(
+            f'Built {days} daily sketches in {build_time:.2f}s ({size / days / 1024:.1f} KiB/day compressed).'
+        )
+
+        self.stdout.write(f'\n{"range":>8} {"exact":>10} {"estimate":>10} {"error":>8} {"exact ms":>10} {"hll ms":>8}')
+        for span in sorted({1, 7, 30, days} & set(range(1, days + 1))):
+            first = days - span
+            started = time.perf_counter()
+            exact = db.execute(
+                'SELECT COUNT(DISTINCT user_id) FROM log WHERE day BETWEEN ? AND ?', (first, days - 1)
+            ).fetchone()[0]
+            exact_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            merged = HyperLogLog(options['precision'])
+            for sketch in sketches[first:]:
+                # Round-trip through the stored encoding, as the API does
+                merged.merge(HyperLogLog.from_bytes(sketch.to_bytes(), options['precision']))
+            estimate = merged.count()
+            hll_ms = (time.perf_counter() - started) * 1000
+
+            error = (estimate - exact) / exact * 100 if exact else 0.0
+            self.stdout.write(
+                f'{span:>6}d {exact:>10,} {estimate:>10,} {error:>7.2f}% {exact_ms:>10.1f} {hll_ms:>8.1f}'
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import datetime, timedelta
+
+from analytics.services import ActiveUserSketchService
+
+
+class Command(BaseCommand):
+    help = 'Build per-day HyperLogLog sketches of active users from UserActivityLog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Last day to build (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--days', type=int, default=2, help='Number of days to build, walking backwards.')
+
+    def handle(self, *args, **options):
+        day = timezone.localdate()
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+
+        total = 0
+        for offset in range(max(options['days'], 1)):
+            total += ActiveUserSketchService.build_day(day - timedelta(days=offset))
+
+        self.stdout.write(self.style.SUCCESS(f'Built {total} active user sketches.'))
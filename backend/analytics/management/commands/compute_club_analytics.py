@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import datetime
+
+from analytics.services import ClubAnalyticsService
+
+
+class Command(BaseCommand):
+    help = 'Materialize per-club ClubAnalytics rows for completed periods (run from a scheduler).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period', choices=['daily', 'weekly', 'monthly'], default='daily',
+            help='Period granularity to compute.'
+        )
+        parser.add_argument(
+            '--date', help='Compute the last complete period before this date (YYYY-MM-DD). Defaults to today.'
+        )
+        parser.add_argument(
+            '--backfill', type=int, default=1,
+            help='Number of consecutive periods to compute, walking backwards.'
+        )
+
+    def handle(self, *args, **options):
+        period_type = options['period']
+        reference = timezone.now()
+        if options['date']:
+            try:
+                date = datetime.strptime(options['date'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+            reference = timezone.make_aware(date)
+
+        total = 0
+        for _ in range(max(options['backfill'], 1)):
+            period_start, period_end = ClubAnalyticsService.period_bounds(period_type, reference)
+            total += ClubAnalyticsService.materialize(period_type, period_start, period_end)
+            reference = period_start
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} {period_type} club analytics rows.'))
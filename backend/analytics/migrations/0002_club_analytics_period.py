@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        ('clubs', '0003_auto_20260127_1818'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clubanalytics',
+            name='period_type',
+            field=models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], default='daily', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='clubanalytics',
+            constraint=models.UniqueConstraint(fields=('club', 'period_type', 'period_start'), name='unique_club_analytics_period'),
+        ),
+    ]
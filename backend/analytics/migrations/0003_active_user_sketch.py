@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:03
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_club_analytics_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveUserSketch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('dimension', models.CharField(choices=[('all', 'All Users'), ('department', 'Department'), ('role', 'Role')], default='all', max_length=20)),
+                ('dimension_value', models.CharField(blank=True, default='', max_length=100)),
+                ('precision', models.SmallIntegerField(default=14)),
+                ('registers', models.BinaryField()),
+                ('log_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['date'],
+                'indexes': [models.Index(fields=['dimension', 'date'], name='analytics_a_dimensi_1b87dc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'dimension', 'dimension_value'), name='unique_active_user_sketch')],
+            },
+        ),
+    ]
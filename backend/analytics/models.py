@@ -56,8 +56,15 @@ class AnalyticsSnapshot(models.Model):
         return f"{self.snapshot_type} analytics for {self.period_end.date()}"
 
 class ClubAnalytics(models.Model):
+    PERIOD_TYPES = (
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+    )
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     club = models.ForeignKey('clubs.Club', on_delete=models.CASCADE, related_name='analytics')
+    period_type = models.CharField(max_length=20, choices=PERIOD_TYPES, default='daily')
     period_start = models.DateTimeField()
     period_end = models.DateTimeField()
     
@@ -87,6 +94,13 @@ class ClubAnalytics(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
+        constraints = [
+            # Lets the materialization job upsert a whole period in one statement
+            models.UniqueConstraint(
+                fields=['club', 'period_type', 'period_start'],
+                name='unique_club_analytics_period'
+            ),
+        ]
         indexes = [
             models.Index(fields=['club', 'period_end']),
         ]
@@ -122,4 +136,38 @@ class UserActivity(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.user.email} activity on {self.date}"
\ No newline at end of file
+        return f"{self.user.email} activity on {self.date}"
+
+class ActiveUserSketch(models.Model):
+    """Per-day HyperLogLog sketch of distinct users in UserActivityLog."""
+    DIMENSIONS = (
+        ('all', 'All Users'),
+        ('department', 'Department'),
+        ('role', 'Role'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    date = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSIONS, default='all')
+    dimension_value = models.CharField(max_length=100, blank=True, default='')
+    precision = models.SmallIntegerField(default=14)
+    registers = models.BinaryField()  # zlib-compressed HLL registers
+    log_count = models.IntegerField(default=0)  # Activity log rows folded into the sketch
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'dimension', 'dimension_value'],
+                name='unique_active_user_sketch'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['dimension', 'date']),
+        ]
+        ordering = ['date']
+    
+    def __str__(self):
+        return f"Active users ({self.dimension}={self.dimension_value or '*'}) on {self.date}"
\ No newline at end of file
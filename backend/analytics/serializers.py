@@ -24,7 +24,7 @@ class ClubAnalyticsSerializer(serializers.ModelSerializer):
     class Meta:
         model = ClubAnalytics
         fields = [
-            'id', 'club', 'period_start', 'period_end',
+            'id', 'club', 'period_type', 'period_start', 'period_end',
             'total_members', 'new_members', 'members_by_role',
             'events_hosted', 'event_registrations', 'avg_event_rating',
             'resources_booked', 'booking_hours', 'budget_allocated',
@@ -33,6 +33,20 @@ class ClubAnalyticsSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at']
 
+class ClubAnalyticsPeriodSerializer(serializers.ModelSerializer):
+    """Materialized ClubAnalytics row without the nested club, for per-club series."""
+    class Meta:
+        model = ClubAnalytics
+        fields = [
+            'period_type', 'period_start', 'period_end',
+            'total_members', 'new_members', 'members_by_role',
+            'events_hosted', 'event_registrations', 'avg_event_rating',
+            'resources_booked', 'booking_hours', 'budget_allocated',
+            'budget_used', 'member_engagement', 'announcement_views',
+            'document_downloads'
+        ]
+        read_only_fields = fields
+
 class UserActivitySerializer(serializers.ModelSerializer):
     user = UserProfileSerializer(read_only=True)
     
@@ -0,0 +1,264 @@
+from django.utils import timezone
+from django.db.models import Count, Sum, Avg, F, DurationField, ExpressionWrapper
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import islice
+import logging
+import numpy as np
+
+from .models import ClubAnalytics, ActiveUserSketch
+from .hll import HyperLogLog, hash_uuids, DEFAULT_PRECISION
+from users.models import ClubMembership, UserActivityLog
+from clubs.models import Club
+from events.models import Event, EventRegistration, EventFeedback
+from resources.models import ResourceBooking
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_MEMBER_ROLES = ['head', 'coordinator', 'member']
+ACTIVE_BOOKING_STATUSES = ['approved', 'confirmed', 'ongoing', 'completed']
+
+
+class ClubAnalyticsService:
+    METRIC_FIELDS = [
+        'period_end', 'total_members', 'new_members', 'members_by_role',
+        'events_hosted', 'event_registrations', 'avg_event_rating',
+        'resources_booked', 'booking_hours', 'budget_allocated', 'budget_used',
+        'member_engagement', 'announcement_views', 'document_downloads',
+        'created_at',
+    ]
+
+    @staticmethod
+    def period_bounds(period_type, reference=None):
+        """
+        Return the (start, end) of the last complete period before `reference`.
+        Bounds are aware datetimes in the current timezone; end is exclusive.
+        """
+        reference = reference or timezone.now()
+        day = timezone.localtime(reference).date()
+
+        if period_type == 'daily':
+            end = day
+            start = end - timedelta(days=1)
+        elif period_type == 'weekly':
+            end = day - timedelta(days=day.weekday())
+            start = end - timedelta(days=7)
+        elif period_type == 'monthly':
+            end = day.replace(day=1)
+            start = (end - timedelta(days=1)).replace(day=1)
+        else:
+            raise ValueError(f"Unknown period type: {period_type}")
+
+        return (
+            timezone.make_aware(datetime.combine(start, datetime.min.time())),
+            timezone.make_aware(datetime.combine(end, datetime.min.time())),
+        )
+
+    @staticmethod
+    def engagement_score(members, events, registrations, capacity, avg_rating):
+        """Engagement score (0-100), same weighting as the live club_performance view."""
+        score = min(members / 10, 30)
+        score += min(events * 3, 30)
+        if capacity:
+            score += min((registrations / capacity) * 100 / 5, 20)
+        score += (avg_rating or 0) * 4
+        return round(min(score, 100), 2)
+
+    @staticmethod
+    def compute(period_type, period_start, period_end):
+        """
+        Build (unsaved) ClubAnalytics rows for every club for one period.
+        Each metric is a single grouped query over the whole table rather
+        than one query per club.
+        """
+        clubs = Club.objects.filter(created_at__lt=period_end).values_list('id', flat=True)
+
+        members_by_role = {}
+        for row in ClubMembership.objects.filter(
+            joined_at__lt=period_end
+        ).values('club_id', 'role').annotate(count=Count('id')):
+            members_by_role.setdefault(row['club_id'], {})[row['role']] = row['count']
+
+        new_members = dict(ClubMembership.objects.filter(
+            joined_at__gte=period_start,
+            joined_at__lt=period_end,
+            role__in=ACTIVE_MEMBER_ROLES
+        ).values_list('club_id').annotate(count=Count('id')))
+
+        period_events = Event.objects.filter(
+            start_datetime__gte=period_start,
+            start_datetime__lt=period_end
+        )
+        event_stats = {
+            row['primary_club_id']: row
+            for row in period_events.values('primary_club_id').annotate(
+                count=Count('id'),
+                capacity=Sum('max_participants'),
+                allocated=Sum('budget_allocated'),
+                used=Sum('budget_used'),
+            )
+        }
+
+        registrations = dict(EventRegistration.objects.filter(
+            event__in=period_events,
+            status__in=['registered', 'attended']
+        ).values_list('event__primary_club_id').annotate(count=Count('id')))
+
+        ratings = dict(EventFeedback.objects.filter(
+            event__in=period_events
+        ).values_list('event__primary_club_id').annotate(avg=Avg('rating')))
+
+        booking_stats = {
+            row['club_id']: row
+            for row in ResourceBooking.objects.filter(
+                club__isnull=False,
+                start_time__gte=period_start,
+                start_time__lt=period_end,
+                status__in=ACTIVE_BOOKING_STATUSES
+            ).values('club_id').annotate(
+                count=Count('id'),
+                duration=Sum(ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())),
+            )
+        }
+
+        now = timezone.now()
+        rows = []
+        for club_id in clubs:
+            roles = members_by_role.get(club_id, {})
+            total_members = sum(roles.get(role, 0) for role in ACTIVE_MEMBER_ROLES)
+            events = event_stats.get(club_id, {})
+            bookings = booking_stats.get(club_id, {})
+            club_registrations = registrations.get(club_id, 0)
+            avg_rating = ratings.get(club_id) or 0.0
+            duration = bookings.get('duration') or timedelta()
+
+            rows.append(ClubAnalytics(
+                club_id=club_id,
+                period_type=period_type,
+                period_start=period_start,
+                period_end=period_end,
+                total_members=total_members,
+                new_members=new_members.get(club_id, 0),
+                members_by_role=roles,
+                events_hosted=events.get('count', 0),
+                event_registrations=club_registrations,
+                avg_event_rating=round(float(avg_rating), 2),
+                resources_booked=bookings.get('count', 0),
+                booking_hours=round(duration.total_seconds() / 3600, 2),
+                budget_allocated=events.get('allocated') or Decimal('0.00'),
+                budget_used=events.get('used') or Decimal('0.00'),
+                member_engagement=ClubAnalyticsService.engagement_score(
+                    total_members,
+                    events.get('count', 0),
+                    club_registrations,
+                    events.get('capacity') or 0,
+                    avg_rating,
+                ),
+                created_at=now,
+            ))
+
+        return rows
+
+    @staticmethod
+    def materialize(period_type, period_start, period_end, batch_size=500):
+        """Compute and upsert one period of ClubAnalytics. Returns the number of rows written."""
+        rows = ClubAnalyticsService.compute(period_type, period_start, period_end)
+        ClubAnalytics.objects.bulk_create(
+            rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['club', 'period_type', 'period_start'],
+            update_fields=ClubAnalyticsService.METRIC_FIELDS,
+        )
+        logger.info(f"Materialized {len(rows)} {period_type} club analytics rows for {period_start.date()}")
+        return len(rows)
+
+
+
+class ActiveUserSketchService:
+    GROUP_DIMENSIONS = {'department': 'user__department', 'role': 'user__role'}
+
+    @staticmethod
+    def build_day(day, chunk_size=50000, precision=DEFAULT_PRECISION):
+        """
+        (Re)build the HyperLogLog sketches for one day of UserActivityLog:
+        one for all users plus one per department and per role. Idempotent.
+        """
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        logs = UserActivityLog.objects.filter(
+            created_at__gte=start,
+            created_at__lt=start + timedelta(days=1)
+        ).values_list('user_id', *ActiveUserSketchService.GROUP_DIMENSIONS.values()).iterator(chunk_size=chunk_size)
+
+        sketches = {('all', ''): HyperLogLog(precision)}
+        log_counts = {('all', ''): 0}
+        while True:
+            chunk = list(islice(logs, chunk_size))
+            if not chunk:
+                break
+            hashes = hash_uuids([row[0] for row in chunk])
+            sketches[('all', '')].add_hashes(hashes)
+            log_counts[('all', '')] += len(chunk)
+
+            for column, dimension in enumerate(ActiveUserSketchService.GROUP_DIMENSIONS, start=1):
+                values, groups = np.unique(
+                    np.array([row[column] or '' for row in chunk], dtype=object), return_inverse=True
+                )
+                for group, value in enumerate(values):
+                    key = (dimension, value)
+                    mask = groups == group
+                    sketches.setdefault(key, HyperLogLog(precision)).add_hashes(hashes[mask])
+                    log_counts[key] = log_counts.get(key, 0) + int(mask.sum())
+
+        now = timezone.now()
+        ActiveUserSketch.objects.bulk_create(
+            [
+                ActiveUserSketch(
+                    date=day,
+                    dimension=dimension,
+                    dimension_value=value,
+                    precision=precision,
+                    registers=sketch.to_bytes(),
+                    log_count=log_counts[(dimension, value)],
+                    updated_at=now,
+                )
+                for (dimension, value), sketch in sketches.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['date', 'dimension', 'dimension_value'],
+            update_fields=['precision', 'registers', 'log_count', 'updated_at'],
+        )
+        return len(sketches)
+
+    @staticmethod
+    def estimate(start_date, end_date, dimension='all', buckets=None):
+        """
+        Approximate distinct active users between two dates (inclusive) by
+        merging stored daily sketches. Returns {dimension_value: count}, or
+        {dimension_value: [count per bucket]} when `buckets` (a sorted
+        datetime64[D] array of bucket start dates) is given.
+        """
+        sketches = ActiveUserSketch.objects.filter(
+            dimension=dimension,
+            date__range=[start_date, end_date]
+        ).values_list('date', 'dimension_value', 'precision', 'registers')
+
+        merged = {}
+        for date, value, precision, registers in sketches:
+            slot = 0
+            if buckets is not None:
+                slot = int(np.searchsorted(buckets, np.datetime64(date, 'D'), side='right')) - 1
+            sketch = HyperLogLog.from_bytes(registers, precision)
+            key = (value or ('all' if dimension == 'all' else 'unspecified'), slot)
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = sketch
+
+        if buckets is None:
+            return {value: sketch.count() for (value, _), sketch in merged.items()}
+
+        results = {}
+        for (value, slot), sketch in merged.items():
+            results.setdefault(value, [0] * len(buckets))[slot] = sketch.count()
+        return results
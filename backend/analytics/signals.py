@@ -0,0 +1,50 @@
+from django.db.models.signals import post_save, post_delete
+
+from .cache import bump_watermark
+from users.models import User, UserActivityLog
+from events.models import Event, EventRegistration, EventFeedback
+from resources.models import ResourceBooking
+
+# Trends only count row creation, so updates don't move the watermark
+TREND_MODELS = (User, Event, EventRegistration, ResourceBooking)
+
+# Cohorts only count signups and activity rows, so only creation moves them
+COHORT_MODELS = (User, EventRegistration, ResourceBooking)
+
+# Distributions read mutable columns (start times, check-ins), so any write moves it
+DISTRIBUTION_MODELS = (Event, EventRegistration, ResourceBooking, EventFeedback)
+
+
+def bump_trends_watermark(sender, created=True, **kwargs):
+    if created:
+        bump_watermark('trends')
+
+
+def bump_distributions_watermark(sender, **kwargs):
+    bump_watermark('distributions')
+
+
+def bump_cohorts_watermark(sender, created=True, **kwargs):
+    if created:
+        bump_watermark('cohorts')
+
+
+def bump_activity_logs_watermark(sender, created=True, **kwargs):
+    if created:
+        bump_watermark('activity_logs')
+
+
+for model in TREND_MODELS:
+    post_save.connect(bump_trends_watermark, sender=model, dispatch_uid=f'trends_save_{model.__name__}')
+    post_delete.connect(bump_trends_watermark, sender=model, dispatch_uid=f'trends_delete_{model.__name__}')
+
+for model in DISTRIBUTION_MODELS:
+    post_save.connect(bump_distributions_watermark, sender=model, dispatch_uid=f'distributions_save_{model.__name__}')
+    post_delete.connect(bump_distributions_watermark, sender=model, dispatch_uid=f'distributions_delete_{model.__name__}')
+
+for model in COHORT_MODELS:
+    post_save.connect(bump_cohorts_watermark, sender=model, dispatch_uid=f'cohorts_save_{model.__name__}')
+    post_delete.connect(bump_cohorts_watermark, sender=model, dispatch_uid=f'cohorts_delete_{model.__name__}')
+
+post_save.connect(bump_activity_logs_watermark, sender=UserActivityLog, dispatch_uid='activity_logs_save')
+post_delete.connect(bump_activity_logs_watermark, sender=UserActivityLog, dispatch_uid='activity_logs_delete')
@@ -1,3 +1,498 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from rest_framework.test import APIClient
+from unittest import mock
+import numpy as np
 
-# Create your tests here.
+from clubs.models import Club
+from events.models import Event, EventFeedback, EventRegistration
+from resources.models import Resource, ResourceBooking
+from users.models import ClubMembership, User, UserActivityLog
+from . import views
+from .cache import bump_watermark, cached_result
+from .cohorts import retention_matrix
+from .counters import ActivityCounter
+from .distributions import StreamingDistribution, duration_distribution, duration_expression
+from .hll import HyperLogLog, hash_ints
+from .models import ActiveUserSketch, ClubAnalytics, UserActivity
+from .services import ActiveUserSketchService, ClubAnalyticsService
+from .timeseries import bucket_starts, gap_fill
+
+
+class ActivityCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='member@example.com', username='member')
+        # No flusher thread: tests flush explicitly
+        self.counter = ActivityCounter(flush_interval=0, max_pending_keys=10)
+
+    def activity(self):
+        return UserActivity.objects.get(user=self.user, date=timezone.localdate())
+
+    def test_increments_coalesce_into_one_upsert(self):
+        for _ in range(5):
+            self.counter.increment(self.user, 'event_views')
+        self.counter.increment(self.user, 'total_session_time', 120)
+        self.assertEqual(self.counter.stats()['pending_keys'], 1)
+        self.assertFalse(UserActivity.objects.exists())
+
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual((self.activity().event_views, self.activity().total_session_time), (5, 120))
+
+        self.counter.increment(self.user, 'event_views', 2)
+        self.counter.flush()
+        self.assertEqual(self.activity().event_views, 7)
+        self.assertEqual(UserActivity.objects.count(), 1)
+        self.assertEqual(self.counter.stats()['pending_increments'], 0)
+
+    def test_fallback_upsert_matches(self):
+        self.counter.increment(self.user, 'messages_sent', 3)
+        with mock.patch.object(self.counter, '_upsert_on_conflict', side_effect=AssertionError), \
+                mock.patch('analytics.counters.connection.vendor', 'mysql'):
+            self.counter.flush()
+            self.counter.increment(self.user, 'messages_sent')
+            self.counter.flush()
+        self.assertEqual(self.activity().messages_sent, 4)
+
+    def test_failed_flush_keeps_the_deltas(self):
+        self.counter.increment(self.user, 'login_count')
+        with mock.patch.object(self.counter, '_upsert', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('analytics.counters', 'ERROR'):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.stats()['failed_flushes'], 1)
+        self.counter.increment(self.user, 'login_count')
+        self.counter.flush()
+        self.assertEqual(self.activity().login_count, 2)
+
+    def test_pending_keys_stay_capped_while_flushes_fail(self):
+        users = [self.user] + [
+            User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(12)
+        ]
+        with mock.patch.object(self.counter, '_upsert', side_effect=RuntimeError('database is down')), \
+                self.assertLogs('analytics.counters', 'ERROR'):
+            for user in users:
+                self.counter.increment(user, 'event_views')
+                self.counter.flush()
+            self.counter.increment(self.user, 'event_views', 4)
+        stats = self.counter.stats()
+        self.assertEqual(stats['pending_keys'], 10)
+        self.assertEqual(stats['dropped_increments'], 3)
+
+        self.counter.flush()
+        self.assertEqual(self.activity().event_views, 5)
+        self.assertEqual(UserActivity.objects.count(), 10)
+
+    def test_anonymous_and_unknown_counters(self):
+        self.counter.increment(None, 'event_views')
+        self.assertEqual(self.counter.stats()['pending_keys'], 0)
+        with self.assertRaises(ValueError):
+            self.counter.increment(self.user, 'page_views')
+
+    def test_password_login_counts_once(self):
+        self.user.set_password('correct horse battery')
+        self.user.save()
+        with mock.patch('users.views.activity_counter', self.counter):
+            response = self.client.post(
+                '/api/auth/login/', {'email': self.user.email, 'password': 'correct horse battery'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.counter.flush()
+        self.assertEqual(self.activity().login_count, 1)
+
+
+class ClubAnalyticsTests(TestCase):
+    def setUp(self):
+        # The week of Monday 2026-03-02
+        self.start, self.end = ClubAnalyticsService.period_bounds(
+            'weekly', timezone.make_aware(datetime(2026, 3, 11, 12))
+        )
+        self.admin = User.objects.create(email='admin@example.com', username='admin', role='admin')
+        self.club = self.make_club('chess', self.start - timedelta(days=30))
+        self.quiet_club = self.make_club('go', self.start - timedelta(days=30))
+        # Created after the period: no row
+        self.make_club('later', self.end + timedelta(days=1))
+
+        for role, joined in [
+            ('head', self.start - timedelta(days=10)),
+            ('coordinator', self.start - timedelta(days=10)),
+            ('member', self.start + timedelta(days=1)),
+            ('member', self.start + timedelta(days=2)),
+            ('pending', self.start + timedelta(days=2)),
+            ('member', self.end + timedelta(hours=1)),
+        ]:
+            self.join(self.club, role, joined)
+
+        first = self.make_event(self.club, self.start + timedelta(days=1), 10, '100.00', '40.00')
+        second = self.make_event(self.club, self.start + timedelta(days=3), 20, '50.00', '10.00')
+        self.make_event(self.club, self.end + timedelta(days=1), 50, '500.00', '0.00')
+        for status in ['registered', 'registered', 'registered', 'cancelled']:
+            EventRegistration.objects.create(event=first, user=self.member(), status=status)
+        EventRegistration.objects.create(event=second, user=self.member(), status='attended')
+        for event, rating in [(first, 4), (first, 5), (second, 3)]:
+            EventFeedback.objects.create(event=event, user=self.member(), rating=rating)
+
+        resource = Resource.objects.create(name='Hall')
+        for status, hours in [('approved', 2), ('completed', 1.5), ('pending', 1)]:
+            start = self.start + timedelta(days=2)
+            ResourceBooking.objects.create(
+                resource=resource, user=self.admin, club=self.club, purpose='Meeting', status=status,
+                start_time=start, end_time=start + timedelta(hours=hours)
+            )
+
+    def make_club(self, slug, created_at):
+        return Club.objects.create(name=slug.title(), slug=slug, description='Club', created_at=created_at)
+
+    def member(self):
+        count = User.objects.count()
+        return User.objects.create(email=f'user{count}@example.com', username=f'user{count}')
+
+    def join(self, club, role, joined_at):
+        return ClubMembership.objects.create(club=club, user=self.member(), role=role, joined_at=joined_at)
+
+    def make_event(self, club, start, capacity, allocated, used):
+        return Event.objects.create(
+            title=f'Event at {start}', slug=f'event-{start:%Y%m%d%H%M}', description='Event', primary_club=club,
+            location='Hall', start_datetime=start, end_datetime=start + timedelta(hours=2),
+            max_participants=capacity, budget_allocated=Decimal(allocated), budget_used=Decimal(used),
+            created_by=self.admin
+        )
+
+    def test_metrics_match_the_fixtures(self):
+        self.assertEqual(ClubAnalyticsService.materialize('weekly', self.start, self.end), 2)
+        row = ClubAnalytics.objects.get(club=self.club)
+        self.assertEqual((row.period_start, row.period_end), (self.start, self.end))
+        self.assertEqual((row.total_members, row.new_members), (4, 2))
+        self.assertEqual(row.members_by_role, {'head': 1, 'coordinator': 1, 'member': 2, 'pending': 1})
+        self.assertEqual((row.events_hosted, row.event_registrations, row.avg_event_rating), (2, 4, 4.0))
+        self.assertEqual((row.resources_booked, row.booking_hours), (2, 3.5))
+        self.assertEqual((row.budget_allocated, row.budget_used), (Decimal('150.00'), Decimal('50.00')))
+        # 4 members -> 0.4, 2 events -> 6, 4 of 30 places -> 2.67, rating 4 -> 16
+        self.assertEqual(row.member_engagement, 25.07)
+
+        quiet = ClubAnalytics.objects.get(club=self.quiet_club)
+        self.assertEqual((quiet.total_members, quiet.events_hosted, quiet.booking_hours), (0, 0, 0.0))
+
+    def test_rerunning_a_period_updates_its_rows_in_place(self):
+        ClubAnalyticsService.materialize('weekly', self.start, self.end)
+        self.join(self.club, 'member', self.start + timedelta(days=4))
+        ClubAnalyticsService.materialize('weekly', self.start, self.end)
+        self.assertEqual(ClubAnalytics.objects.filter(period_type='weekly').count(), 2)
+        row = ClubAnalytics.objects.get(club=self.club)
+        self.assertEqual((row.total_members, row.new_members), (5, 3))
+
+    def test_query_count_does_not_grow_with_clubs(self):
+        with self.assertNumQueries(8):
+            ClubAnalyticsService.materialize('weekly', self.start, self.end)
+        for i in range(5):
+            club = self.make_club(f'club-{i}', self.start - timedelta(days=1))
+            self.join(club, 'member', self.start)
+            self.make_event(club, self.start + timedelta(hours=i + 1), 10, '0.00', '0.00')
+        with self.assertNumQueries(8):
+            self.assertEqual(ClubAnalyticsService.materialize('weekly', self.start, self.end), 7)
+
+    def test_club_endpoint_filters_on_period_end(self):
+        for days in range(3):
+            end = self.end - timedelta(days=days)
+            ClubAnalyticsService.materialize('daily', end - timedelta(days=1), end)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        # The two days up to the period end: their rows end at the following midnights
+        last_day = timezone.localtime(self.end).date() - timedelta(days=1)
+        response = client.get('/api/analytics/club/', {
+            'club_id': str(self.club.pk), 'period': 'daily',
+            'start_date': last_day - timedelta(days=1), 'end_date': last_day,
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [row['period_end'] for row in response.data['results']],
+            [(self.end - timedelta(days=1)).isoformat(), self.end.isoformat()]
+        )
+        response = client.get('/api/analytics/club/', {'club_id': str(self.club.pk), 'period': 'hourly'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TrendsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def aware(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_gap_fill_zeroes_empty_buckets(self):
+        buckets = bucket_starts(self.aware(2026, 3, 2, 9), self.aware(2026, 3, 6, 18), 'day')
+        self.assertEqual(len(buckets), 5)
+        rows = [
+            (self.aware(2026, 3, 2), 3),
+            (self.aware(2026, 3, 4), 2),
+            # Outside the axis: dropped
+            (self.aware(2026, 3, 9), 7),
+        ]
+        self.assertEqual(gap_fill(buckets, rows).tolist(), [3, 0, 2, 0, 0])
+        self.assertEqual(gap_fill(buckets, []).tolist(), [0] * 5)
+
+    def test_weeks_start_on_monday(self):
+        # 2026-03-04 is a Wednesday
+        buckets = bucket_starts(self.aware(2026, 3, 4), self.aware(2026, 3, 16), 'week')
+        self.assertEqual([str(bucket) for bucket in buckets.astype('datetime64[D]')], [
+            '2026-03-02', '2026-03-09', '2026-03-16'
+        ])
+
+    def test_cached_results_are_keyed_by_params_and_watermark(self):
+        compute = mock.Mock(side_effect=lambda: len(compute.mock_calls))
+        self.assertEqual(cached_result('trends', {'granularity': 'day'}, compute), 1)
+        self.assertEqual(cached_result('trends', {'granularity': 'day'}, compute), 1)
+        self.assertEqual(cached_result('trends', {'granularity': 'week'}, compute), 2)
+
+        bump_watermark('trends')
+        self.assertEqual(cached_result('trends', {'granularity': 'day'}, compute), 3)
+
+        combined = {'granularity': 'day'}
+        self.assertEqual(cached_result('cohorts', combined, compute, depends_on=['cohorts', 'trends']), 4)
+        bump_watermark('trends')
+        self.assertEqual(cached_result('cohorts', combined, compute, depends_on=['cohorts', 'trends']), 5)
+        bump_watermark('distributions')
+        self.assertEqual(cached_result('cohorts', combined, compute, depends_on=['cohorts', 'trends']), 5)
+
+    def trends(self):
+        today = timezone.localdate()
+        response = self.client.get('/api/analytics/trends/', {'start_date': today, 'end_date': today})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_related_writes_invalidate_cached_trends(self):
+        with mock.patch.object(views, 'grouped_counts', wraps=views.grouped_counts) as grouped_counts:
+            self.assertEqual(self.trends()['users'][0]['count'], 1)
+            self.trends()
+            self.assertEqual(grouped_counts.call_count, 4)
+
+            # Not a trend source
+            Club.objects.create(name='Chess', slug='chess', description='Chess club')
+            self.trends()
+            self.assertEqual(grouped_counts.call_count, 4)
+
+            user = User.objects.create(email='new@example.com', username='new')
+            self.assertEqual(self.trends()['users'][0]['count'], 2)
+            self.assertEqual(grouped_counts.call_count, 8)
+
+            # Trends count creations only, so updates keep the cached result
+            user.first_name = 'New'
+            user.save()
+            self.trends()
+            self.assertEqual(grouped_counts.call_count, 8)
+
+            user.delete()
+            self.assertEqual(self.trends()['users'][0]['count'], 1)
+            self.assertEqual(grouped_counts.call_count, 12)
+
+
+class StreamingDistributionTests(TestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(42).lognormal(1, 0.75, 20000)
+        self.edges = np.linspace(0, 20, 41)
+
+    def stream(self, sample_size, seed=0, chunk_size=3000):
+        distribution = StreamingDistribution(self.edges, sample_size=sample_size, seed=seed)
+        for start in range(0, len(self.values), chunk_size):
+            distribution.add(self.values[start:start + chunk_size])
+        return distribution
+
+    def test_histogram_matches_numpy_on_the_full_data(self):
+        summary = self.stream(sample_size=1000).summary()
+        # Values past the last edge are counted in the last bin
+        expected, _ = np.histogram(np.clip(self.values, 0, 20), bins=self.edges)
+        self.assertEqual(summary['histogram']['counts'], expected.tolist())
+        self.assertEqual(summary['count'], len(self.values))
+        self.assertAlmostEqual(summary['mean'], self.values.mean(), places=3)
+        self.assertEqual((summary['min'], summary['max']), (
+            round(self.values.min(), 4), round(self.values.max(), 4)
+        ))
+
+    def test_sample_is_bounded_and_seeded(self):
+        distribution = self.stream(sample_size=1000)
+        self.assertEqual(len(distribution._sample), 1000)
+        self.assertTrue(distribution.summary()['sampled'])
+        # Every sampled value comes from the data
+        self.assertTrue(np.isin(distribution._sample, self.values).all())
+
+        np.testing.assert_array_equal(np.sort(self.stream(1000)._sample), np.sort(distribution._sample))
+        self.assertEqual(self.stream(1000).summary(), distribution.summary())
+        self.assertNotEqual(self.stream(1000, seed=1).summary()['percentiles'], distribution.summary()['percentiles'])
+
+        # Estimated percentiles stay close to the exact ones
+        exact = np.percentile(self.values, [25, 50, 75])
+        estimated = [distribution.summary()['percentiles'][p] for p in ('p25', 'p50', 'p75')]
+        np.testing.assert_allclose(estimated, exact, rtol=0.1)
+
+    def test_percentiles_are_exact_while_everything_fits(self):
+        summary = self.stream(sample_size=len(self.values)).summary()
+        self.assertFalse(summary['sampled'])
+        self.assertEqual(summary['percentiles']['p90'], round(float(np.percentile(self.values, 90)), 4))
+        self.assertEqual(StreamingDistribution(self.edges).summary(), {'count': 0})
+
+    def test_duration_distribution_streams_query_rows(self):
+        user = User.objects.create(email='member@example.com', username='member')
+        resource = Resource.objects.create(name='Hall')
+        start = timezone.now()
+        for hours in (1, 2, 3):
+            ResourceBooking.objects.create(
+                resource=resource, user=user, purpose='Practice', status='approved',
+                start_time=start, end_time=start + timedelta(hours=hours)
+            )
+        summary = duration_distribution(
+            ResourceBooking.objects.all(), duration_expression('end_time', 'start_time'), bins=2, chunk_size=2
+        )
+        self.assertEqual(summary['histogram'], {'edges': [1.0, 2.0, 3.0], 'counts': [1, 2]})
+        self.assertEqual(summary['percentiles']['p50'], 2.0)
+
+
+class CohortTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(
+            email='admin@example.com', username='admin', role='admin', created_at=self.at(2025, 6)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        # January and March cohorts; nobody signs up in February
+        january = [self.signup(f'jan{i}', self.at(2026, 1)) for i in range(3)]
+        march = [self.signup(f'mar{i}', self.at(2026, 3)) for i in range(2)]
+
+        club = Club.objects.create(name='Chess', slug='chess', description='Chess club')
+        event = Event.objects.create(
+            title='Open', slug='open', description='Open', primary_club=club, location='Hall',
+            start_datetime=self.at(2026, 5), end_datetime=self.at(2026, 5, 16), created_by=self.admin
+        )
+        resource = Resource.objects.create(name='Hall')
+
+        # jan0 is active every month until March, through a different source each time
+        self.log(january[0], self.at(2026, 1, 20))
+        EventRegistration.objects.create(event=event, user=january[0], registered_at=self.at(2026, 2))
+        ResourceBooking.objects.create(
+            resource=resource, user=january[0], purpose='Practice', status='approved',
+            start_time=self.at(2026, 3), end_time=self.at(2026, 3, 16), created_at=self.at(2026, 3)
+        )
+        # jan1 shows up in February through two sources and several rows: counted once
+        self.log(january[1], self.at(2026, 2, 3))
+        self.log(january[1], self.at(2026, 2, 20))
+        EventRegistration.objects.create(event=event, user=january[1], registered_at=self.at(2026, 2))
+        # jan2 never comes back
+        self.log(march[0], self.at(2026, 3, 20))
+        self.log(march[0], self.at(2026, 4))
+        # Cancelled registrations don't count as activity
+        EventRegistration.objects.create(
+            event=event, user=march[1], status='cancelled', registered_at=self.at(2026, 4)
+        )
+
+    def at(self, year, month, day=15):
+        return timezone.make_aware(datetime(year, month, day, 12))
+
+    def signup(self, username, created_at):
+        return User.objects.create(email=f'{username}@example.com', username=username, created_at=created_at)
+
+    def log(self, user, created_at):
+        UserActivityLog.objects.create(user=user, action='LOGIN_SUCCESS', created_at=created_at)
+
+    def cohorts(self, **params):
+        response = self.client.get('/api/analytics/cohorts/', {'periods': 4, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['cohorts']
+
+    def test_retention_matrix_matches_the_fixture(self):
+        cohorts = self.cohorts(start_date='2026-01-01', end_date='2026-04-20')
+        self.assertEqual(cohorts, [
+            {'cohort': '2026-01', 'size': 3, 'active': [1, 2, 1, 0], 'retention': [0.3333, 0.6667, 0.3333, 0.0]},
+            # Periods after end_date are unknown rather than zero
+            {'cohort': '2026-03', 'size': 2, 'active': [1, 1, None, None], 'retention': [0.5, 0.5, None, None]},
+        ])
+
+    def test_sources_are_selectable(self):
+        cohorts = self.cohorts(start_date='2026-01-01', end_date='2026-04-20', sources='registrations')
+        self.assertEqual([cohort['active'] for cohort in cohorts], [[0, 2, 0, 0], [0, 0, None, None]])
+
+    def test_empty_cohorts(self):
+        # February alone has no signups
+        self.assertEqual(self.cohorts(start_date='2026-02-01', end_date='2026-02-28'), [])
+
+        first, sizes, active = retention_matrix([], [], 4)
+        self.assertIsNone(first)
+        self.assertEqual((sizes.tolist(), active.shape), ([], (0, 4)))
+
+        january, march = datetime(2026, 1, 1), datetime(2026, 3, 1)
+        first, sizes, active = retention_matrix(
+            [('a', january), ('b', march)], [('a', march), ('b', march), ('stranger', march)], 3
+        )
+        self.assertEqual(sizes.tolist(), [1, 0, 1])
+        self.assertEqual(active.tolist(), [[0, 0, 1], [0, 0, 0], [1, 0, 0]])
+
+
+class HyperLogLogTests(TestCase):
+    def sketch(self, start, stop, precision=14):
+        sketch = HyperLogLog(precision)
+        sketch.add_hashes(hash_ints(np.arange(start, stop)))
+        return sketch
+
+    def test_estimates_stay_within_the_standard_error(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEqual(self.sketch(0, 10).count(), 10)
+        for cardinality in (1000, 50000, 300000):
+            estimate = self.sketch(0, cardinality).count()
+            # 0.8% standard error at precision 14; allow four of them
+            self.assertLess(abs(estimate - cardinality) / cardinality, 0.032, (cardinality, estimate))
+
+    def test_duplicates_do_not_count(self):
+        sketch = self.sketch(0, 5000)
+        sketch.add_hashes(hash_ints(np.arange(0, 5000)))
+        self.assertEqual(sketch.count(), self.sketch(0, 5000).count())
+
+    def test_merge_is_the_union(self):
+        merged = self.sketch(0, 20000).merge(self.sketch(10000, 30000))
+        np.testing.assert_array_equal(merged.registers, self.sketch(0, 30000).registers)
+        with self.assertRaises(ValueError):
+            merged.merge(HyperLogLog(precision=10))
+
+    def test_round_trips_through_bytes(self):
+        sketch = self.sketch(0, 1234, precision=12)
+        restored = HyperLogLog.from_bytes(sketch.to_bytes(), precision=12)
+        self.assertEqual(restored.count(), sketch.count())
+
+
+class ActiveUserSketchTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        self.users = [
+            User.objects.create(
+                email=f'user{i}@example.com', username=f'user{i}',
+                department='Physics' if i % 2 else 'History', role='participant'
+            )
+            for i in range(6)
+        ]
+        noon = timezone.make_aware(datetime.combine(self.today, time(12)))
+        for i, user in enumerate(self.users):
+            # Everyone today, several times; the first three yesterday too
+            for _ in range(3):
+                UserActivityLog.objects.create(user=user, action='LOGIN_SUCCESS', created_at=noon)
+            if i < 3:
+                UserActivityLog.objects.create(user=user, action='LOGIN_SUCCESS', created_at=noon - timedelta(days=1))
+
+    def test_daily_sketches_merge_over_a_range(self):
+        self.assertEqual(ActiveUserSketchService.build_day(self.today), 4)
+        ActiveUserSketchService.build_day(self.yesterday)
+        # Rebuilding replaces rather than duplicates
+        ActiveUserSketchService.build_day(self.today)
+        self.assertEqual(ActiveUserSketch.objects.filter(date=self.today).count(), 4)
+        self.assertEqual(ActiveUserSketch.objects.get(date=self.today, dimension='all').log_count, 18)
+
+        self.assertEqual(ActiveUserSketchService.estimate(self.yesterday, self.yesterday), {'all': 3})
+        self.assertEqual(ActiveUserSketchService.estimate(self.yesterday, self.today), {'all': 6})
+        self.assertEqual(
+            ActiveUserSketchService.estimate(self.yesterday, self.today, 'department'), {'History': 3, 'Physics': 3}
+        )
+        buckets = np.array([self.yesterday, self.today], dtype='datetime64[D]')
+        self.assertEqual(ActiveUserSketchService.estimate(self.yesterday, self.today, buckets=buckets), {'all': [3, 6]})
@@ -0,0 +1,60 @@
+"""Bucketing and gap-filling for analytics time series."""
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.db.models import DateTimeField
+from django.utils import timezone
+import numpy as np
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 5000
+
+
+def _to_datetime64(values):
+    """Aware datetimes -> naive local datetime64[s], the space buckets are aligned in."""
+    return np.array(
+        [timezone.localtime(value).replace(tzinfo=None) for value in values],
+        dtype='datetime64[s]'
+    )
+
+
+def bucket_starts(start, end, granularity):
+    """
+    All bucket start times covering [start, end] as a datetime64[s] array,
+    aligned the same way the database truncates (weeks start on Monday).
+    """
+    first, last = _to_datetime64([start, end])
+
+    if granularity == 'hour':
+        return np.arange(first.astype('datetime64[h]'), last.astype('datetime64[h]') + 1).astype('datetime64[s]')
+    if granularity == 'day':
+        return np.arange(first.astype('datetime64[D]'), last.astype('datetime64[D]') + 1).astype('datetime64[s]')
+    if granularity == 'week':
+        first_day = first.astype('datetime64[D]')
+        # 1970-01-01 was a Thursday: shift so the week floors land on Mondays
+        monday = first_day - ((first_day.astype('int64') + 3) % 7)
+        return np.arange(monday, last.astype('datetime64[D]') + 1, 7).astype('datetime64[s]')
+    if granularity == 'month':
+        return np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1).astype('datetime64[s]')
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def grouped_counts(queryset, field, granularity):
+    """One grouped query: (bucket, count) rows for `queryset` truncated on `field`."""
+    return list(queryset.annotate(
+        bucket=Trunc(field, granularity, output_field=DateTimeField())
+    ).values_list('bucket').annotate(count=Count('pk')).order_by('bucket'))
+
+
+def gap_fill(buckets, rows):
+    """Scatter sparse (bucket, count) rows onto the dense `buckets` axis, zero elsewhere."""
+    series = np.zeros(len(buckets), dtype=np.int64)
+    if not rows:
+        return series
+
+    keys = _to_datetime64([bucket for bucket, _ in rows])
+    counts = np.fromiter((count for _, count in rows), dtype=np.int64, count=len(rows))
+    positions = np.searchsorted(buckets, keys)
+    in_range = positions < len(buckets)
+    in_range[in_range] &= buckets[positions[in_range]] == keys[in_range]
+    np.add.at(series, positions[in_range], counts[in_range])
+    return series
@@ -4,11 +4,15 @@ from rest_framework.response import Response
 from django.utils import timezone
 from datetime import timedelta, datetime
 from django.db.models import Count, Sum, Avg, Q, F
-from django.db.models.functions import TruncDate
 
-from .models import AnalyticsSnapshot, ClubAnalytics, UserActivity
+from .models import AnalyticsSnapshot, ClubAnalytics, UserActivity, ActiveUserSketch
+from .services import ActiveUserSketchService
+from .cache import cached_result
+from .timeseries import GRANULARITIES, MAX_BUCKETS, bucket_starts, grouped_counts, gap_fill
+from .distributions import duration_distribution, duration_expression, value_distribution
+from .cohorts import COHORT_SOURCES, retention_matrix, user_months
 from .serializers import (
-    AnalyticsSnapshotSerializer, ClubAnalyticsSerializer,
+    AnalyticsSnapshotSerializer, ClubAnalyticsSerializer, ClubAnalyticsPeriodSerializer,
     UserActivitySerializer, DateRangeSerializer
 )
 from users.models import User, ClubMembership
@@ -119,11 +123,18 @@ class AnalyticsViewSet(viewsets.GenericViewSet):
     
     @action(detail=False, methods=['get'])
     def trends(self, request):
-        """Get trends over time"""
+        """Get zero-filled trends over time (granularity=hour|day|week|month)"""
         serializer = DateRangeSerializer(data=request.query_params)
         if serializer.is_valid():
             start_date = serializer.validated_data.get('start_date')
             end_date = serializer.validated_data.get('end_date')
+            granularity = request.query_params.get('granularity', 'day')
+            
+            if granularity not in GRANULARITIES:
+                return Response(
+                    {'error': f'Invalid granularity. Use one of: {", ".join(GRANULARITIES)}.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             if not start_date:
                 start_date = timezone.now().date() - timedelta(days=30)
@@ -134,56 +145,240 @@ class AnalyticsViewSet(viewsets.GenericViewSet):
             start_datetime = timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
             end_datetime = timezone.make_aware(datetime.combine(end_date, datetime.max.time()))
             
-            # User trends
-            user_trends = User.objects.filter(
-                created_at__range=[start_datetime, end_datetime]
-            ).annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date')
+            buckets = bucket_starts(start_datetime, end_datetime, granularity)
+            if len(buckets) > MAX_BUCKETS:
+                return Response(
+                    {'error': f'Range too large for {granularity} granularity (max {MAX_BUCKETS} buckets).'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Event trends
-            event_trends = Event.objects.filter(
-                created_at__range=[start_datetime, end_datetime]
-            ).annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date')
+            def compute():
+                # One grouped query per metric, then a vectorized gap-fill onto the shared axis
+                series = {
+                    'users': gap_fill(buckets, grouped_counts(
+                        User.objects.filter(created_at__range=[start_datetime, end_datetime]),
+                        'created_at', granularity
+                    )),
+                    'events': gap_fill(buckets, grouped_counts(
+                        Event.objects.filter(created_at__range=[start_datetime, end_datetime]),
+                        'created_at', granularity
+                    )),
+                    'registrations': gap_fill(buckets, grouped_counts(
+                        EventRegistration.objects.filter(registered_at__range=[start_datetime, end_datetime]),
+                        'registered_at', granularity
+                    )),
+                    'bookings': gap_fill(buckets, grouped_counts(
+                        ResourceBooking.objects.filter(created_at__range=[start_datetime, end_datetime]),
+                        'created_at', granularity
+                    )),
+                }
+                labels = [str(bucket) for bucket in buckets.astype('datetime64[m]' if granularity == 'hour' else 'datetime64[D]')]
+                
+                trends_data = {
+                    name: [{'date': label, 'count': int(count)} for label, count in zip(labels, values)]
+                    for name, values in series.items()
+                }
+                trends_data['buckets'] = labels
+                trends_data['granularity'] = granularity
+                trends_data['date_range'] = {
+                    'start': start_date,
+                    'end': end_date
+                }
+                return trends_data
             
-            # Registration trends
-            registration_trends = EventRegistration.objects.filter(
-                registered_at__range=[start_datetime, end_datetime]
-            ).annotate(
-                date=TruncDate('registered_at')
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date')
+            return Response(cached_result(
+                'trends',
+                {'start': start_date, 'end': end_date, 'granularity': granularity},
+                compute
+            ))
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['get'])
+    def distributions(self, request):
+        """Get histograms and percentiles for lead times, booking durations, check-in delays and ratings"""
+        serializer = DateRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        start_date = serializer.validated_data.get('start_date') or timezone.now().date() - timedelta(days=90)
+        end_date = serializer.validated_data.get('end_date') or timezone.now().date()
+        club_id = serializer.validated_data.get('club_id')
+        try:
+            bins = min(max(int(request.query_params.get('bins', 20)), 1), 200)
+        except ValueError:
+            return Response({'error': 'bins must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        start_datetime = timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
+        end_datetime = timezone.make_aware(datetime.combine(end_date, datetime.max.time()))
+        
+        def compute():
+            registrations = EventRegistration.objects.filter(
+                registered_at__range=[start_datetime, end_datetime],
+                status__in=['registered', 'attended']
+            )
+            bookings = ResourceBooking.objects.filter(
+                start_time__range=[start_datetime, end_datetime],
+                status__in=['approved', 'confirmed', 'ongoing', 'completed']
+            )
+            feedback = EventFeedback.objects.filter(created_at__range=[start_datetime, end_datetime])
             
-            # Booking trends
-            booking_trends = ResourceBooking.objects.filter(
-                created_at__range=[start_datetime, end_datetime]
-            ).annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date')
+            if club_id:
+                registrations = registrations.filter(event__primary_club_id=club_id)
+                bookings = bookings.filter(club_id=club_id)
+                feedback = feedback.filter(event__primary_club_id=club_id)
             
-            trends_data = {
-                'users': list(user_trends),
-                'events': list(event_trends),
-                'registrations': list(registration_trends),
-                'bookings': list(booking_trends),
+            return {
+                'registration_lead_time_hours': duration_distribution(
+                    registrations, duration_expression('event__start_datetime', 'registered_at'), bins
+                ),
+                'booking_duration_hours': duration_distribution(
+                    bookings, duration_expression('end_time', 'start_time'), bins
+                ),
+                'checkin_delay_minutes': duration_distribution(
+                    bookings.filter(actual_start_time__isnull=False),
+                    duration_expression('actual_start_time', 'start_time'), bins, unit_seconds=60
+                ),
+                'feedback_rating': value_distribution(feedback, 'rating', [0.5, 1.5, 2.5, 3.5, 4.5, 5.5]),
                 'date_range': {
                     'start': start_date,
                     'end': end_date
                 }
             }
+        
+        return Response(cached_result(
+            'distributions',
+            {'start': start_date, 'end': end_date, 'club_id': club_id, 'bins': bins},
+            compute
+        ))
+    
+    @action(detail=False, methods=['get'])
+    def active_users(self, request):
+        """Get approximate distinct active users from HyperLogLog sketches (group_by=department|role)"""
+        serializer = DateRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        start_date = serializer.validated_data.get('start_date') or timezone.now().date() - timedelta(days=30)
+        end_date = serializer.validated_data.get('end_date') or timezone.now().date()
+        group_by = request.query_params.get('group_by', 'all')
+        granularity = request.query_params.get('granularity')
+        
+        if group_by not in dict(ActiveUserSketch.DIMENSIONS):
+            return Response(
+                {'error': 'Invalid group_by. Use all, department or role.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if granularity not in (None, 'day', 'week', 'month'):
+            return Response(
+                {'error': 'Invalid granularity. Use day, week or month.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        data = {
+            'group_by': group_by,
+            'date_range': {
+                'start': start_date,
+                'end': end_date
+            },
+            'approximate': True
+        }
+        
+        if granularity:
+            buckets = bucket_starts(
+                timezone.make_aware(datetime.combine(start_date, datetime.min.time())),
+                timezone.make_aware(datetime.combine(end_date, datetime.min.time())),
+                granularity
+            ).astype('datetime64[D]')
+            data['granularity'] = granularity
+            data['buckets'] = [str(bucket) for bucket in buckets]
+            data['results'] = ActiveUserSketchService.estimate(start_date, end_date, group_by, buckets)
+        else:
+            data['results'] = ActiveUserSketchService.estimate(start_date, end_date, group_by)
+        
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def cohorts(self, request):
+        """Get monthly signup cohorts and the share still registering, booking or active N months later"""
+        serializer = DateRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        end_date = serializer.validated_data.get('end_date') or timezone.now().date()
+        start_date = serializer.validated_data.get('start_date') or (end_date - timedelta(days=365)).replace(day=1)
+        role = request.query_params.get('role')
+        sources = [s for s in request.query_params.get('sources', ','.join(COHORT_SOURCES)).split(',') if s]
+        try:
+            periods = min(max(int(request.query_params.get('periods', 12)), 1), 36)
+        except ValueError:
+            return Response({'error': 'periods must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not sources or any(source not in COHORT_SOURCES for source in sources):
+            return Response(
+                {'error': f"Invalid sources. Use a comma-separated subset of {', '.join(COHORT_SOURCES)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        start_datetime = timezone.make_aware(datetime.combine(start_date.replace(day=1), datetime.min.time()))
+        end_datetime = timezone.make_aware(datetime.combine(end_date, datetime.max.time()))
+        
+        def compute():
+            users = User.objects.filter(created_at__range=[start_datetime, end_datetime])
+            if role:
+                users = users.filter(role=role)
             
-            return Response(trends_data)
+            activity = []
+            for source in sources:
+                model, time_field, filters = COHORT_SOURCES[source]
+                activity.extend(user_months(
+                    model.objects.filter(
+                        user__in=users.values('id'),
+                        **{f'{time_field}__gte': start_datetime},
+                        **filters
+                    ),
+                    'user_id',
+                    time_field
+                ))
+            
+            first_cohort, sizes, active = retention_matrix(
+                user_months(users, 'id', 'created_at'), activity, periods
+            )
+            
+            cohorts = []
+            for row, size in enumerate(sizes):
+                if not size:
+                    continue
+                year, month = divmod(first_cohort + row + 1970 * 12, 12)
+                cohort_start = datetime(year, month + 1, 1)
+                # Periods that haven't happened yet are reported as null rather than 0% retention
+                elapsed = (end_date.year - year) * 12 + end_date.month - (month + 1) + 1
+                cohorts.append({
+                    'cohort': cohort_start.strftime('%Y-%m'),
+                    'size': int(size),
+                    'active': [int(count) if period < elapsed else None for period, count in enumerate(active[row])],
+                    'retention': [
+                        round(float(count) / size, 4) if period < elapsed else None
+                        for period, count in enumerate(active[row])
+                    ],
+                })
+            
+            return {
+                'cohorts': cohorts,
+                'periods': periods,
+                'sources': sources,
+                'date_range': {
+                    'start': start_date,
+                    'end': end_date
+                }
+            }
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_result(
+            'cohorts',
+            {'start': start_date, 'end': end_date, 'periods': periods, 'sources': sorted(sources), 'role': role},
+            compute,
+            depends_on=['cohorts', 'activity_logs'] if 'logs' in sources else ['cohorts']
+        ))
     
     @action(detail=False, methods=['get'])
     def club_performance(self, request):
@@ -234,6 +429,66 @@ class AnalyticsViewSet(viewsets.GenericViewSet):
         
         return Response(performance_data)
     
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def club(self, request):
+        """Get materialized analytics for one club (admins and club heads/coordinators)"""
+        serializer = DateRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        club_id = serializer.validated_data.get('club_id')
+        if not club_id:
+            return Response(
+                {'error': 'club_id is required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        period_type = request.query_params.get('period', 'daily')
+        if period_type not in dict(ClubAnalytics.PERIOD_TYPES):
+            return Response(
+                {'error': 'Invalid period. Use daily, weekly or monthly.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        club = Club.objects.filter(id=club_id).first()
+        if not club:
+            return Response({'error': 'Club not found.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if request.user.role != 'admin' and not ClubMembership.objects.filter(
+            club=club,
+            user=request.user,
+            role__in=['head', 'coordinator']
+        ).exists():
+            return Response(
+                {'error': 'Only club heads and coordinators can view club analytics.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        start_date = serializer.validated_data.get('start_date') or timezone.now().date() - timedelta(days=30)
+        end_date = serializer.validated_data.get('end_date') or timezone.now().date()
+        
+        # Only read materialized rows; served by the (club, period_end) index
+        rows = ClubAnalytics.objects.filter(
+            club=club,
+            period_end__gt=timezone.make_aware(datetime.combine(start_date, datetime.min.time())),
+            period_end__lte=timezone.make_aware(datetime.combine(end_date + timedelta(days=1), datetime.min.time())),
+            period_type=period_type
+        ).order_by('period_end')
+        
+        return Response({
+            'club': {
+                'id': str(club.id),
+                'name': club.name,
+                'slug': club.slug
+            },
+            'period': period_type,
+            'date_range': {
+                'start': start_date,
+                'end': end_date
+            },
+            'results': ClubAnalyticsPeriodSerializer(rows, many=True).data
+        })
+    
     @action(detail=False, methods=['get'])
     def resource_utilization(self, request):
         """Get resource utilization analytics"""
@@ -13,6 +13,8 @@ from .serializers import (
 )
 from users.models import ClubMembership, User
 from users.permissions import IsAdmin, IsOrganizer
+from analytics.counters import activity_counter
+from notifications.mailer import background_mailer, build_message, render_email
 
 class ClubViewSet(viewsets.ModelViewSet):
     queryset = Club.objects.all()
@@ -192,8 +194,16 @@ class ClubViewSet(viewsets.ModelViewSet):
                 expires_at=expires_at
             )
             
-            # TODO: Send invitation email
             invitation_url = f"{request.build_absolute_uri('/')}api/clubs/invitations/accept/{token}"
+            if invitation_type == 'email':
+                text, html = render_email('club_invitation', {
+                    'club': club.name,
+                    'invited_by': request.user.get_full_name() or request.user.username,
+                    'role': invitation.get_role_display(),
+                    'invitation_url': invitation_url,
+                    'expires_at': expires_at,
+                })
+                background_mailer.send(build_message(f'Invitation to join {club.name}', text, email, html))
             
             return Response({
                 'message': 'Invitation sent successfully.',
@@ -223,6 +233,7 @@ class ClubViewSet(viewsets.ModelViewSet):
             )
         
         announcements = club.announcements.all().order_by('-created_at')
+        activity_counter.increment(user, 'announcements_viewed')
         serializer = ClubAnnouncementSerializer(announcements, many=True)
         return Response(serializer.data)
     
@@ -5,6 +5,7 @@ Django settings for campus_management project.
 from pathlib import Path
 from decouple import config
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -72,6 +73,35 @@ TEMPLATES = [
 
 ASGI_APPLICATION = 'config.asgi.application'
 
+# Channel layer for websocket push. The in-memory layer only reaches consumers in the
+# same process; set CHANNEL_REDIS_URL when the API and the ASGI server run separately
+CHANNEL_REDIS_URL = config('CHANNEL_REDIS_URL', default='')
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+# Cache for analytics results and notification preferences. The local-memory fallback is
+# per process, so invalidations don't reach other workers; set CACHE_REDIS_URL to share it
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# How long a process may serve analytics results cached before another process's write,
+# when the cache is not shared
+ANALYTICS_LOCAL_CACHE_TIMEOUT = config('ANALYTICS_LOCAL_CACHE_TIMEOUT', default=60, cast=int)
+
 # MongoDB Configuration
 DATABASES = {
     'default': {
@@ -118,6 +148,61 @@ EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default=EMAIL_HOST_USER or 'webmaster@localhost')
+
+# Batched email: messages per SMTP connection, max messages/second (0 = unthrottled),
+# whether OTP/invitation mail is handed to a background thread, how many messages may
+# wait for it, and seconds before a stalled SMTP operation is abandoned
+NOTIFICATION_EMAIL_BATCH_SIZE = config('NOTIFICATION_EMAIL_BATCH_SIZE', default=100, cast=int)
+NOTIFICATION_EMAIL_RATE = config('NOTIFICATION_EMAIL_RATE', default=0, cast=float)
+EMAIL_SEND_IN_BACKGROUND = config('EMAIL_SEND_IN_BACKGROUND', default=True, cast=bool)
+NOTIFICATION_EMAIL_QUEUE_SIZE = config('NOTIFICATION_EMAIL_QUEUE_SIZE', default=1000, cast=int)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)
+
+# Write-behind UserActivity counters (seconds between flushes, 0 = no background flusher /
+# most pending user-days held in memory). Tests flush explicitly, so `manage.py test` runs without the flusher
+TESTING = sys.argv[1:2] == ['test']
+ACTIVITY_COUNTER_FLUSH_INTERVAL = config('ACTIVITY_COUNTER_FLUSH_INTERVAL', default=0 if TESTING else 10, cast=int)
+ACTIVITY_COUNTER_MAX_PENDING = config('ACTIVITY_COUNTER_MAX_PENDING', default=5000, cast=int)
+
+# Notification preferences: channels used when a user has no row for a type/channel,
+# how long each process may serve its local copy after a change elsewhere, and how long
+# entries live in the shared cache (only used when CACHE_REDIS_URL makes it shared)
+NOTIFICATION_DEFAULT_CHANNELS = ['in_app']
+NOTIFICATION_PREFERENCE_LOCAL_TTL = config('NOTIFICATION_PREFERENCE_LOCAL_TTL', default=30, cast=int)
+NOTIFICATION_PREFERENCE_SHARED_TIMEOUT = config('NOTIFICATION_PREFERENCE_SHARED_TIMEOUT', default=3600, cast=int)
+
+# Notification outbox: per-channel delivery backends (email via EMAIL_BACKEND, others log only) and retry limit
+NOTIFICATION_CHANNEL_BACKENDS = {}
+NOTIFICATION_DELIVERY_MAX_ATTEMPTS = config('NOTIFICATION_DELIVERY_MAX_ATTEMPTS', default=5, cast=int)
+# Local hour at which daily notification digests go out
+NOTIFICATION_DIGEST_DAILY_HOUR = config('NOTIFICATION_DIGEST_DAILY_HOUR', default=8, cast=int)
+
+# Reminder offsets in minutes before the start, for users who haven't chosen their own
+NOTIFICATION_REMINDER_OFFSETS = {'event_reminder': [60], 'booking_reminder': [30]}
+
+# Notification retention (purge_notifications)
+NOTIFICATION_READ_RETENTION_DAYS = config('NOTIFICATION_READ_RETENTION_DAYS', default=30, cast=int)
+NOTIFICATION_PURGE_BATCH_SIZE = config('NOTIFICATION_PURGE_BATCH_SIZE', default=1000, cast=int)
+# Days deletions stay visible to delta sync; older client cursors get a full reset
+NOTIFICATION_SYNC_TOMBSTONE_DAYS = config('NOTIFICATION_SYNC_TOMBSTONE_DAYS', default=30, cast=int)
+
+# Typing indicators: seconds between coalesced frames per thread, and seconds a typer
+# stays shown after their last keystroke
+MESSAGING_TYPING_INTERVAL = config('MESSAGING_TYPING_INTERVAL', default=1.0, cast=float)
+MESSAGING_TYPING_TTL = config('MESSAGING_TYPING_TTL', default=6.0, cast=float)
+
+# Websocket presence: seconds between batched diffs, between cross-worker snapshots,
+# and without a heartbeat before a connection counts as closed
+PRESENCE_FLUSH_INTERVAL = config('PRESENCE_FLUSH_INTERVAL', default=2.0, cast=float)
+PRESENCE_SNAPSHOT_INTERVAL = config('PRESENCE_SNAPSHOT_INTERVAL', default=15.0, cast=float)
+PRESENCE_CONNECTION_TIMEOUT = config('PRESENCE_CONNECTION_TIMEOUT', default=90.0, cast=float)
+
+# Message archival: age in days after which messages move to compressed archive chunks,
+# messages per chunk, and decoded chunks each process keeps for history reads
+MESSAGING_ARCHIVE_AFTER_DAYS = config('MESSAGING_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+MESSAGING_ARCHIVE_CHUNK_SIZE = config('MESSAGING_ARCHIVE_CHUNK_SIZE', default=500, cast=int)
+MESSAGING_ARCHIVE_CACHE_SIZE = config('MESSAGING_ARCHIVE_CACHE_SIZE', default=128, cast=int)
 
 # JWT Configuration (optional for OAuth)
 JWT_SECRET_KEY = config('JWT_SECRET_KEY', default=SECRET_KEY)
@@ -13,6 +13,7 @@ from .serializers import (
 )
 from users.permissions import IsAdmin, IsAdminOrOrganizer
 from clubs.models import ClubMembership
+from analytics.counters import activity_counter
 
 class EventViewSet(viewsets.ModelViewSet):
     queryset = Event.objects.all()
@@ -71,6 +72,11 @@ class EventViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        activity_counter.increment(request.user, 'event_views')
+        return response
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -151,6 +157,7 @@ class EventViewSet(viewsets.ModelViewSet):
             if existing_registration.status == 'cancelled':
                 existing_registration.status = 'registered'
                 existing_registration.save()
+                activity_counter.increment(user, 'event_registrations')
                 return Response(
                     {'message': 'Registration restored.'},
                     status=status.HTTP_200_OK
@@ -185,6 +192,7 @@ class EventViewSet(viewsets.ModelViewSet):
             user=user,
             payment_amount=event.registration_fee
         )
+        activity_counter.increment(user, 'event_registrations')
         
         # TODO: Process payment if registration_fee > 0
         
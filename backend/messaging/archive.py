@@ -0,0 +1,352 @@
+"""
+Cold storage for old messages.
+
+The archive_messages command moves messages out of Message and into
+MessageArchive rows. It takes messages older than
+MESSAGING_ARCHIVE_AFTER_DAYS, and every message of an inactive thread.
+Each row holds a run of up to MESSAGING_ARCHIVE_CHUNK_SIZE consecutive
+messages of one thread, with their reactions, as zlib-compressed compact
+JSON (one list per message, in FIELDS order). A chunk is written and its
+rows are deleted in the same transaction.
+
+Archiving always takes a thread's oldest messages, so the archive is a
+prefix of the history in (created_at, id) order and the live rows carry
+on where it ends. The newest visible message of an active thread stays
+live, so the inbox summary still points at a row.
+
+Deleting the rows has these effects:
+- The search triggers drop them from the index.
+- Read watermarks lose their last_read_message but keep their time.
+- Their legacy per-message read receipts are deleted with them.
+- Thread.last_seq is untouched.
+- Thread summaries are recomputed once per thread, counting archived
+  messages.
+
+MessageHistoryService pages past the live rows with older() and newer();
+the thread messages view pages the whole history through ThreadHistory.
+These return unsaved Message instances with `archived` set and their
+reactions prefetched. Chunks never change once written, so each process
+keeps the latest MESSAGING_ARCHIVE_CACHE_SIZE decoded chunks in an LRU
+cache, and paging back through a thread decompresses each chunk once.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from functools import lru_cache
+import json
+import logging
+import time
+import uuid
+import zlib
+
+from .models import Message, MessageArchive, MessageReaction, MessageThread
+from .services import ThreadSummaryService
+from .signals import summary_refresh_paused
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'MESSAGING_ARCHIVE_AFTER_DAYS', 365)
+CHUNK_SIZE = getattr(settings, 'MESSAGING_ARCHIVE_CHUNK_SIZE', 500)
+CACHE_SIZE = getattr(settings, 'MESSAGING_ARCHIVE_CACHE_SIZE', 128)
+COMPRESSION_LEVEL = 6
+FORMAT_VERSION = 1
+
+FIELDS = (
+    'id', 'seq', 'sender_id', 'content', 'message_type', 'attachments',
+    'is_read', 'is_deleted', 'created_at', 'updated_at', 'reactions',
+)
+
+
+def encode(messages, reactions):
+    """Compact JSON of `messages` (lists in FIELDS order); `reactions` maps message ids to their reactions."""
+    rows = [
+        [
+            message.pk.hex, message.seq, message.sender_id.hex, message.content, message.message_type,
+            message.attachments, message.is_read, message.is_deleted,
+            message.created_at.isoformat(), message.updated_at.isoformat(),
+            [
+                [reaction.user_id.hex, reaction.reaction_type, reaction.created_at.isoformat()]
+                for reaction in reactions.get(message.pk, ())
+            ],
+        ]
+        for message in messages
+    ]
+    return json.dumps({'v': FORMAT_VERSION, 'rows': rows}, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode(data):
+    payload = json.loads(zlib.decompress(bytes(data)))
+    if payload.get('v') != FORMAT_VERSION:
+        raise ValueError(f"Unknown message archive format {payload.get('v')!r}.")
+    return payload['rows']
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _chunk(archive_id):
+    """((created_at, id), row) for every message in an archive chunk, in history order."""
+    data = MessageArchive.objects.filter(pk=archive_id).values_list('data', flat=True).first()
+    if data is None:
+        return ()
+    return tuple(((parse_datetime(row[8]), uuid.UUID(row[0])), row) for row in decode(data))
+
+
+def to_message(thread_id, key, row):
+    created_at, message_id = key
+    message = Message(
+        id=message_id, thread_id=thread_id, seq=row[1], sender_id=uuid.UUID(row[2]),
+        content=row[3], message_type=row[4], attachments=row[5], is_read=row[6], is_deleted=row[7],
+        created_at=created_at, updated_at=parse_datetime(row[9]),
+    )
+    message._state.adding = False
+    message.archived = True
+
+    # Serve message.reactions.all() from the archive, like a prefetch would
+    reactions = MessageReaction.objects.none()
+    reactions._result_cache = [
+        MessageReaction(message_id=message_id, user_id=uuid.UUID(user_id), reaction_type=reaction_type,
+                        created_at=parse_datetime(reacted_at))
+        for user_id, reaction_type, reacted_at in row[10]
+    ]
+    reactions._prefetch_done = True
+    message._prefetched_objects_cache = {'reactions': reactions}
+    return message
+
+
+def _chunk_ids(thread_id, **filters):
+    return list(MessageArchive.objects.filter(thread_id=thread_id, **filters).values_list('pk', flat=True))
+
+
+def older(thread_id, anchor=None, count=1):
+    """Up to `count` visible archived messages before `anchor` (or the newest ones), newest first."""
+    if anchor is None:
+        chunk_ids, bound = _chunk_ids(thread_id), None
+    else:
+        chunk_ids, bound = _chunk_ids(thread_id, first_message_at__lte=anchor.created_at), (anchor.created_at, anchor.pk)
+    found = []
+    for archive_id in reversed(chunk_ids):
+        for key, row in reversed(_chunk(archive_id)):
+            if row[7] or (bound is not None and key >= bound):
+                continue
+            found.append(to_message(thread_id, key, row))
+            if len(found) >= count:
+                return found
+    return found
+
+
+def newer(thread_id, anchor, count=1):
+    """Up to `count` visible archived messages after `anchor`, oldest first."""
+    bound = (anchor.created_at, anchor.pk)
+    found = []
+    for archive_id in _chunk_ids(thread_id, last_message_at__gte=anchor.created_at):
+        for key, row in _chunk(archive_id):
+            if row[7] or key <= bound:
+                continue
+            found.append(to_message(thread_id, key, row))
+            if len(found) >= count:
+                return found
+    return found
+
+
+def messages(thread_id):
+    """Every visible archived message of the thread, in history order."""
+    return [
+        to_message(thread_id, key, row)
+        for archive_id in _chunk_ids(thread_id)
+        for key, row in _chunk(archive_id) if not row[7]
+    ]
+
+
+class ThreadHistory:
+    """
+    A thread's visible history, archived messages then `live` (its visible
+    live rows in (created_at, id) order), as a sequence a paginator can
+    count and slice. Chunk offsets come from visible_count, so a slice
+    decodes only the chunks it overlaps and queries only the live rows it
+    needs.
+    """
+
+    def __init__(self, thread_id, live):
+        self.thread_id = thread_id
+        self.live = live
+        self.chunks = list(MessageArchive.objects.filter(thread_id=thread_id).values_list('pk', 'visible_count'))
+        self.archived = sum(visible for _, visible in self.chunks)
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.archived + self.live.count()
+        return self._count
+
+    def __iter__(self):
+        yield from messages(self.thread_id)
+        yield from self.live
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += len(self)
+            page = self[index:index + 1] if index >= 0 else []
+            if not page:
+                raise IndexError('ThreadHistory index out of range')
+            return page[0]
+        if index.step not in (None, 1) or (index.start or 0) < 0 or (index.stop is not None and index.stop < 0):
+            return list(self)[index]
+
+        start = index.start or 0
+        stop = len(self) if index.stop is None else index.stop
+        found = []
+        offset = 0
+        for archive_id, visible in self.chunks:
+            if offset >= stop:
+                break
+            if offset + visible > start:
+                rows = [(key, row) for key, row in _chunk(archive_id) if not row[7]]
+                found.extend(
+                    to_message(self.thread_id, key, row)
+                    for key, row in rows[max(start - offset, 0):stop - offset]
+                )
+            offset += visible
+        if stop > self.archived:
+            found.extend(self.live[max(start - self.archived, 0):stop - self.archived])
+        return found
+
+
+def history(thread_id, live):
+    """`live` itself for a thread with nothing archived, else a ThreadHistory over the archive and `live`."""
+    thread_history = ThreadHistory(thread_id, live)
+    return thread_history if thread_history.chunks else live
+
+
+def find(thread_id, message_id):
+    """
+    The archived message `message_id` of the thread, or None. Chunks are
+    searched newest first, where paging back from the live rows lands.
+    """
+    for archive_id in reversed(_chunk_ids(thread_id)):
+        for key, row in _chunk(archive_id):
+            if key[1] == message_id:
+                return to_message(thread_id, key, row)
+    return None
+
+
+def due_messages(cutoff):
+    """Messages in active threads older than `cutoff` (bar each thread's last one) and all of inactive threads."""
+    return Message.objects.filter(
+        Q(thread__is_active=True, created_at__lt=cutoff) | Q(thread__is_active=False)
+    ).exclude(pk=F('thread__last_message_id'))
+
+
+def count_due(now=None, archive_after_days=None):
+    if archive_after_days is None:
+        archive_after_days = ARCHIVE_AFTER_DAYS
+    due = due_messages((now or timezone.now()) - timedelta(days=archive_after_days))
+    return {
+        'threads': due.order_by().values('thread_id').distinct().count(),
+        'messages': due.count(),
+    }
+
+
+def archive_chunk(thread_id, message_ids):
+    """Move the given messages of one thread into a new MessageArchive. Returns (messages, JSON bytes, stored bytes)."""
+    with transaction.atomic(), summary_refresh_paused():
+        # Locked while being copied, so an edit can't land between the copy and the delete
+        messages = list(Message.objects.select_for_update().filter(
+            thread_id=thread_id, pk__in=message_ids
+        ).order_by('created_at', 'id'))
+        if not messages:
+            return 0, 0, 0
+        reactions = {}
+        for reaction in MessageReaction.objects.filter(message_id__in=message_ids).order_by('created_at'):
+            reactions.setdefault(reaction.message_id, []).append(reaction)
+
+        payload = encode(messages, reactions).encode()
+        data = zlib.compress(payload, COMPRESSION_LEVEL)
+        seqs = [message.seq for message in messages if message.seq is not None]
+        MessageArchive.objects.create(
+            thread_id=thread_id,
+            first_seq=min(seqs, default=None),
+            last_seq=max(seqs, default=None),
+            first_message_at=messages[0].created_at,
+            last_message_at=messages[-1].created_at,
+            message_count=len(messages),
+            visible_count=sum(1 for message in messages if not message.is_deleted),
+            data=data,
+        )
+        Message.objects.filter(pk__in=[message.pk for message in messages]).delete()
+    return len(messages), len(payload), len(data)
+
+
+def archive_thread(thread, cutoff, chunk_size=None, max_chunks=None):
+    """
+    Archive `thread`'s due messages, oldest first, in chunks of
+    `chunk_size`. An active thread keeps its newest visible message and
+    anything after it. Returns the run's metrics.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    metrics = {'messages': 0, 'chunks': 0, 'json_bytes': 0, 'stored_bytes': 0, 'complete': True}
+
+    due = Message.objects.filter(thread_id=thread.pk)
+    if thread.is_active:
+        due = due.filter(created_at__lt=cutoff)
+        keep = Message.objects.filter(thread_id=thread.pk, is_deleted=False).order_by(
+            '-created_at', '-id'
+        ).only('id', 'created_at').first()
+        if keep is not None:
+            due = due.filter(Q(created_at__lt=keep.created_at) | Q(created_at=keep.created_at, id__lt=keep.id))
+
+    while True:
+        if max_chunks is not None and metrics['chunks'] >= max_chunks:
+            metrics['complete'] = False
+            break
+        message_ids = list(due.order_by('created_at', 'id').values_list('pk', flat=True)[:chunk_size])
+        if not message_ids:
+            break
+        archived, json_bytes, stored_bytes = archive_chunk(thread.pk, message_ids)
+        metrics['messages'] += archived
+        metrics['chunks'] += 1
+        metrics['json_bytes'] += json_bytes
+        metrics['stored_bytes'] += stored_bytes
+        if len(message_ids) < chunk_size:
+            break
+
+    if metrics['messages']:
+        ThreadSummaryService.refresh([thread.pk])
+    return metrics
+
+
+def archive(now=None, archive_after_days=None, chunk_size=None, max_chunks=None, pause=0):
+    """
+    Archive every thread with due messages, stopping after `max_chunks`
+    chunks if given. Returns the run's metrics.
+    """
+    if archive_after_days is None:
+        archive_after_days = ARCHIVE_AFTER_DAYS
+    cutoff = (now or timezone.now()) - timedelta(days=archive_after_days)
+    started = time.monotonic()
+    metrics = {'threads': 0, 'messages': 0, 'chunks': 0, 'json_bytes': 0, 'stored_bytes': 0, 'complete': True}
+
+    thread_ids = due_messages(cutoff).order_by('thread_id').values_list('thread_id', flat=True).distinct()
+    for thread in MessageThread.objects.filter(pk__in=list(thread_ids)).only('id', 'is_active'):
+        remaining = None if max_chunks is None else max_chunks - metrics['chunks']
+        if remaining is not None and remaining <= 0:
+            metrics['complete'] = False
+            break
+        result = archive_thread(thread, cutoff, chunk_size, remaining)
+        metrics['threads'] += 1
+        for metric in ('messages', 'chunks', 'json_bytes', 'stored_bytes'):
+            metrics[metric] += result[metric]
+        if not result['complete']:
+            metrics['complete'] = False
+            break
+        if pause:
+            time.sleep(pause)
+
+    metrics['seconds'] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"Archived {metrics['messages']} messages from {metrics['threads']} threads in {metrics['chunks']} chunks "
+        f"({metrics['json_bytes']} bytes of JSON stored as {metrics['stored_bytes']}), {metrics['seconds']}s"
+    )
+    return metrics
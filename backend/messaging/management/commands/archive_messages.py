@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from messaging import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Move old messages, and all messages of inactive threads, into compressed per-thread '
+        'archive chunks (run from a scheduler).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help=f'Archive messages older than this many days (default: {archive.ARCHIVE_AFTER_DAYS}).')
+        parser.add_argument('--chunk-size', type=int, default=archive.CHUNK_SIZE,
+                            help='Messages per archive chunk, each written in its own transaction.')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks; the next run continues.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between threads.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived.')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            counts = archive.count_due(archive_after_days=options['days'])
+            self.stdout.write(f"Would archive {counts['messages']} messages from {counts['threads']} threads.")
+            return
+
+        metrics = archive.archive(
+            archive_after_days=options['days'],
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+            pause=options['pause'],
+        )
+        ratio = metrics['json_bytes'] / metrics['stored_bytes'] if metrics['stored_bytes'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {metrics['messages']} messages from {metrics['threads']} threads "
+            f"in {metrics['chunks']} chunks, {metrics['seconds']}s "
+            f"({metrics['stored_bytes']} bytes stored, {ratio:.1f}x compression)."
+        ))
+        if not metrics['complete']:
+            self.stdout.write(self.style.WARNING('Stopped at --max-chunks; more messages are due.'))
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+from rest_framework.renderers import JSONRenderer
+import time
+
+from clubs.models import Club
+from messaging.models import MessageThread, Message, MessageReaction
+from messaging.serializers import MessageSerializer, compact_message_payload
+from messaging.services import ReadStateService
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the nested message representation against the compact wire '
+        'format for one page of thread history in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=50)
+        parser.add_argument('--participants', type=int, default=20)
+        parser.add_argument('--reactions', type=int, default=3, help='Reactions per message.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            thread, viewer = self._populate(options['messages'], options['participants'], options['reactions'])
+            messages = thread.messages.filter(is_deleted=False).order_by('created_at')
+
+            self.stdout.write(f'\n{"format":>8} {"bytes":>10} {"queries":>9} {"ms":>9}')
+            nested = lambda: MessageSerializer(
+                list(messages), many=True, context={
+                    'read_states': ReadStateService.read_states(thread.pk),
+                    'receipt_times': ReadStateService.receipt_times([message.pk for message in messages]),
+                }
+            ).data
+            self._run('nested', nested, options['repeat'])
+            self._run('compact', lambda: compact_message_payload(list(messages), viewer), options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, label, serialize, repeat):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        timings = []
+        for _ in range(repeat):
+            queries = 0
+            with connection.execute_wrapper(count_queries):
+                started = time.perf_counter()
+                body = JSONRenderer().render(serialize())
+                timings.append(time.perf_counter() - started)
+        self.stdout.write(f'{label:>8} {len(body):>10,} {queries:>9,} {min(timings) * 1000:>9.1f}')
+
+    def _populate(self, message_count, participant_count, reactions_per_message):
+        now = timezone.now()
+        users = User.objects.bulk_create(
+            [User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(participant_count)]
+        )
+        club = Club.objects.create(name='Bench Club', slug='bench-club', description='Benchmark')
+        thread = MessageThread.objects.create(thread_type='club', club=club, created_by=users[0], name='Bench')
+        thread.participants.set(users)
+
+        for i in range(message_count):
+            Message.objects.create(
+                thread=thread, sender=users[i % participant_count],
+                content=f'Benchmark message {i} ' + 'lorem ipsum ' * 10,
+                created_at=now - timedelta(minutes=message_count - i)
+            )
+        messages = list(thread.messages.order_by('created_at'))
+        reaction_types = [choice[0] for choice in MessageReaction.REACTION_TYPES]
+        MessageReaction.objects.bulk_create([
+            MessageReaction(message=message, user=users[(i + j) % participant_count],
+                            reaction_type=reaction_types[j % len(reaction_types)])
+            for i, message in enumerate(messages) for j in range(reactions_per_message)
+        ])
+        # Half the participants are caught up, the rest stopped halfway
+        for i, user in enumerate(users):
+            ReadStateService.mark_read(thread.pk, user, messages[-1] if i % 2 else messages[len(messages) // 2])
+        return thread, users[0]
@@ -0,0 +1,149 @@
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+from websocket.presence import PresenceService, PresenceStore
+
+
+class BenchLayer(InMemoryChannelLayer):
+    """The in-memory layer, delivering worker traffic and counting (then dropping) frames to simulated clients."""
+
+    def __init__(self, **kwargs):
+        super().__init__(capacity=100_000, **kwargs)
+        self.frames = 0
+        self.frame_bytes = 0
+        self.changes = 0
+
+    async def send(self, channel, message):
+        if channel.startswith('bench.'):
+            self.frames += 1
+            self.frame_bytes += len(json.dumps(message))
+            self.changes += len(message.get('changes', ()))
+            return
+        await super().send(channel, message)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the websocket presence service with simulated connections '
+        'spread over several in-process workers sharing the in-memory channel layer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50_000)
+        parser.add_argument('--users', type=int, default=40_000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=5_000)
+        parser.add_argument('--participants', type=int, default=25)
+        parser.add_argument('--churn', type=float, default=0.1, help='Share of connections that drop and reconnect.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--memory', action='store_true', help='Trace allocations (slows every phase down).')
+
+    def handle(self, *args, **options):
+        asyncio.run(self._bench(options))
+
+    async def _bench(self, options):
+        rng = random.Random(options['seed'])
+        clock = [time.time()]
+        layer = BenchLayer()
+        workers = [
+            PresenceService(store=PresenceStore(connection_timeout=90, worker_timeout=45), clock=lambda: clock[0])
+            for _ in range(options['workers'])
+        ]
+        for worker in workers:
+            await worker.start(layer)
+
+        users = [f'user-{i}' for i in range(options['users'])]
+        threads = [rng.sample(users, options['participants']) for _ in range(options['threads'])]
+        connections = [
+            (workers[i % len(workers)], users[i % len(users)], f'bench.conn!{i}')
+            for i in range(options['connections'])
+        ]
+
+        if options['memory']:
+            tracemalloc.start()
+        self.stdout.write(f'\n{"phase":>12} {"ops":>9} {"seconds":>9} {"ops/s":>11} {"frames":>8} {"changes":>8}')
+
+        async def connect_all():
+            for worker, user_id, channel_name in connections:
+                await worker.connect(user_id, channel_name, layer)
+        await self._phase('connect', len(connections), connect_all, layer)
+
+        def subscribe_all():
+            for worker, user_id, channel_name in connections:
+                worker.subscribe(channel_name, rng.choice(threads))
+        await self._phase('subscribe', len(connections), subscribe_all, layer)
+
+        await self._phase('sync', len(workers), lambda: self._flush_all(workers), layer)
+
+        def heartbeat_all():
+            for worker, user_id, channel_name in connections:
+                worker.heartbeat(user_id, channel_name)
+        await self._phase('heartbeat', len(connections), heartbeat_all, layer)
+
+        churned = rng.sample(connections, int(len(connections) * options['churn']))
+
+        async def churn():
+            for worker, user_id, channel_name in churned:
+                await worker.disconnect(user_id, channel_name)
+        await self._phase('disconnect', len(churned), churn, layer)
+        await self._phase('flush', len(workers), lambda: self._flush_all(workers), layer)
+
+        async def reconnect():
+            for worker, user_id, channel_name in churned:
+                await worker.connect(user_id, channel_name, layer)
+        await self._phase('reconnect', len(churned), reconnect, layer)
+        await self._phase('flush', len(workers), lambda: self._flush_all(workers), layer)
+
+        # Half the connections go quiet past the heartbeat timeout
+        clock[0] += 60
+        for worker, user_id, channel_name in connections[::2]:
+            worker.heartbeat(user_id, channel_name)
+        clock[0] += 40
+        await self._phase('expire', len(workers), lambda: self._flush_all(workers), layer)
+
+        sample = threads[:1000]
+        store = workers[0].store
+
+        def thread_queries():
+            for participants in sample:
+                store.online_among(participants)
+        await self._phase('who-online', len(sample), thread_queries, layer)
+
+        online = sum(1 for user_id in users if store.is_online(user_id))
+        self.stdout.write(
+            f'\nonline (worker 0 view): {online:,} users, '
+            f'{layer.frame_bytes / max(layer.frames, 1):.0f} bytes/frame'
+        )
+        if options['memory']:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f'memory {current / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB)')
+        for worker in workers:
+            await worker.stop()
+
+    async def _flush_all(self, workers):
+        for worker in workers:
+            await worker.flush()
+        # Let each worker take in the others' snapshots, then push the resulting diffs
+        await asyncio.sleep(0)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        for worker in workers:
+            await worker.flush()
+
+    async def _phase(self, label, ops, run, layer):
+        frames, changes = layer.frames, layer.changes
+        started = time.perf_counter()
+        result = run()
+        if asyncio.iscoroutine(result):
+            await result
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{label:>12} {ops:>9,} {elapsed:>9.3f} {ops / elapsed if elapsed else 0:>11,.0f} '
+            f'{layer.frames - frames:>8,} {layer.changes - changes:>8,}'
+        )
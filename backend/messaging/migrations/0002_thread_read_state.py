@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:51
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_read_states(apps, schema_editor):
+    # The newest message each user has a receipt for in a thread becomes their watermark there,
+    # read at the latest receipt time; the receipts themselves stay as per-message history
+    MessageReadReceipt = apps.get_model('messaging', 'MessageReadReceipt')
+    Message = apps.get_model('messaging', 'Message')
+    ThreadReadState = apps.get_model('messaging', 'ThreadReadState')
+    rows = MessageReadReceipt.objects.order_by().values('message__thread_id', 'user_id').annotate(
+        last_read_at=Max('message__created_at'),
+        read_at=Max('read_at'),
+    )
+    ThreadReadState.objects.bulk_create(
+        [
+            ThreadReadState(
+                thread_id=row['message__thread_id'],
+                user_id=row['user_id'],
+                last_read_at=row['last_read_at'],
+                read_at=row['read_at'],
+                updated_at=row['read_at'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=500,
+    )
+    ThreadReadState.objects.update(last_read_message=Subquery(
+        Message.objects.filter(
+            thread_id=OuterRef('thread_id'), created_at=OuterRef('last_read_at')
+        ).order_by('id').values('id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadReadState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('last_read_at', models.DateTimeField()),
+                ('read_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='messaging.messagethread')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='threadreadstate',
+            constraint=models.UniqueConstraint(fields=('thread', 'user'), name='unique_thread_read_state'),
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
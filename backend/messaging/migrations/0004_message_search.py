@@ -0,0 +1,77 @@
+from django.db import migrations, OperationalError
+
+# Kept in step with messaging_message by triggers, so queryset.update() and
+# raw writes are indexed too. Soft-deleted messages are removed from the index.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE messaging_message_fts USING fts5(
+        content, message_id UNINDEXED, thread_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER messaging_message_fts_insert AFTER INSERT ON messaging_message
+    WHEN new.is_deleted = 0 BEGIN
+        INSERT INTO messaging_message_fts (rowid, content, message_id, thread_id)
+        VALUES (new.rowid, new.content, new.id, new.thread_id);
+    END
+    """,
+    """
+    CREATE TRIGGER messaging_message_fts_update AFTER UPDATE OF content, is_deleted, thread_id ON messaging_message
+    BEGIN
+        DELETE FROM messaging_message_fts WHERE rowid = old.rowid;
+        INSERT INTO messaging_message_fts (rowid, content, message_id, thread_id)
+        SELECT new.rowid, new.content, new.id, new.thread_id WHERE new.is_deleted = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER messaging_message_fts_delete AFTER DELETE ON messaging_message
+    BEGIN
+        DELETE FROM messaging_message_fts WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    INSERT INTO messaging_message_fts (rowid, content, message_id, thread_id)
+    SELECT rowid, content, id, thread_id FROM messaging_message WHERE is_deleted = 0
+    """,
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS messaging_message_fts_insert",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_update",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_delete",
+    "DROP TABLE IF EXISTS messaging_message_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases, or SQLite builds without FTS5, use the LIKE fallback in messaging.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(content)")
+            cursor.execute("DROP TABLE temp.fts5_probe")
+        except OperationalError:
+            return
+        for sql in CREATE_INDEX:
+            cursor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_INDEX:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_thread_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    # Existing messages are numbered in the order history shows them: (created_at, id)
+    MessageThread = apps.get_model('messaging', 'MessageThread')
+    Message = apps.get_model('messaging', 'Message')
+    for thread_id in MessageThread.objects.values_list('pk', flat=True).iterator():
+        messages = list(Message.objects.filter(thread_id=thread_id).order_by('created_at', 'id').only('pk'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=500)
+        MessageThread.objects.filter(pk=thread_id).update(last_seq=len(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagethread',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        # Partial, so SQLite adds it as an index instead of rebuilding the table (and its search triggers)
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('seq__isnull', False)), fields=('thread', 'seq'), name='unique_message_seq'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:11
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_message_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('first_seq', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('last_seq', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('first_message_at', models.DateTimeField()),
+                ('last_message_at', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('visible_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='messaging.messagethread')),
+            ],
+            options={
+                'ordering': ['first_message_at'],
+                'indexes': [models.Index(fields=['thread', 'first_message_at'], name='messaging_m_thread__93af27_idx')],
+            },
+        ),
+    ]
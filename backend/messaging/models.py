@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 import uuid
 
@@ -29,10 +29,22 @@ class MessageThread(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     
+    # Denormalized summary, maintained by ThreadSummaryService on message create/delete
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=100, blank=True, default='')
+    last_message_type = models.CharField(max_length=50, blank=True, default='')
+    last_message_sender = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    
+    # Last sequence number handed out to a message in this thread
+    last_seq = models.PositiveBigIntegerField(default=0)
+    
     class Meta:
         indexes = [
             models.Index(fields=['thread_type']),
             models.Index(fields=['updated_at']),
+            models.Index(fields=['-last_message_at'], name='thread_last_message_idx'),
         ]
         ordering = ['-updated_at']
     
@@ -48,25 +60,33 @@ class MessageThread(models.Model):
             names = [p.get_full_name() or p.email for p in participants]
             return f"Chat with {', '.join(names)}"
     
-    @property
-    def last_message(self):
-        return self.messages.filter(is_deleted=False).order_by('-created_at').first()
+    @classmethod
+    def allocate_seq(cls, thread_id):
+        """
+        Next sequence number in the thread. The UPDATE holds the thread row
+        until the caller's transaction commits, so concurrent senders get
+        increasing numbers in commit order.
+        """
+        cls.objects.filter(pk=thread_id).update(last_seq=models.F('last_seq') + 1)
+        return cls.objects.filter(pk=thread_id).values_list('last_seq', flat=True).get()
     
-    @property
     def unread_count(self, user):
-        return self.messages.filter(is_read=False).exclude(sender=user).count()
+        from .services import ReadStateService
+        return ReadStateService.unread_counts([self.pk], user).get(self.pk, 0)
 
 class Message(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='sent_messages')
+    seq = models.PositiveBigIntegerField(null=True, editable=False)  # Per-thread, assigned on insert
+    archived = False  # Set on instances read back from a MessageArchive, see messaging.archive
     
     # Message content
     content = models.TextField()
     message_type = models.CharField(max_length=50, default='text')  # text, image, file, system
     attachments = models.JSONField(default=list)  # List of attachment URLs
     
-    # Status tracking
+    # Status tracking (is_read: seen by at least one other participant; per-reader state is ThreadReadState)
     is_read = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     read_by = models.ManyToManyField('users.User', through='MessageReadReceipt', related_name='read_messages')
@@ -81,19 +101,32 @@ class Message(models.Model):
             models.Index(fields=['sender']),
             models.Index(fields=['is_read']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['thread', 'seq'], condition=models.Q(seq__isnull=False), name='unique_message_seq'),
+        ]
         ordering = ['created_at']
     
     def __str__(self):
         return f"{self.sender.email}: {self.content[:50]}..."
     
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.seq is None:
+            with transaction.atomic():
+                self.seq = MessageThread.allocate_seq(self.thread_id)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+    
     def mark_as_read(self, user):
-        """Mark message as read by a user"""
-        if not self.is_read and user != self.sender:
-            self.is_read = True
-            self.save()
-            MessageReadReceipt.objects.get_or_create(message=self, user=user)
+        """Mark this message, and everything before it in the thread, as read by a user"""
+        from .services import ReadStateService
+        ReadStateService.mark_read(self.thread_id, user, self)
 
 class MessageReadReceipt(models.Model):
+    """
+    Per-message read times from before ThreadReadState. No longer written,
+    but kept: read receipts report these exact times where they exist.
+    """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
     user = models.ForeignKey('users.User', on_delete=models.CASCADE)
@@ -105,6 +138,54 @@ class MessageReadReceipt(models.Model):
     def __str__(self):
         return f"{self.user.email} read message at {self.read_at}"
 
+class ThreadReadState(models.Model):
+    """
+    A participant's read watermark in a thread: every message up to
+    last_read_at is read, and read_at is when the watermark last moved.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='thread_read_states')
+    last_read_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_read_at = models.DateTimeField()
+    read_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['thread', 'user'], name='unique_thread_read_state'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} read {self.thread_id} up to {self.last_read_at}"
+
+class MessageArchive(models.Model):
+    """
+    A run of a thread's oldest messages (with their reactions), moved out
+    of Message into one zlib-compressed compact JSON blob by messaging.archive.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='archives')
+    first_seq = models.PositiveBigIntegerField(null=True, blank=True)
+    last_seq = models.PositiveBigIntegerField(null=True, blank=True)
+    first_message_at = models.DateTimeField()
+    last_message_at = models.DateTimeField()
+    
+    # message_count includes soft-deleted messages; visible_count feeds the thread summary
+    message_count = models.PositiveIntegerField()
+    visible_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'first_message_at']),
+        ]
+        ordering = ['first_message_at']
+    
+    def __str__(self):
+        return f"{self.thread_id}: {self.message_count} messages up to {self.last_message_at}"
+
 class MessageReaction(models.Model):
     REACTION_TYPES = (
         ('like', '👍'),
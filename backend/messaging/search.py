@@ -0,0 +1,164 @@
+"""
+Full-text search over the messages of a user's threads.
+
+On SQLite with FTS5, migration 0004 keeps messaging_message_fts in step
+with messaging_message through triggers: inserts and content edits are
+indexed, and soft-deleted or removed messages drop out. A search first
+resolves the user's active thread ids from the participants table (the
+participant filter), then runs one MATCH restricted to those threads,
+ranked by bm25 with a highlighted snippet per hit. Pages continue from a
+signed (score, rowid) cursor bound to the query text.
+
+Elsewhere, or when FTS5 is missing, the same API falls back to a
+case-insensitive LIKE over the participant-scoped messages, newest first.
+"""
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+import re
+import uuid
+
+from .models import Message, MessageThread
+
+CURSOR_SALT = 'messaging.search'
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+FTS_TABLE = 'messaging_message_fts'
+SNIPPET_TOKENS = 12
+
+# Private-use characters mark the match in snippets, so the content can be escaped before <mark> goes in
+MATCH_START, MATCH_END = '\ue000', '\ue001'
+
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available
+
+
+def match_expression(text):
+    """An FTS5 query for `text`: every word must match, the last one as a prefix."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def encode_cursor(query, position):
+    return signing.dumps({'q': query, 'p': position}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, query):
+    try:
+        cursor = signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ValueError("Invalid search cursor.")
+    if cursor.get('q') != query or not isinstance(cursor.get('p'), list):
+        raise ValueError("Search cursor belongs to a different query.")
+    return cursor['p']
+
+
+def participant_thread_ids(user):
+    return list(MessageThread.objects.filter(
+        participants=user, is_active=True
+    ).values_list('id', flat=True))
+
+
+def search(user, query, cursor=None, limit=PAGE_SIZE):
+    """
+    Messages in `user`'s threads matching `query`, best first. Returns
+    {'hits': [(message, snippet, score)], 'cursor': next page or None}.
+    Raises ValueError for a bad cursor.
+    """
+    position = decode_cursor(cursor, query) if cursor else None
+    thread_ids = participant_thread_ids(user)
+    if not thread_ids:
+        return {'hits': [], 'cursor': None}
+    if fts_available():
+        return _search_fts(query, thread_ids, position, limit)
+    return _search_like(query, thread_ids, position, limit)
+
+
+def _search_fts(query, thread_ids, position, limit):
+    expression = match_expression(query)
+    if expression is None:
+        return {'hits': [], 'cursor': None}
+
+    params = [MATCH_START, MATCH_END, SNIPPET_TOKENS, expression, *[thread_id.hex for thread_id in thread_ids]]
+    after = ''
+    if position:
+        after = 'WHERE score > %s OR (score = %s AND rowid > %s)'
+        params += [position[0], position[0], position[1]]
+    sql = (
+        f"SELECT rowid, message_id, score, snippet FROM ("
+        f"  SELECT rowid, message_id, bm25({FTS_TABLE}) AS score,"
+        f"         snippet({FTS_TABLE}, 0, %s, %s, '…', %s) AS snippet"
+        f"  FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        f"  AND thread_id IN ({', '.join(['%s'] * len(thread_ids))})"
+        f") {after} ORDER BY score, rowid LIMIT %s"
+    )
+    params.append(limit + 1)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = Message.objects.select_related('thread').in_bulk([uuid.UUID(row[1]) for row in rows])
+    hits = []
+    for rowid, message_id, score, snippet in rows:
+        message = messages.get(uuid.UUID(message_id))
+        if message is not None:
+            hits.append((message, highlight(snippet), score))
+    return {
+        'hits': hits,
+        'cursor': encode_cursor(query, [rows[-1][2], rows[-1][0]]) if has_more else None,
+    }
+
+
+def _search_like(query, thread_ids, position, limit):
+    text = query.strip()
+    if not text:
+        return {'hits': [], 'cursor': None}
+    messages = Message.objects.filter(
+        thread_id__in=thread_ids, is_deleted=False, content__icontains=text
+    ).select_related('thread')
+    if position:
+        messages = messages.filter(
+            Q(created_at__lt=position[0]) | Q(created_at=position[0], id__lt=position[1])
+        )
+    rows = list(messages.order_by('-created_at', '-id')[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    hits = [(message, highlight(like_snippet(message.content, text)), None) for message in rows]
+    return {
+        'hits': hits,
+        'cursor': encode_cursor(query, [rows[-1].created_at.isoformat(), str(rows[-1].pk)]) if has_more else None,
+    }
+
+
+def like_snippet(content, query, radius=60):
+    start = content.lower().find(query.lower())
+    if start < 0:
+        return content[:radius * 2]
+    end = start + len(query)
+    left, right = max(start - radius, 0), min(end + radius, len(content))
+    return (
+        ('…' if left else '') + content[left:start] + MATCH_START + content[start:end] + MATCH_END
+        + content[end:right] + ('…' if right < len(content) else '')
+    )
+
+
+def highlight(snippet):
+    """Escape a snippet and turn its match markers into <mark> tags."""
+    return escape(snippet or '').replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
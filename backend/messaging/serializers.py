@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from .models import MessageThread, Message, MessageReadReceipt, MessageReaction
+from django.db.models import Count, Q
+from .models import MessageThread, Message, MessageReaction
+from .services import ReadStateService
+from users.models import User
 from users.serializers import UserProfileSerializer
 from clubs.serializers import ClubSerializer
 from events.serializers import EventSerializer
@@ -22,22 +25,63 @@ class MessageThreadSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_last_message(self, obj):
-        last_message = obj.last_message
-        if last_message:
+        # The id is None once the last message has been archived
+        if obj.last_message_at:
             return {
-                'content': last_message.content[:100],
-                'sender': UserProfileSerializer(last_message.sender).data,
-                'created_at': last_message.created_at,
-                'message_type': last_message.message_type
+                'id': obj.last_message_id,
+                'content': obj.last_message_preview,
+                'sender': UserProfileSerializer(obj.last_message_sender).data if obj.last_message_sender else None,
+                'created_at': obj.last_message_at,
+                'message_type': obj.last_message_type
             }
         return None
     
     def get_unread_count(self, obj):
+        # List views compute the counts for a whole page in one query
+        unread_counts = self.context.get('unread_counts')
+        if unread_counts is not None:
+            return unread_counts.get(obj.pk, 0)
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return obj.unread_count(request.user)
         return 0
 
+class ThreadParticipantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'profile_picture']
+
+class MessageThreadListSerializer(MessageThreadSerializer):
+    """Inbox row: the denormalized summary and compact related objects, with no per-row queries."""
+    participants = ThreadParticipantSerializer(many=True, read_only=True)
+    created_by = serializers.PrimaryKeyRelatedField(read_only=True)
+    event = serializers.SerializerMethodField()
+    club = serializers.SerializerMethodField()
+    
+    class Meta(MessageThreadSerializer.Meta):
+        fields = MessageThreadSerializer.Meta.fields + ['message_count']
+    
+    def get_last_message(self, obj):
+        if obj.last_message_at:
+            return {
+                'id': obj.last_message_id,
+                'content': obj.last_message_preview,
+                'sender': ThreadParticipantSerializer(obj.last_message_sender).data if obj.last_message_sender else None,
+                'created_at': obj.last_message_at,
+                'message_type': obj.last_message_type
+            }
+        return None
+    
+    def get_event(self, obj):
+        if obj.event:
+            return {'id': obj.event.id, 'title': obj.event.title, 'slug': obj.event.slug}
+        return None
+    
+    def get_club(self, obj):
+        if obj.club:
+            return {'id': obj.club.id, 'name': obj.club.name, 'slug': obj.club.slug, 'logo': obj.club.logo}
+        return None
+
 class CreateMessageThreadSerializer(serializers.ModelSerializer):
     participant_ids = serializers.ListField(
         child=serializers.UUIDField(),
@@ -70,18 +114,22 @@ class CreateMessageThreadSerializer(serializers.ModelSerializer):
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserProfileSerializer(read_only=True)
-    thread = MessageThreadSerializer(read_only=True)
+    thread = serializers.SerializerMethodField()
     reactions = serializers.SerializerMethodField()
     read_receipts = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = [
-            'id', 'thread', 'sender', 'content', 'message_type',
+            'id', 'thread', 'seq', 'sender', 'content', 'message_type',
             'attachments', 'is_read', 'is_deleted', 'reactions',
             'read_receipts', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'seq', 'created_at', 'updated_at']
+    
+    def get_thread(self, obj):
+        # Just the id: messages are read within their thread, so nesting the whole thread repeated it per message
+        return {'id': str(obj.thread_id)}
     
     def get_reactions(self, obj):
         reactions = {}
@@ -94,15 +142,111 @@ class MessageSerializer(serializers.ModelSerializer):
         return reactions
     
     def get_read_receipts(self, obj):
-        receipts = obj.messagereadreceipt_set.all()
+        # Derived from the thread's read watermarks; list views pass them in context once per page,
+        # with the exact times of any legacy per-message receipts
+        states = self.context.get('read_states')
+        if states is None:
+            states = ReadStateService.read_states(obj.thread_id)
+        receipt_times = self.context.get('receipt_times')
+        if receipt_times is None:
+            receipt_times = ReadStateService.receipt_times([obj.pk])
         return [
             {
-                'user': UserProfileSerializer(receipt.user).data,
-                'read_at': receipt.read_at
+                'user': UserProfileSerializer(state.user).data,
+                'read_at': receipt_times.get((obj.pk, state.user_id), state.read_at)
             }
-            for receipt in receipts
+            for state in ReadStateService.read_receipts(obj, states)
         ]
 
+class CompactMessageSerializer(serializers.ModelSerializer):
+    """
+    Wire format for message lists and pushes: ids instead of nested thread
+    and user objects, reaction counts and reader ids. Use
+    compact_message_payload() to build a page with its side-loaded users.
+    """
+    thread_id = serializers.UUIDField(read_only=True)
+    sender_id = serializers.UUIDField(read_only=True)
+    reactions = serializers.SerializerMethodField()
+    my_reactions = serializers.SerializerMethodField()
+    read_by = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'thread_id', 'seq', 'sender_id', 'content', 'message_type',
+            'attachments', 'is_read', 'is_deleted', 'reactions', 'my_reactions',
+            'read_by', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+    
+    def get_reactions(self, obj):
+        return self.context['reactions'].get(obj.pk, {}).get('counts', {})
+    
+    def get_my_reactions(self, obj):
+        return self.context['reactions'].get(obj.pk, {}).get('mine', [])
+    
+    def get_read_by(self, obj):
+        states = self.context['read_states'].get(obj.thread_id, [])
+        return [str(state.user_id) for state in ReadStateService.read_receipts(obj, states)]
+
+def compact_message_payload(messages, viewer=None):
+    """
+    {'messages': [...], 'users': {id: user}} for `messages`, with a fixed
+    number of queries per page: reaction counts, read watermarks and the
+    referenced users are each loaded once.
+    """
+    messages = list(messages)
+    message_ids = [message.pk for message in messages if not message.archived]
+    
+    reactions = {}
+    for message in messages:
+        if message.archived:
+            # Archived messages carry their reactions with them
+            for reaction in message.reactions.all():
+                entry = reactions.setdefault(message.pk, {'counts': {}, 'mine': []})
+                entry['counts'][reaction.reaction_type] = entry['counts'].get(reaction.reaction_type, 0) + 1
+                if viewer and reaction.user_id == viewer.pk and reaction.reaction_type not in entry['mine']:
+                    entry['mine'].append(reaction.reaction_type)
+    for row in MessageReaction.objects.filter(message_id__in=message_ids).order_by().values(
+        'message_id', 'reaction_type'
+    ).annotate(
+        count=Count('id'),
+        mine=Count('id', filter=Q(user_id=viewer.pk if viewer else None))
+    ):
+        entry = reactions.setdefault(row['message_id'], {'counts': {}, 'mine': []})
+        entry['counts'][row['reaction_type']] = row['count']
+        if row['mine']:
+            entry['mine'].append(row['reaction_type'])
+    
+    read_states = ReadStateService.read_states_by_thread({message.thread_id for message in messages})
+    data = CompactMessageSerializer(
+        messages, many=True, context={'reactions': reactions, 'read_states': read_states}
+    ).data
+    
+    user_ids = {message.sender_id for message in messages}
+    for item in data:
+        user_ids.update(item['read_by'])
+    users = ThreadParticipantSerializer(User.objects.filter(id__in=user_ids), many=True).data
+    
+    return {
+        'messages': data,
+        'users': {str(user['id']): user for user in users},
+    }
+
+def message_event(message):
+    """
+    The thread group event for a new message. It carries both formats,
+    serialized once by the sender: each consumer forwards the compact one
+    if its client connected with `?compact=1`, as on the REST API, and the
+    default nested one otherwise.
+    """
+    payload = compact_message_payload([message])
+    return {
+        'type': 'message',
+        'message': MessageSerializer(message).data,
+        'compact': {'message': payload['messages'][0], 'users': payload['users']},
+    }
+
 class CreateMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
@@ -127,9 +271,6 @@ class CreateMessageSerializer(serializers.ModelSerializer):
             **validated_data
         )
         
-        # Update thread's updated_at
-        thread.save()  # This triggers auto_now
-        
         return message
 
 class MessageReactionSerializer(serializers.ModelSerializer):
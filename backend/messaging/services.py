@@ -0,0 +1,317 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+import logging
+import uuid
+
+from .models import Message, MessageArchive, MessageReadReceipt, MessageThread, ThreadReadState
+
+logger = logging.getLogger(__name__)
+
+
+class ReadStateService:
+    """
+    Per-(thread, user) read watermarks. Reading a thread moves one row
+    forward instead of writing a receipt per message; unread counts and
+    read receipts are derived by comparing message times to watermarks.
+    """
+
+    @staticmethod
+    def mark_read(thread_id, user, message=None):
+        """
+        Move `user`'s watermark in the thread up to `message` (default: the
+        latest message). Never moves it backwards. Returns the new
+        watermark time, or None if there was nothing to read.
+        """
+        if message is None:
+            message = Message.objects.filter(
+                thread_id=thread_id, is_deleted=False
+            ).order_by('-created_at').only('id', 'created_at', 'sender_id').first()
+            if message is None:
+                return None
+
+        with transaction.atomic():
+            if connection.vendor in ('sqlite', 'postgresql'):
+                ReadStateService._upsert_on_conflict(thread_id, user.pk, message)
+            else:
+                ReadStateService._upsert_fallback(thread_id, user.pk, message)
+
+            # Message.is_read means "seen by someone other than the sender"
+            Message.objects.filter(
+                thread_id=thread_id, is_read=False, created_at__lte=message.created_at
+            ).exclude(sender_id=user.pk).update(is_read=True)
+        return message.created_at
+
+    @staticmethod
+    def _upsert_on_conflict(thread_id, user_id, message):
+        """One INSERT ... ON CONFLICT (thread_id, user_id) DO UPDATE ... WHERE the watermark moves forward."""
+        meta = ThreadReadState._meta
+        qn = connection.ops.quote_name
+        table = qn(meta.db_table)
+        columns = ['id', 'thread', 'user', 'last_read_message', 'last_read_at', 'read_at', 'updated_at']
+        fields = [meta.get_field(name) for name in columns]
+        now = timezone.now()
+        values = [uuid.uuid4(), thread_id, user_id, message.pk, message.created_at, now, now]
+        params = [field.get_db_prep_value(value, connection) for field, value in zip(fields, values)]
+
+        last_read_at = qn(meta.get_field('last_read_at').column)
+        updates = ', '.join(
+            f"{qn(field.column)} = EXCLUDED.{qn(field.column)}" for field in fields[3:]
+        )
+        sql = (
+            f"INSERT INTO {table} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) "
+            f"ON CONFLICT ({qn(meta.get_field('thread').column)}, {qn(meta.get_field('user').column)}) "
+            f"DO UPDATE SET {updates} WHERE {table}.{last_read_at} < EXCLUDED.{last_read_at}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @staticmethod
+    def _upsert_fallback(thread_id, user_id, message):
+        now = timezone.now()
+        ThreadReadState.objects.filter(
+            thread_id=thread_id, user_id=user_id, last_read_at__lt=message.created_at
+        ).update(last_read_message=message, last_read_at=message.created_at, read_at=now, updated_at=now)
+        ThreadReadState.objects.bulk_create(
+            [ThreadReadState(
+                thread_id=thread_id, user_id=user_id, last_read_message=message,
+                last_read_at=message.created_at, read_at=now, updated_at=now
+            )],
+            ignore_conflicts=True
+        )
+
+    @staticmethod
+    def unread_counts(thread_ids, user):
+        """{thread_id: unread messages for `user`} for all `thread_ids` in one grouped query."""
+        watermark = ThreadReadState.objects.filter(
+            thread_id=OuterRef('thread_id'), user=user
+        ).values('last_read_at')[:1]
+        return dict(
+            Message.objects.filter(
+                thread_id__in=thread_ids, is_deleted=False
+            ).exclude(
+                sender=user
+            ).annotate(
+                watermark=Subquery(watermark)
+            ).filter(
+                Q(watermark__isnull=True) | Q(created_at__gt=F('watermark'))
+            ).order_by().values_list('thread_id').annotate(count=Count('id'))
+        )
+
+    @staticmethod
+    def read_states(thread_id):
+        """The thread's watermarks with their users, newest first: the input for read_receipts()."""
+        return list(ThreadReadState.objects.filter(
+            thread_id=thread_id
+        ).select_related('user').order_by('-last_read_at'))
+
+    @staticmethod
+    def read_states_by_thread(thread_ids):
+        """{thread_id: [watermarks]} for several threads in one query, without the users."""
+        states = {}
+        for state in ThreadReadState.objects.filter(thread_id__in=thread_ids):
+            states.setdefault(state.thread_id, []).append(state)
+        return states
+
+    @staticmethod
+    def receipt_times(message_ids):
+        """{(message_id, user_id): read_at} from the legacy per-message receipts, in one query."""
+        return {
+            (message_id, user_id): read_at
+            for message_id, user_id, read_at in MessageReadReceipt.objects.filter(
+                message_id__in=message_ids
+            ).values_list('message_id', 'user_id', 'read_at')
+        }
+
+    @staticmethod
+    def read_receipts(message, states):
+        """Participants other than the sender whose watermark covers `message`."""
+        return [
+            state for state in states
+            if state.user_id != message.sender_id and state.last_read_at >= message.created_at
+        ]
+
+
+class ThreadSummaryService:
+    """
+    Keeps MessageThread's denormalized summary (last message id, preview,
+    type, sender and time, plus the message count) in step with its
+    messages, so the inbox reads it straight off the thread row. Archived
+    messages still count; one that is last keeps its preview but no id.
+    """
+
+    @staticmethod
+    def summary_fields(message):
+        if message is None:
+            return {
+                'last_message': None, 'last_message_preview': '', 'last_message_type': '',
+                'last_message_sender': None, 'last_message_at': None,
+            }
+        return {
+            'last_message': None if message.archived else message.pk,
+            'last_message_preview': message.content[:100],
+            'last_message_type': message.message_type,
+            'last_message_sender': message.sender_id,
+            'last_message_at': message.created_at,
+        }
+
+    @staticmethod
+    def record_created(message):
+        """Count a new message and make it the thread's last message unless a later one exists."""
+        if message.is_deleted:
+            return
+        now = timezone.now()
+        threads = MessageThread.objects.filter(pk=message.thread_id)
+        threads.update(message_count=F('message_count') + 1, updated_at=now)
+        threads.filter(
+            Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.created_at)
+        ).update(**ThreadSummaryService.summary_fields(message))
+
+    @staticmethod
+    def refresh(thread_ids):
+        """Recompute the summary of `thread_ids` from their messages, e.g. after a delete."""
+        from . import archive
+        
+        thread_ids = list(MessageThread.objects.filter(pk__in=set(thread_ids)).values_list('pk', flat=True))
+        if not thread_ids:
+            return
+        visible = Message.objects.filter(thread_id__in=thread_ids, is_deleted=False)
+        counts = dict(visible.order_by().values_list('thread_id').annotate(count=Count('id')))
+        archived = dict(MessageArchive.objects.filter(
+            thread_id__in=thread_ids
+        ).order_by().values_list('thread_id').annotate(count=Sum('visible_count')))
+        for thread_id in thread_ids:
+            last = visible.filter(thread_id=thread_id).order_by('-created_at').only(
+                'id', 'content', 'message_type', 'sender_id', 'created_at'
+            ).first()
+            if last is None and archived.get(thread_id):
+                last = next(iter(archive.older(thread_id)), None)
+            MessageThread.objects.filter(pk=thread_id).update(
+                message_count=counts.get(thread_id, 0) + (archived.get(thread_id) or 0),
+                **ThreadSummaryService.summary_fields(last)
+            )
+
+
+class MessageHistoryService:
+    """
+    Keyset pagination over a thread's messages on (created_at, id), served
+    by the (thread, created_at) index: every page is a range scan from an
+    anchor message, however deep in the history it is. Older messages
+    than the live rows hold come from the thread's archive chunks (see
+    messaging.archive), and so may the anchors.
+    """
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    @staticmethod
+    def page(thread_id, before=None, after=None, around=None, limit=PAGE_SIZE):
+        """
+        Up to `limit` visible messages in chronological order: those older
+        than `before`, newer than `after`, centred on `around` (anchor
+        included), or the newest ones. Anchors are Message instances.
+        Returns (messages, has_before, has_after).
+        """
+        from . import archive
+        
+        messages = Message.objects.filter(thread_id=thread_id, is_deleted=False)
+
+        # The archive holds a prefix of the history: nothing live precedes an archived
+        # message, and the archive only needs reading once the live rows run out
+        def older(anchor, count):
+            rows = []
+            if anchor is None or not anchor.archived:
+                live = messages if anchor is None else messages.filter(
+                    Q(created_at__lt=anchor.created_at) | Q(created_at=anchor.created_at, id__lt=anchor.id)
+                )
+                rows = list(live.order_by('-created_at', '-id')[:count + 1])
+            if len(rows) <= count:
+                rows += archive.older(thread_id, anchor, count + 1 - len(rows))
+            return rows[:count][::-1], len(rows) > count
+
+        def newer(anchor, count):
+            rows = archive.newer(thread_id, anchor, count + 1) if anchor.archived else []
+            if len(rows) <= count:
+                rows += list(messages.filter(
+                    Q(created_at__gt=anchor.created_at) | Q(created_at=anchor.created_at, id__gt=anchor.id)
+                ).order_by('created_at', 'id')[:count + 1 - len(rows)])
+            return rows[:count], len(rows) > count
+
+        if around is not None:
+            head, has_before = older(around, (limit - 1) // 2)
+            tail, has_after = newer(around, limit - 1 - len(head))
+            return head + ([around] if not around.is_deleted else []) + tail, has_before, has_after
+        if before is not None:
+            rows, has_before = older(before, limit)
+            return rows, has_before, True
+        if after is not None:
+            rows, has_after = newer(after, limit)
+            return rows, True, has_after
+
+        rows, has_before = older(None, limit)
+        return rows, has_before, False
+
+
+class MessageSyncService:
+    """
+    Replays what a reconnecting client missed. Every message carries its
+    thread's next sequence number (Message.seq), so the gap after a
+    client's last-seen seq is a range scan on (thread, seq).
+    """
+    BATCH_SIZE = 100
+    MAX_MESSAGES = 1000
+
+    @staticmethod
+    def parse_positions(positions):
+        """{thread_id: last seen seq} from client JSON. Raises ValueError."""
+        if not isinstance(positions, dict):
+            raise ValueError("Expected an object of thread ids to sequence numbers.")
+        parsed = {}
+        for thread_id, seq in positions.items():
+            try:
+                parsed[uuid.UUID(str(thread_id))] = max(int(seq), 0)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid sync position for thread "{thread_id}".')
+        return parsed
+
+    @staticmethod
+    def replay(user, positions, batch_size=BATCH_SIZE, max_messages=MAX_MESSAGES):
+        """
+        Batches of at most `batch_size` messages after each position, in seq
+        order, for the threads among `positions` that `user` is in, and at
+        most `max_messages` in total. Each batch is {'thread_id', 'messages',
+        'users', 'last_seq', 'has_more'}; a thread cut short by the limit ends
+        with has_more set and the client syncs again from there.
+        """
+        from .serializers import compact_message_payload
+
+        threads = MessageThread.objects.filter(
+            participants=user, pk__in=positions
+        ).values_list('pk', 'last_seq')
+
+        batches = []
+        budget = max_messages
+        for thread_id, last_seq in threads:
+            since = positions[thread_id]
+            while True:
+                count = min(batch_size, budget)
+                messages = []
+                if count and since < last_seq:
+                    messages = list(Message.objects.filter(
+                        thread_id=thread_id, seq__gt=since
+                    ).order_by('seq')[:count])
+                if messages:
+                    since = messages[-1].seq
+                    budget -= len(messages)
+                has_more = since < last_seq and len(messages) == count
+                payload = compact_message_payload(messages)
+                batches.append({
+                    'thread_id': str(thread_id),
+                    'messages': payload['messages'],
+                    'users': payload['users'],
+                    'last_seq': since,
+                    'has_more': has_more,
+                })
+                if not has_more or not budget:
+                    break
+        return batches
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Message
+from .services import ThreadSummaryService
+
+_refresh_paused = ContextVar('messaging_summary_refresh_paused', default=False)
+
+
+@contextmanager
+def summary_refresh_paused():
+    """Skip per-message summary refreshes, for bulk deletes that refresh their threads once at the end."""
+    token = _refresh_paused.set(True)
+    try:
+        yield
+    finally:
+        _refresh_paused.reset(token)
+
+
+def update_thread_summary(sender, instance, created, **kwargs):
+    if created:
+        ThreadSummaryService.record_created(instance)
+    else:
+        # Edits and soft deletes may change the preview, the count or which message is last
+        ThreadSummaryService.refresh([instance.thread_id])
+
+
+def refresh_thread_summary(sender, instance, **kwargs):
+    if _refresh_paused.get():
+        return
+    # Deferred so a cascade deleting the thread itself has finished first
+    thread_id = instance.thread_id
+    transaction.on_commit(lambda: ThreadSummaryService.refresh([thread_id]))
+
+
+post_save.connect(update_thread_summary, sender=Message, dispatch_uid='messaging_thread_summary_save')
+post_delete.connect(refresh_thread_summary, sender=Message, dispatch_uid='messaging_thread_summary_delete')
@@ -1,3 +1,573 @@
+from django.apps import apps
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+import asyncio
+import importlib
+import json
 
-# Create your tests here.
+from clubs.models import Club
+from users.models import User
+from .models import MessageArchive, MessageReaction, MessageReadReceipt, MessageThread, Message, ThreadReadState
+from .serializers import MessageSerializer, compact_message_payload
+from .services import MessageHistoryService, MessageSyncService, ReadStateService
+from . import archive, search
+from websocket.presence import PresenceService, PresenceStore
+from websocket.typing_indicators import TypingCoalescer
+
+
+class ThreadInboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.others = [
+            User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(3)
+        ]
+        self.club = Club.objects.create(name='Chess', slug='chess', description='Chess club')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_threads(self, count):
+        now = timezone.now()
+        for i in range(count):
+            thread = MessageThread.objects.create(
+                thread_type='club', club=self.club, created_by=self.user, name=f'Thread {i}'
+            )
+            thread.participants.set([self.user, *self.others])
+            for j, sender in enumerate(self.others):
+                Message.objects.create(
+                    thread=thread, sender=sender, content=f'Message {j}',
+                    created_at=now - timedelta(minutes=i * 10 + 3 - j)
+                )
+
+    def list_inbox(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messaging/threads/')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_inbox_query_count_is_fixed(self):
+        self.make_threads(2)
+        _, few = self.list_inbox()
+        self.make_threads(10)
+        results, many = self.list_inbox()
+        self.assertEqual(len(results), 12)
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 3)
+
+    def test_summary_follows_creates_and_deletes(self):
+        self.make_threads(1)
+        thread = MessageThread.objects.get()
+        self.assertEqual(thread.message_count, 3)
+        self.assertEqual(thread.last_message_preview, 'Message 2')
+        self.assertEqual(thread.last_message_sender, self.others[2])
+
+        last = thread.last_message
+        last.is_deleted = True
+        last.save()
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 2)
+        self.assertEqual(thread.last_message_preview, 'Message 1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(thread=thread, content='Message 1').delete()
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 1)
+        self.assertEqual(thread.last_message_preview, 'Message 0')
+
+    def test_unread_counts_follow_watermark(self):
+        self.make_threads(1)
+        thread = MessageThread.objects.get()
+        results, _ = self.list_inbox()
+        self.assertEqual(results[0]['unread_count'], 3)
+        self.assertEqual(results[0]['last_message']['content'], 'Message 2')
+
+        ReadStateService.mark_read(thread.pk, self.user, thread.messages.get(content='Message 1'))
+        results, _ = self.list_inbox()
+        self.assertEqual(results[0]['unread_count'], 1)
+
+    def test_mark_read_rejects_malformed_message_ids(self):
+        self.make_threads(1)
+        thread = MessageThread.objects.get()
+        url = f'/api/messaging/threads/{thread.id}/mark_read/'
+        response = self.client.post(url, {'message_id': 'not-a-uuid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'message_id': str(thread.messages.get(content='Message 1').id)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unread_count'], 1)
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.other = User.objects.create(email='writer@example.com', username='writer')
+        self.thread = MessageThread.objects.create(thread_type='direct', created_by=self.user)
+        self.thread.participants.set([self.user, self.other])
+        start = timezone.now() - timedelta(hours=1)
+        # Pairs share a timestamp so the id tiebreak is exercised
+        self.messages = sorted(
+            [
+                Message.objects.create(
+                    thread=self.thread, sender=self.other, content=f'Message {i}',
+                    created_at=start + timedelta(seconds=i // 2)
+                )
+                for i in range(30)
+            ],
+            key=lambda message: (message.created_at, str(message.id))
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def history(self, **params):
+        response = self.client.get(f'/api/messaging/threads/{self.thread.id}/messages/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, messages):
+        return [str(message.id) for message in messages]
+
+    def test_pages_walk_the_whole_history(self):
+        page = self.history(limit=7)
+        seen = [item['id'] for item in page['results']]
+        self.assertFalse(page['has_after'])
+        while page['has_before']:
+            page = self.history(limit=7, before=page['before'])
+            seen = [item['id'] for item in page['results']] + seen
+        self.assertEqual(seen, self.ids(self.messages))
+
+        page = self.history(limit=10, after=str(self.messages[4].id))
+        self.assertEqual([item['id'] for item in page['results']], self.ids(self.messages[5:15]))
+        self.assertTrue(page['has_after'])
+
+    def test_around_centres_on_the_anchor(self):
+        anchor = self.messages[10]
+        messages, has_before, has_after = MessageHistoryService.page(self.thread.id, around=anchor, limit=5)
+        self.assertEqual(messages, self.messages[8:13])
+        self.assertTrue(has_before and has_after)
+
+    def test_unknown_anchor_is_rejected(self):
+        response = self.client.get(
+            f'/api/messaging/threads/{self.thread.id}/messages/', {'before': 'not-a-message'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageArchiveTests(MessageHistoryTests):
+    """The history tests again, with everything but the newest message archived in small chunks."""
+
+    def setUp(self):
+        super().setUp()
+        MessageReaction.objects.create(message=self.messages[3], user=self.user, reaction_type='like')
+        self.metrics = archive.archive(archive_after_days=0, chunk_size=4)
+        self.messages = archive.messages(self.thread.id) + list(Message.objects.filter(thread=self.thread))
+
+    def test_archive_moves_all_but_the_last_message(self):
+        self.assertEqual(self.metrics['messages'], 29)
+        self.assertEqual(self.metrics['chunks'], 8)
+        self.assertEqual(list(Message.objects.filter(thread=self.thread)), [self.messages[-1]])
+        self.assertEqual(sum(MessageArchive.objects.values_list('message_count', flat=True)), 29)
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 30)
+        self.assertEqual(self.thread.last_message_id, self.messages[-1].id)
+        self.assertEqual(self.thread.last_seq, 30)
+        # The search index follows the deletes
+        self.assertEqual(search.search(self.user, 'Message 3')['hits'], [])
+
+    def test_archived_messages_keep_their_fields_and_reactions(self):
+        data = self.history(limit=30, compact=1)
+        self.assertEqual([item['id'] for item in data['messages']], self.ids(self.messages))
+        self.assertEqual([item['seq'] for item in data['messages']], [message.seq for message in self.messages])
+        self.assertEqual(data['messages'][3]['reactions'], {'like': 1})
+        self.assertEqual(data['messages'][3]['my_reactions'], ['like'])
+        self.assertEqual(data['messages'][3]['created_at'], self.history(limit=30)['results'][3]['created_at'])
+
+    def test_full_history_pages_decode_only_their_chunks(self):
+        response = self.client.get(f'/api/messaging/threads/{self.thread.id}/messages/')
+        self.assertEqual([item['id'] for item in response.data], self.ids(self.messages))
+
+        history = archive.history(self.thread.id, Message.objects.filter(thread=self.thread).order_by('created_at', 'id'))
+        self.assertEqual(len(history), 30)
+        archive._chunk.cache_clear()
+        self.assertEqual(self.ids(history[5:10]), self.ids(self.messages[5:10]))
+        self.assertEqual(archive._chunk.cache_info().misses, 2)
+        self.assertEqual(self.ids(history[27:35]), self.ids(self.messages[27:]))
+        self.assertEqual(history[-1], self.messages[-1])
+
+    def test_inactive_thread_is_archived_whole(self):
+        self.thread.is_active = False
+        self.thread.save()
+        archive.archive()
+        self.assertFalse(Message.objects.filter(thread=self.thread).exists())
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 30)
+        self.assertIsNone(self.thread.last_message_id)
+        self.assertEqual(self.thread.last_message_preview, self.messages[-1].content)
+        messages, has_before, _ = MessageHistoryService.page(self.thread.id, limit=30)
+        self.assertEqual(messages, self.messages)
+        self.assertFalse(has_before)
+
+
+class ReadReceiptTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.other = User.objects.create(email='writer@example.com', username='writer')
+        self.thread = MessageThread.objects.create(thread_type='direct', created_by=self.user)
+        self.thread.participants.set([self.user, self.other])
+        self.start = timezone.now() - timedelta(hours=1)
+        self.messages = [
+            Message.objects.create(
+                thread=self.thread, sender=self.other, content=f'Message {i}',
+                created_at=self.start + timedelta(minutes=i)
+            )
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.other)
+
+    def receipt(self, message, user, minutes):
+        return MessageReadReceipt.objects.create(
+            message=message, user=user, read_at=self.start + timedelta(minutes=minutes)
+        )
+
+    def test_backfill_turns_receipts_into_watermarks_in_fixed_queries(self):
+        migration = importlib.import_module('messaging.migrations.0002_thread_read_state')
+        self.receipt(self.messages[0], self.user, 10)
+        self.receipt(self.messages[2], self.user, 20)
+        second = MessageThread.objects.create(thread_type='direct', created_by=self.other)
+        reply = Message.objects.create(thread=second, sender=self.user, content='Reply', created_at=self.start)
+        self.receipt(reply, self.other, 5)
+
+        with self.assertNumQueries(3):
+            migration.backfill_read_states(apps, None)
+
+        state = ThreadReadState.objects.get(thread=self.thread, user=self.user)
+        self.assertEqual(state.last_read_message, self.messages[2])
+        self.assertEqual(state.last_read_at, self.messages[2].created_at)
+        self.assertEqual(state.read_at, self.start + timedelta(minutes=20))
+        state = ThreadReadState.objects.get(thread=second, user=self.other)
+        self.assertEqual(state.last_read_message, reply)
+        # The receipts stay as per-message history
+        self.assertEqual(MessageReadReceipt.objects.count(), 3)
+
+    def test_receipts_report_when_messages_were_read(self):
+        self.receipt(self.messages[0], self.user, 10)
+        ReadStateService.mark_read(self.thread.pk, self.user, self.messages[1])
+        marked = ThreadReadState.objects.get(user=self.user).read_at
+        ThreadReadState.objects.filter(user=self.user).update(updated_at=self.start)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/messaging/threads/{self.thread.id}/messages/')
+        self.assertEqual(response.status_code, 200)
+        # The legacy receipts are loaded once for the page
+        self.assertEqual(sum('messaging_messagereadreceipt' in query['sql'] for query in queries), 1)
+        receipts = {item['content']: item['read_receipts'] for item in response.data}
+        self.assertEqual(receipts['Message 0'][0]['read_at'], self.start + timedelta(minutes=10))
+        self.assertEqual(receipts['Message 1'][0]['read_at'], marked)
+        self.assertEqual(receipts['Message 1'][0]['user']['email'], self.user.email)
+        self.assertEqual(receipts['Message 2'], [])
+
+
+class MessagePayloadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.others = [
+            User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(3)
+        ]
+        self.thread = MessageThread.objects.create(thread_type='group', created_by=self.user, name='Group')
+        self.thread.participants.set([self.user, *self.others])
+
+    def send(self, count):
+        return [
+            Message.objects.create(thread=self.thread, sender=self.others[i % 3], content=f'Message {i}')
+            for i in range(count)
+        ]
+
+    def test_default_format_nests_users_but_not_the_thread(self):
+        messages = self.send(2)
+        ReadStateService.mark_read(self.thread.pk, self.user, messages[-1])
+        data = MessageSerializer(messages, many=True).data
+        self.assertEqual(data[0]['thread'], {'id': str(self.thread.pk)})
+        self.assertEqual(data[0]['sender']['email'], 'member0@example.com')
+        self.assertEqual([receipt['user']['id'] for receipt in data[1]['read_receipts']], [str(self.user.pk)])
+
+    def test_compact_format_side_loads_users_in_fixed_queries(self):
+        self.send(2)
+        with CaptureQueriesContext(connection) as few:
+            compact_message_payload(Message.objects.all(), self.user)
+        messages = self.send(10)
+        ReadStateService.mark_read(self.thread.pk, self.user, messages[-1])
+        with CaptureQueriesContext(connection) as many:
+            payload = compact_message_payload(Message.objects.all(), self.user)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(payload['messages']), 12)
+        first = payload['messages'][0]
+        self.assertEqual((first['thread_id'], first['sender_id']), (str(self.thread.pk), str(self.others[0].pk)))
+        self.assertEqual(first['read_by'], [str(self.user.pk)])
+        self.assertEqual(set(payload['users']), {str(user.pk) for user in [self.user, *self.others]})
+
+    def test_websocket_sends_each_connection_the_format_it_asked_for(self):
+        from channels.testing import WebsocketCommunicator
+        from websocket.consumers import MessageConsumer
+
+        def connect(user, query=''):
+            token = Token.objects.create(user=user)
+            return WebsocketCommunicator(MessageConsumer.as_asgi(), f'/ws/messages/?token={token.key}{query}')
+
+        sender = connect(self.others[0])
+        default = connect(self.user)
+        compact = connect(self.others[1], '&compact=1')
+
+        async def scenario():
+            for communicator in (sender, default, compact):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+                await communicator.send_json_to({'type': 'join_room', 'room': str(self.thread.pk)})
+            await sender.send_json_to({'type': 'send_message', 'thread_id': str(self.thread.pk), 'content': 'Hi'})
+            frames = [await communicator.receive_json_from(timeout=5) for communicator in (default, compact)]
+            for communicator in (sender, default, compact):
+                await communicator.disconnect()
+            return frames
+
+        full, short = async_to_sync(scenario)()
+        message = Message.objects.get(content='Hi')
+        self.assertEqual(full['type'], 'message')
+        self.assertEqual(full['message']['id'], str(message.pk))
+        self.assertEqual(full['message']['thread'], {'id': str(self.thread.pk)})
+        self.assertEqual(full['message']['sender']['id'], str(self.others[0].pk))
+        self.assertNotIn('users', full)
+        self.assertEqual(short['message']['id'], str(message.pk))
+        self.assertEqual(short['message']['sender_id'], str(self.others[0].pk))
+        self.assertEqual(list(short['users']), [str(self.others[0].pk)])
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.other = User.objects.create(email='writer@example.com', username='writer')
+        self.thread = MessageThread.objects.create(thread_type='direct', created_by=self.user, name='Planning')
+        self.thread.participants.set([self.user, self.other])
+        self.hidden = MessageThread.objects.create(thread_type='direct', created_by=self.other)
+        self.hidden.participants.set([self.other])
+        for i in range(5):
+            Message.objects.create(thread=self.thread, sender=self.other, content=f'Budget review number {i}')
+        Message.objects.create(thread=self.thread, sender=self.other, content='Lunch at <noon>?')
+        Message.objects.create(thread=self.hidden, sender=self.other, content='Budget secrets')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/messaging/threads/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_results_are_scoped_paged_and_highlighted(self):
+        page = self.search(q='budg', limit=3)
+        seen = [hit['message']['id'] for hit in page['results']]
+        self.assertIn('<mark>Budget</mark>', page['results'][0]['snippet'])
+        self.assertEqual(page['results'][0]['thread']['name'], 'Planning')
+        while page['cursor']:
+            page = self.search(q='budg', limit=3, cursor=page['cursor'])
+            seen += [hit['message']['id'] for hit in page['results']]
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+        snippet = self.search(q='lunch')['results'][0]['snippet']
+        self.assertIn('&lt;noon&gt;', snippet)
+
+    def test_index_follows_edits_and_soft_deletes(self):
+        message = Message.objects.get(content='Budget review number 0')
+        message.content = 'Quarterly forecast'
+        message.save()
+        self.assertEqual(len(self.search(q='forecast')['results']), 1)
+        self.assertEqual(len(self.search(q='budget')['results']), 4)
+
+        message.is_deleted = True
+        message.save()
+        self.assertEqual(self.search(q='forecast')['results'], [])
+
+    def test_like_fallback(self):
+        available = search._fts_available
+        search._fts_available = False
+        try:
+            page = self.search(q='budget', limit=4)
+            self.assertEqual(len(page['results']), 4)
+            page = self.search(q='budget', limit=4, cursor=page['cursor'])
+            self.assertEqual(len(page['results']), 1)
+        finally:
+            search._fts_available = available
+
+
+class MessageSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='reader@example.com', username='reader')
+        self.other = User.objects.create(email='writer@example.com', username='writer')
+        self.threads = []
+        for name in ('first', 'second'):
+            thread = MessageThread.objects.create(thread_type='direct', created_by=self.user, name=name)
+            thread.participants.set([self.user, self.other])
+            self.threads.append(thread)
+        self.hidden = MessageThread.objects.create(thread_type='direct', created_by=self.other)
+        self.hidden.participants.set([self.other])
+        for i in range(7):
+            for thread in (*self.threads, self.hidden):
+                Message.objects.create(thread=thread, sender=self.other, content=f'Message {i}')
+
+    def test_seq_is_dense_per_thread(self):
+        for thread in self.threads:
+            self.assertEqual(list(thread.messages.order_by('seq').values_list('seq', flat=True)), list(range(1, 8)))
+            thread.refresh_from_db()
+            self.assertEqual(thread.last_seq, 7)
+
+    def test_replay_fills_the_gap_in_bounded_batches(self):
+        first, second = self.threads
+        positions = MessageSyncService.parse_positions({
+            str(first.id): 2, str(second.id): 7, str(self.hidden.id): 0
+        })
+        batches = MessageSyncService.replay(self.user, positions, batch_size=2)
+        replayed = [batch for batch in batches if batch['thread_id'] == str(first.id)]
+        self.assertEqual(
+            [message['seq'] for batch in replayed for message in batch['messages']], [3, 4, 5, 6, 7]
+        )
+        self.assertTrue(all(len(batch['messages']) <= 2 for batch in replayed))
+        self.assertFalse(replayed[-1]['has_more'])
+        caught_up = [batch for batch in batches if batch['thread_id'] == str(second.id)]
+        self.assertEqual(caught_up, [{
+            'thread_id': str(second.id), 'messages': [], 'users': {}, 'last_seq': 7, 'has_more': False
+        }])
+        self.assertNotIn(str(self.hidden.id), [batch['thread_id'] for batch in batches])
+
+    def test_replay_stops_at_the_message_limit(self):
+        first = self.threads[0]
+        batches = MessageSyncService.replay(self.user, {first.id: 0}, batch_size=2, max_messages=3)
+        self.assertEqual(sum(len(batch['messages']) for batch in batches), 3)
+        self.assertTrue(batches[-1]['has_more'])
+        self.assertEqual(batches[-1]['last_seq'], 3)
+
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.frames = []
+
+    async def group_send(self, group, frame):
+        self.frames.append((group, frame))
+
+
+class TypingCoalescerTests(TestCase):
+    def setUp(self):
+        self.layer = RecordingLayer()
+        self.typing = TypingCoalescer(interval=0.05, ttl=0.4)
+
+    def run_async(self, scenario):
+        async def run():
+            await scenario()
+            # Let the per-thread ticker finish
+            for _ in range(40):
+                if not self.typing._threads:
+                    break
+                await asyncio.sleep(0.05)
+        asyncio.run(run())
+
+    def test_keystrokes_coalesce_into_one_frame_per_interval(self):
+        async def scenario():
+            for _ in range(20):
+                await self.typing.update(self.layer, 't1', 'alice')
+            await self.typing.update(self.layer, 't1', 'bob')
+            # Leading edge: alice went out at once, bob waits for the interval
+            self.assertEqual([frame['typing'] for _, frame in self.layer.frames], [['alice']])
+            await asyncio.sleep(0.12)
+            self.assertEqual(self.layer.frames[-1][1]['typing'], ['alice', 'bob'])
+            self.assertEqual(self.typing.typing_in('t1'), ['alice', 'bob'])
+            await self.typing.update(self.layer, 't1', 'alice', is_typing=False)
+            await self.typing.update(self.layer, 't1', 'bob', is_typing=False)
+
+        self.run_async(scenario)
+        group, last = self.layer.frames[-1]
+        self.assertEqual(group, 'thread_t1')
+        self.assertEqual((last['typing'], last['stopped']), ([], ['alice', 'bob']))
+        self.assertLessEqual(len(self.layer.frames), 4)
+        self.assertEqual(self.typing._threads, {})
+
+    def test_silent_typers_expire(self):
+        async def scenario():
+            await self.typing.update(self.layer, 't1', 'alice')
+
+        self.run_async(scenario)
+        self.assertEqual(self.layer.frames[-1][1]['stopped'], ['alice'])
+        self.assertEqual(self.typing.typing_in('t1'), [])
+
+    def test_stop_without_typing_sends_nothing(self):
+        async def scenario():
+            await self.typing.update(self.layer, 't1', 'alice', is_typing=False)
+
+        self.run_async(scenario)
+        self.assertEqual(self.layer.frames, [])
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.store = PresenceStore(connection_timeout=90, worker_timeout=45)
+        self.store.subscribe('watcher', ['alice'])
+
+    def test_connections_drive_online_state(self):
+        self.store.connect('alice', 'tab-1', 0)
+        self.store.connect('alice', 'tab-2', 1)
+        self.store.disconnect('alice', 'tab-1', 2)
+        self.assertTrue(self.store.is_online('alice'))
+        self.store.disconnect('alice', 'tab-2', 3)
+        self.assertFalse(self.store.is_online('alice'))
+        self.assertEqual(self.store.last_seen('alice'), 3)
+        # Online then offline within one flush nets out to the last state
+        self.assertEqual(self.store.drain(), {'watcher': [{'user_id': 'alice', 'online': False, 'last_seen': 3}]})
+
+    def test_heartbeats_keep_connections_open(self):
+        self.store.connect('alice', 'tab-1', 0)
+        self.assertTrue(self.store.heartbeat('alice', 'tab-1', 80))
+        self.assertEqual(self.store.expire(100), 0)
+        self.assertEqual(self.store.expire(200), 1)
+        self.assertFalse(self.store.is_online('alice'))
+
+    def test_heartbeat_after_expiry_is_ignored(self):
+        self.store.connect('alice', 'tab-1', 0)
+        self.store.expire(100)
+        self.assertFalse(self.store.heartbeat('alice', 'tab-1', 101))
+        self.assertFalse(self.store.heartbeat('bob', 'never-connected', 101))
+        self.assertEqual(self.store.online_among(['alice', 'bob']), [])
+
+    def test_remote_workers_count_until_they_go_quiet(self):
+        self.store.apply_snapshot('worker-1', ['alice'], 0)
+        self.store.apply_snapshot('worker-2', ['alice'], 0)
+        self.store.apply_snapshot('worker-1', [], 10)
+        self.assertTrue(self.store.is_online('alice'))
+        self.store.expire(60)
+        self.assertFalse(self.store.is_online('alice'))
+
+    def test_receive_loop_survives_a_bad_message(self):
+        class Layer:
+            def __init__(self):
+                self.messages = [{'type': 'presence.snapshot'}, {
+                    'type': 'presence.snapshot', 'worker': 'other', 'online': ['alice']
+                }]
+
+            async def receive(self, channel):
+                if not self.messages:
+                    await asyncio.Event().wait()
+                return self.messages.pop(0)
+
+        service = PresenceService(store=self.store, flush_interval=0)
+        service.layer, service.channel = Layer(), 'presence-channel'
+
+        async def run():
+            task = asyncio.ensure_future(service._receive())
+            for _ in range(5):
+                await asyncio.sleep(0)
+            task.cancel()
+
+        with self.assertLogs('websocket.presence', 'ERROR'):
+            asyncio.run(run())
+        self.assertTrue(self.store.is_online('alice'))
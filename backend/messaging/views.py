@@ -1,14 +1,26 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db.models import Q, Count, Max
+from django.db.models import Q, Count, F
+import uuid
 
-from .models import MessageThread, Message, MessageReadReceipt, MessageReaction
+from .models import MessageThread, Message, MessageReaction
 from .serializers import (
-    MessageThreadSerializer, CreateMessageThreadSerializer,
-    MessageSerializer, CreateMessageSerializer, MessageReactionSerializer
+    MessageThreadSerializer, MessageThreadListSerializer, CreateMessageThreadSerializer,
+    MessageSerializer, CreateMessageSerializer, MessageReactionSerializer,
+    compact_message_payload
 )
+from .services import MessageHistoryService, ReadStateService
+from . import archive as message_archive
+from . import search as message_search
+from analytics.counters import activity_counter
+
+
+def wants_compact(request):
+    """`?compact=1` selects the compact message format (ids, counts and a side-loaded users map)."""
+    return request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
 
 class MessageThreadViewSet(viewsets.ModelViewSet):
     serializer_class = MessageThreadSerializer
@@ -17,18 +29,23 @@ class MessageThreadViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateMessageThreadSerializer
+        if self.action == 'list':
+            return MessageThreadListSerializer
         return super().get_serializer_class()
     
     def get_queryset(self):
         user = self.request.user
         
-        # Get threads where user is a participant
+        # Get threads where user is a participant, ordered by the denormalized last message time
         queryset = MessageThread.objects.filter(
             participants=user,
             is_active=True
-        ).annotate(
-            last_message_time=Max('messages__created_at')
-        ).order_by('-last_message_time')
+        ).order_by(F('last_message_at').desc(nulls_last=True), '-created_at')
+        
+        if self.action == 'list':
+            queryset = queryset.select_related(
+                'event', 'club', 'last_message_sender'
+            ).prefetch_related('participants')
         
         # Filter by thread type if provided
         thread_type = self.request.query_params.get('type')
@@ -47,6 +64,20 @@ class MessageThreadViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        threads = page if page is not None else list(queryset)
+        
+        # Unread counts for the whole page in one query against the read watermarks
+        context = self.get_serializer_context()
+        context['unread_counts'] = ReadStateService.unread_counts([thread.pk for thread in threads], request.user)
+        serializer = MessageThreadListSerializer(threads, many=True, context=context)
+        
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -57,6 +88,42 @@ class MessageThreadViewSet(viewsets.ModelViewSet):
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'Search query is required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            limit = min(max(int(request.query_params.get('limit', message_search.PAGE_SIZE)), 1), message_search.MAX_PAGE_SIZE)
+            result = message_search.search(request.user, query, request.query_params.get('cursor'), limit)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        messages = [message for message, _, _ in result['hits']]
+        payload = compact_message_payload(messages, request.user)
+        results = []
+        for (message, snippet, score), data in zip(result['hits'], payload['messages']):
+            results.append({
+                'message': data,
+                'snippet': snippet,
+                'score': score,
+                'thread': {
+                    'id': str(message.thread_id),
+                    'name': message.thread.name,
+                    'thread_type': message.thread.thread_type,
+                },
+            })
+        
+        return Response({
+            'results': results,
+            'users': payload['users'],
+            'cursor': result['cursor'],
+        })
+    
     @action(detail=True, methods=['post'])
     def add_participant(self, request, pk=None):
         thread = self.get_object()
@@ -178,20 +245,122 @@ class MessageThreadViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        messages = thread.messages.filter(is_deleted=False).order_by('created_at')
+        if any(param in request.query_params for param in ('before', 'after', 'around', 'limit')):
+            return self._message_history(request, thread)
+        
+        messages = thread.messages.filter(is_deleted=False).order_by('created_at', 'id')
+        
+        # The full history includes what has been moved to the archive; a page decodes only the chunks it covers
+        messages = message_archive.history(thread.id, messages)
         
-        # Mark messages as read
-        unread_messages = messages.filter(is_read=False).exclude(sender=request.user)
-        for message in unread_messages:
-            message.mark_as_read(request.user)
+        # Mark messages as read: one watermark upsert for the whole thread
+        ReadStateService.mark_read(thread.id, request.user)
+        
+        if wants_compact(request):
+            page = self.paginate_queryset(messages)
+            payload = compact_message_payload(page if page is not None else messages, request.user)
+            if page is not None:
+                return self.get_paginated_response(payload)
+            return Response(payload)
         
         page = self.paginate_queryset(messages)
+        rows = page if page is not None else list(messages)
+        context = {
+            'request': request,
+            'read_states': ReadStateService.read_states(thread.id),
+            'receipt_times': ReadStateService.receipt_times([message.pk for message in rows]),
+        }
+        
+        serializer = MessageSerializer(rows, many=True, context=context)
         if page is not None:
-            serializer = MessageSerializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        
-        serializer = MessageSerializer(messages, many=True)
         return Response(serializer.data)
+    
+    def _message_history(self, request, thread):
+        """Keyset page of `thread`'s history: ?before=, ?after= or ?around= a message id, and ?limit=."""
+        try:
+            limit = int(request.query_params.get('limit', MessageHistoryService.PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {'error': 'Limit must be an integer.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(max(limit, 1), MessageHistoryService.MAX_PAGE_SIZE)
+        
+        anchors = {}
+        for param in ('before', 'after', 'around'):
+            message_id = request.query_params.get(param)
+            if not message_id:
+                continue
+            try:
+                anchors[param] = thread.messages.only('id', 'created_at', 'is_deleted').get(id=message_id)
+            except (Message.DoesNotExist, ValidationError):
+                try:
+                    anchors[param] = message_archive.find(thread.id, uuid.UUID(message_id))
+                except ValueError:
+                    anchors[param] = None
+            if anchors[param] is None:
+                return Response(
+                    {'error': f'Message "{message_id}" not found in this thread.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        if len(anchors) > 1:
+            return Response(
+                {'error': 'Use only one of before, after and around.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        messages, has_before, has_after = MessageHistoryService.page(thread.id, limit=limit, **anchors)
+        
+        # Reading a page marks it read; the watermark never moves back for older pages,
+        # and archived pages are older than every live message
+        if messages and not messages[-1].archived:
+            ReadStateService.mark_read(thread.id, request.user, messages[-1])
+        
+        if wants_compact(request):
+            data = compact_message_payload(messages, request.user)
+        else:
+            context = {
+                'request': request,
+                'read_states': ReadStateService.read_states(thread.id),
+                'receipt_times': ReadStateService.receipt_times([message.pk for message in messages]),
+            }
+            data = {'results': MessageSerializer(messages, many=True, context=context).data}
+        
+        data.update({
+            'has_before': has_before,
+            'has_after': has_after,
+            'before': str(messages[0].id) if messages else None,
+            'after': str(messages[-1].id) if messages else None,
+        })
+        return Response(data)
+    
+    @action(detail=True, methods=['post'])
+    def mark_read(self, request, pk=None):
+        thread = self.get_object()
+        
+        message = None
+        message_id = request.data.get('message_id')
+        if message_id:
+            try:
+                message_id = uuid.UUID(str(message_id))
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid message id.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            message = thread.messages.filter(id=message_id).first()
+            if message is None:
+                return Response(
+                    {'error': 'Message not found in this thread.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        
+        last_read_at = ReadStateService.mark_read(thread.id, request.user, message)
+        return Response({
+            'last_read_at': last_read_at,
+            'unread_count': thread.unread_count(request.user)
+        })
 
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
@@ -211,6 +380,17 @@ class MessageViewSet(viewsets.ModelViewSet):
             is_deleted=False
         ).order_by('-created_at')
     
+    def list(self, request, *args, **kwargs):
+        if not wants_compact(request):
+            return super().list(request, *args, **kwargs)
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        payload = compact_message_payload(page if page is not None else queryset, request.user)
+        if page is not None:
+            return self.get_paginated_response(payload)
+        return Response(payload)
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -218,6 +398,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             serializer.context['thread_id'] = self.kwargs.get('thread_id')
             
             message = serializer.save()
+            activity_counter.increment(request.user, 'messages_sent')
+            if wants_compact(request):
+                return Response(compact_message_payload([message], request.user), status=status.HTTP_201_CREATED)
             return Response(
                 MessageSerializer(message, context={'request': request}).data,
                 status=status.HTTP_201_CREATED
@@ -0,0 +1,122 @@
+"""
+Channel delivery backends used by the notification outbox worker.
+
+NOTIFICATION_CHANNEL_BACKENDS maps a channel to a dotted backend path.
+A backend's ``send_messages(notifications)`` delivers a batch and returns
+``{notification_id: error}`` for the ones that failed. Raising fails the
+whole batch. Every failure is retried with backoff by the worker.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+import logging
+import threading
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKENDS = {
+    'email': 'notifications.backends.EmailBackend',
+    'push': 'notifications.backends.LogBackend',
+    'sms': 'notifications.backends.LogBackend',
+}
+
+# Messages "sent" through LocmemBackend, like django.core.mail.outbox
+outbox = []
+_outbox_lock = threading.Lock()
+
+
+class BaseChannelBackend:
+    def __init__(self, channel, **options):
+        self.channel = channel
+        self.options = options
+
+    def send_messages(self, notifications):
+        raise NotImplementedError
+
+    def send_digests(self, groups):
+        """
+        Deliver {recipient_id: [notifications]} as one combined message per
+        recipient. Returns {recipient_id: error} for the ones that failed.
+        """
+        digests = {recipient_id: build_digest(notifications) for recipient_id, notifications in groups.items()}
+        failures = self.send_messages(list(digests.values()))
+        return {
+            recipient_id: failures[digest.pk]
+            for recipient_id, digest in digests.items() if digest.pk in failures
+        }
+
+
+def build_digest(notifications):
+    """An unsaved notification summarising `notifications` (all for the same recipient), newest first."""
+    notifications = sorted(notifications, key=lambda notification: notification.updated_at, reverse=True)
+    total = sum(notification.count for notification in notifications)
+    return Notification(
+        recipient=notifications[0].recipient,
+        notification_type='system',
+        title=f"You have {total} new notification{'s' if total != 1 else ''}",
+        message='\n'.join(f'- {notification.title}: {notification.message}' for notification in notifications),
+        data={'digest': [str(notification.pk) for notification in notifications]},
+    )
+
+
+class LogBackend(BaseChannelBackend):
+    """One message at a time through the NotificationService senders (push and SMS still only log)."""
+
+    def send_messages(self, notifications):
+        from .services import NotificationService
+
+        senders = {
+            'email': NotificationService.send_email_notification,
+            'push': NotificationService.send_push_notification,
+            'sms': NotificationService.send_sms_notification,
+        }
+        failures = {}
+        for notification in notifications:
+            try:
+                senders[self.channel](notification.recipient, notification)
+            except Exception as e:
+                failures[notification.pk] = str(e)
+        return failures
+
+
+class EmailBackend(BaseChannelBackend):
+    """Email through Django's EMAIL_BACKEND, one connection per batch and one render per distinct notification."""
+
+    def send_messages(self, notifications):
+        from .mailer import render_notification_emails, send_messages
+
+        failures = {
+            notification.pk: 'Recipient has no email address'
+            for notification in notifications if not notification.recipient.email
+        }
+        deliverable = [notification for notification in notifications if notification.recipient.email]
+        for index, error in send_messages(render_notification_emails(deliverable)).items():
+            failures[deliverable[index].pk] = error
+        return failures
+
+
+class LocmemBackend(BaseChannelBackend):
+    """
+    Keeps deliveries in ``notifications.backends.outbox`` for tests and local
+    runs. Recipients whose email is in ``fail_recipients`` fail, so retry
+    paths can be exercised.
+    """
+    fail_recipients = set()
+
+    def send_messages(self, notifications):
+        failures = {}
+        with _outbox_lock:
+            for notification in notifications:
+                if notification.recipient.email in self.fail_recipients:
+                    failures[notification.pk] = f"Simulated {self.channel} failure"
+                else:
+                    outbox.append((self.channel, notification))
+        return failures
+
+
+def get_backend(channel):
+    backends = {**DEFAULT_BACKENDS, **getattr(settings, 'NOTIFICATION_CHANNEL_BACKENDS', {})}
+    if channel not in backends:
+        raise ValueError(f"No delivery backend configured for channel: {channel}")
+    return import_string(backends[channel])(channel)
@@ -0,0 +1,130 @@
+"""
+Coalescing of near-identical notifications.
+
+A rule per notification type gives a window and an optional related field
+to group by. A new notification whose recipient already has an unread row
+with the same coalesce key, created within the window, is folded into
+that row: ``count`` goes up, the title is rewritten from the rule, the
+message and related object become the latest ones and ``data['items']``
+keeps the most recent individual entries. Folded notifications get no new
+channel deliveries; a delivery still waiting in the outbox (or in a
+digest) picks up the merged content when it is sent. A rule with
+``redeliver`` set queues the row's external deliveries again on every
+merge instead, re-arming ones already sent.
+
+Event and booking reminders are not coalesced by default: every offset a
+user asked for is its own notification and its own email or push.
+
+Rules can be replaced with the NOTIFICATION_COALESCE_RULES setting.
+"""
+from django.conf import settings
+from datetime import timedelta
+
+from .models import Notification
+
+MAX_ITEMS = 20
+
+DEFAULT_RULES = {
+    'event_registration': {'window': 3600, 'group_by': None, 'title': '{count} event registrations confirmed'},
+    'event_update': {'window': 3600, 'group_by': 'event', 'title': '{count} updates to an event'},
+    'message': {'window': 600, 'group_by': 'message_thread', 'title': '{count} new messages'},
+    'announcement': {'window': 3600, 'group_by': 'club', 'title': '{count} new announcements'},
+}
+
+PRIORITY_ORDER = [priority for priority, _ in Notification.PRIORITY_LEVELS]
+RELATED_FIELDS = ['event', 'club', 'resource_booking', 'message_thread']
+MERGED_FIELDS = ['count', 'title', 'message', 'data', 'priority', 'expires_at', 'updated_at', 'version',
+                 *(f'{field}_id' for field in RELATED_FIELDS)]
+
+
+def get_rules():
+    return getattr(settings, 'NOTIFICATION_COALESCE_RULES', DEFAULT_RULES)
+
+
+def coalesce_key(notification, rule):
+    related = getattr(notification, f"{rule['group_by']}_id") if rule['group_by'] else ''
+    return f"{notification.notification_type}:{related or ''}"
+
+
+def _item(notification):
+    return {
+        'title': notification.title,
+        'message': notification.message,
+        'data': notification.data,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+def merge(target, notification, rule):
+    """Fold `notification` into `target` in place."""
+    items = target.data.get('items') if target.count > 1 else None
+    items = [_item(notification)] + (items or [_item(target)])
+    target.count += notification.count
+    target.title = rule['title'].format(count=target.count)
+    target.message = notification.message
+    target.data = {**notification.data, 'items': items[:MAX_ITEMS]}
+    target.updated_at = notification.created_at
+    if PRIORITY_ORDER.index(notification.priority) > PRIORITY_ORDER.index(target.priority):
+        target.priority = notification.priority
+    if notification.expires_at and target.expires_at and notification.expires_at > target.expires_at:
+        target.expires_at = notification.expires_at
+    for field in RELATED_FIELDS:
+        if getattr(notification, f'{field}_id'):
+            setattr(target, field, getattr(notification, field))
+
+
+def coalesce(notifications):
+    """
+    Split unsaved notifications into (new rows to create, existing rows to
+    update), folding each coalescible notification into an open row for
+    the same recipient and key: one loaded from the database with a single
+    query, or an earlier notification of the same batch.
+    """
+    rules = get_rules()
+    candidates = [notification for notification in notifications if notification.notification_type in rules]
+    if not candidates:
+        return notifications, []
+
+    for notification in candidates:
+        notification.coalesce_key = coalesce_key(notification, rules[notification.notification_type])
+        notification.updated_at = notification.created_at
+
+    oldest = min(
+        notification.created_at - timedelta(seconds=rules[notification.notification_type]['window'])
+        for notification in candidates
+    )
+    open_rows = {
+        (row.recipient_id, row.coalesce_key): row
+        for row in Notification.objects.filter(
+            recipient_id__in={notification.recipient_id for notification in candidates},
+            coalesce_key__in={notification.coalesce_key for notification in candidates},
+            is_read=False,
+            created_at__gte=oldest
+        ).order_by('created_at')
+    }
+
+    new, updated = [], {}
+    for notification in notifications:
+        rule = rules.get(notification.notification_type)
+        if rule is None:
+            new.append(notification)
+            continue
+
+        key = (notification.recipient_id, notification.coalesce_key)
+        target = open_rows.get(key)
+        if target is not None and target.created_at >= notification.created_at - timedelta(seconds=rule['window']):
+            merge(target, notification, rule)
+            if not target._state.adding:
+                updated[target.pk] = target
+        else:
+            new.append(notification)
+            open_rows[key] = notification
+    return new, list(updated.values())
+
+
+def save_merged(rows):
+    # One plain UPDATE per row: bulk_update's CASE WHEN per field and row costs far more to compile
+    for row in rows:
+        Notification.objects.filter(pk=row.pk).update(
+            **{field: getattr(row, field) for field in MERGED_FIELDS}
+        )
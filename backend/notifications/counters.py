@@ -0,0 +1,151 @@
+"""
+Denormalized per-user notification counts.
+
+NotificationCounter holds each user's unread and total notification
+counts so the header badge poll is a primary-key lookup instead of two
+COUNTs over the notification table. Every code path that creates, reads
+or deletes notifications applies its delta in the same transaction as
+the change itself: dispatch() fan-out, mark_read, mark_all_read, API
+deletes and the retention purge. Coalesced notifications merge into a
+row that is still unread, so they change neither count.
+
+Reads are the counter row alone. Expired notifications stop counting
+when the expiry sweep (purge_notifications --expired-only, run every
+minute or so) deletes them through the same path as any other delete, so
+the counts, the version and the sync tombstones all follow within one
+sweep interval. Anything that bypasses these paths (admin edits, raw
+SQL) is repaired by reconcile_notification_counters, which bumps the
+version of every counter it corrects so delta-sync clients pick up the
+new counts.
+
+The same row carries the user's change version for delta sync. Each of
+those paths bumps it once and stamps the version on every notification
+it writes (or on a tombstone for each one it deletes). The counter
+UPDATE locks the user's row until commit, so concurrent writers for one
+user get increasing versions in commit order.
+"""
+from collections import Counter
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationCounter, NotificationTombstone
+
+
+def apply(unread=None, total=None, touch=(), bump_version=True, batch_size=500):
+    """
+    Add {user_id: delta} changes to the unread and total counts and bump
+    the version of every user involved, including those in `touch` whose
+    counts don't change. Users sharing the same pair of deltas (all
+    recipients of one fan-out) are updated together, one UPDATE per
+    `batch_size` users. Pass bump_version=False to correct counts after a
+    write that bump() already versioned.
+    """
+    unread, total = unread or {}, total or {}
+    groups = {}
+    for user_id in set(unread) | set(total) | set(touch):
+        delta = (unread.get(user_id, 0), total.get(user_id, 0))
+        if bump_version or delta != (0, 0):
+            groups.setdefault(delta, []).append(user_id)
+    if not groups:
+        return
+
+    user_ids = [user_id for members in groups.values() for user_id in members]
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in user_ids],
+        batch_size=batch_size,
+        ignore_conflicts=True
+    )
+
+    changes = {'updated_at': timezone.now()}
+    if bump_version:
+        changes['version'] = F('version') + 1
+    for (unread_delta, total_delta), members in groups.items():
+        for i in range(0, len(members), batch_size):
+            NotificationCounter.objects.filter(user_id__in=members[i:i + batch_size]).update(
+                unread=Greatest(F('unread') + unread_delta, 0),
+                total=Greatest(F('total') + total_delta, 0),
+                **changes
+            )
+
+
+def versions(user_ids, batch_size=500):
+    """{user_id: current version}, read back after apply() in the same transaction."""
+    user_ids = list(user_ids)
+    result = {}
+    for i in range(0, len(user_ids), batch_size):
+        result.update(NotificationCounter.objects.filter(
+            user_id__in=user_ids[i:i + batch_size]
+        ).values_list('user_id', 'version'))
+    return result
+
+
+def bump(user_id, unread=0, total=0):
+    """apply() for one user; returns their new version."""
+    apply(unread={user_id: unread}, total={user_id: total})
+    return versions([user_id])[user_id]
+
+
+def record_created(notifications, merged=()):
+    """
+    Count new `notifications` and stamp them, and the coalesced `merged`
+    rows, with their recipient's new version. Call before saving them.
+    """
+    counts = Counter(notification.recipient_id for notification in notifications)
+    unread = Counter(notification.recipient_id for notification in notifications if not notification.is_read)
+    apply(unread=unread, total=counts, touch={notification.recipient_id for notification in merged})
+
+    current = versions({notification.recipient_id for notification in [*notifications, *merged]})
+    for notification in [*notifications, *merged]:
+        notification.version = current[notification.recipient_id]
+
+
+def record_deleted(rows, batch_size=500):
+    """Apply the deletion of `rows`, an iterable of (notification_id, recipient_id, is_read), and tombstone them."""
+    rows = list(rows)
+    total, unread = Counter(), Counter()
+    for _, recipient_id, is_read in rows:
+        total[recipient_id] -= 1
+        if not is_read:
+            unread[recipient_id] -= 1
+    apply(unread=unread, total=total)
+
+    current = versions(total)
+    NotificationTombstone.objects.bulk_create(
+        [
+            NotificationTombstone(
+                recipient_id=recipient_id, notification_id=notification_id, version=current[recipient_id]
+            )
+            for notification_id, recipient_id, _ in rows
+        ],
+        batch_size=batch_size
+    )
+
+
+def get_state(user):
+    """The user's (unread, total, version), computed and stored on first use."""
+    counter = NotificationCounter.objects.filter(user=user).values_list('unread', 'total', 'version').first()
+    if counter is not None:
+        return counter
+
+    actual = count_notifications(Q(recipient=user)).get(user.pk, (0, 0))
+    counter, _ = NotificationCounter.objects.get_or_create(
+        user=user, defaults={'unread': actual[0], 'total': actual[1]}
+    )
+    return counter.unread, counter.total, counter.version
+
+
+def get_counts(user):
+    """The user's (unread, total) counts: one primary-key lookup."""
+    return get_state(user)[:2]
+
+
+def count_notifications(predicate):
+    """{recipient_id: (unread, total)} computed from the notification table."""
+    return {
+        row['recipient_id']: (row['unread'], row['total'])
+        for row in Notification.objects.filter(predicate).order_by().values('recipient_id').annotate(
+            unread=Count('id', filter=Q(is_read=False)),
+            total=Count('id'),
+        )
+    }
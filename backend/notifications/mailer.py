@@ -0,0 +1,195 @@
+"""
+Batched, throttled email delivery.
+
+``send_messages()`` pushes a list of messages through one SMTP connection
+per batch of ``NOTIFICATION_EMAIL_BATCH_SIZE`` instead of one connection per
+message, pacing itself to ``NOTIFICATION_EMAIL_RATE`` messages per second
+(0 = unthrottled) with a process-wide token bucket. Messages are sent one
+at a time over the open connection so a refused recipient fails alone.
+
+``render_notification_emails()`` renders each distinct notification
+content once per batch, so a 2,000-recipient reminder is one render.
+
+Transactional mail sent from request handlers (OTPs, invitations) goes
+through ``background_mailer``, which hands messages to a daemon thread so
+a slow SMTP server never stalls the request. Its queue holds at most
+``NOTIFICATION_EMAIL_QUEUE_SIZE`` messages; past that, new ones are logged
+and dropped rather than piling up behind a server that stopped answering
+(each SMTP operation gives up after ``EMAIL_TIMEOUT`` seconds).
+"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'NOTIFICATION_EMAIL_BATCH_SIZE', 100)
+QUEUE_SIZE = getattr(settings, 'NOTIFICATION_EMAIL_QUEUE_SIZE', 1000)
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` messages per second; idle time builds up to one second of burst."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = min(1.0, float(rate))
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(getattr(settings, 'NOTIFICATION_EMAIL_RATE', 0))
+
+
+def build_message(subject, text, recipient, html=None):
+    message = EmailMultiAlternatives(subject, text, settings.DEFAULT_FROM_EMAIL, [recipient])
+    if html:
+        message.attach_alternative(html, 'text/html')
+    return message
+
+
+def render_email(template, context):
+    """Render `template`.txt and `template`.html once."""
+    return (
+        render_to_string(f'notifications/email/{template}.txt', context),
+        render_to_string(f'notifications/email/{template}.html', context),
+    )
+
+
+def render_notification_emails(notifications):
+    """One message per notification, rendering each distinct (title, message) once."""
+    rendered = {}
+    messages = []
+    for notification in notifications:
+        key = (notification.title, notification.message)
+        if key not in rendered:
+            rendered[key] = render_email('notification', {
+                'title': notification.title,
+                'message': notification.message,
+            })
+        text, html = rendered[key]
+        messages.append(build_message(notification.title, text, notification.recipient.email, html))
+    return messages
+
+
+def send_messages(messages, batch_size=None, limiter=None):
+    """
+    Send `messages` reusing one connection per batch. Returns
+    {index in messages: error} for the ones that failed.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    limiter = limiter or rate_limiter
+    failures = {}
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Could not open email connection: {e}")
+            failures.update({start + offset: str(e) for offset in range(len(batch))})
+            continue
+
+        index = start
+        try:
+            for index, message in enumerate(batch, start=start):
+                limiter.acquire()
+                try:
+                    connection.send_messages([message])
+                except Exception as e:
+                    failures[index] = str(e)
+                    # The server may have dropped us; carry on with a fresh connection
+                    connection.close()
+                    connection.open()
+        except Exception as e:
+            # Reconnecting failed: the rest of the batch can't be sent either
+            logger.error(f"Email connection lost mid-batch: {e}")
+            failures.update({later: str(e) for later in range(index + 1, start + len(batch))})
+        finally:
+            connection.close()
+    return failures
+
+
+class BackgroundMailer:
+    """Sends queued messages from a daemon thread, batching whatever has queued up since the last send."""
+
+    def __init__(self, batch_size=BATCH_SIZE, max_queued=QUEUE_SIZE):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        """Queue `message`. Returns False if the queue is full and the message was dropped."""
+        if not getattr(settings, 'EMAIL_SEND_IN_BACKGROUND', True):
+            failures = send_messages([message])
+            if failures:
+                raise RuntimeError(failures[0])
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            logger.error(f"Email queue full, dropping message to {', '.join(message.to)}")
+            return False
+        return True
+
+    def flush(self):
+        """Send everything queued so far from the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._send(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='background-mailer', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            failures = send_messages(batch, self.batch_size)
+        except Exception as e:
+            failures = {index: str(e) for index in range(len(batch))}
+        for index, error in failures.items():
+            logger.error(f"Error sending email to {', '.join(batch[index].to)}: {error}")
+
+
+background_mailer = BackgroundMailer()
@@ -0,0 +1,158 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from datetime import datetime, timedelta
+import logging
+import numpy as np
+import time
+
+from notifications.models import Notification, NotificationDelivery, NotificationPreference
+from notifications.preferences import preference_cache
+from notifications.services import NotificationService
+from users.models import User
+from clubs.models import Club
+from events.models import Event
+from messaging.models import MessageThread
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a synthetic event day (registrations, event updates, reminders, chat bursts, '
+        'announcements) with and without coalescing and digests, in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--events', type=int, default=40)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        logging.getLogger('notifications').setLevel(logging.WARNING)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            rng = np.random.default_rng(options['seed'])
+            users, actions = self._workload(rng, options['users'], options['events'])
+            self.stdout.write(f'Replaying {len(actions):,} actions for {len(users):,} users.')
+
+            self.stdout.write(
+                f'\n{"scenario":>22} {"dispatched":>11} {"rows":>8} {"immediate":>10} '
+                f'{"digests":>8} {"external":>9} {"seconds":>8}'
+            )
+            with override_settings(NOTIFICATION_COALESCE_RULES={}):
+                self._replay('baseline', actions)
+            self._replay('coalescing', actions)
+            self._use_digests(users, rng)
+            self._replay('coalescing + digests', actions)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _workload(self, rng, user_count, event_count):
+        """Build users, preferences and related rows, and return (users, time-ordered actions)."""
+        day = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        users = User.objects.bulk_create(
+            [User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(user_count)], batch_size=1000
+        )
+        NotificationPreference.objects.bulk_create([
+            NotificationPreference(user=user, notification_type=notification_type, channel='email')
+            for user in users[:user_count // 2]
+            for notification_type in ('event_registration', 'event_update', 'event_reminder', 'announcement')
+        ], batch_size=1000)
+
+        clubs = [Club.objects.create(name=f'Bench Club {i}', slug=f'bench-club-{i}', description='Benchmark')
+                 for i in range(20)]
+        events = []
+        for i in range(event_count):
+            start = day + timedelta(hours=float(rng.uniform(10, 21)))
+            events.append(Event.objects.create(
+                title=f'Bench Event {i}', slug=f'bench-event-{i}', description='Benchmark',
+                primary_club=clubs[i % len(clubs)], location='Main hall', start_datetime=start,
+                end_datetime=start + timedelta(hours=2), created_by=users[0], status='approved'
+            ))
+        threads = [MessageThread.objects.create(thread_type='group', name=f'Bench {i}')
+                   for i in range(user_count // 5)]
+
+        actions = []
+        hour = lambda low, high: day + timedelta(hours=float(rng.uniform(low, high)))
+
+        # Registrations: ~3 per user, each confirmed individually
+        registrants = {event.id: [] for event in events}
+        for user in users:
+            for index in rng.choice(event_count, size=min(rng.poisson(3), event_count), replace=False):
+                event = events[index]
+                registrants[event.id].append(user)
+                actions.append((hour(7, (event.start_datetime - day).total_seconds() / 3600 - 1), [user],
+                                'event_registration', 'Event Registration Confirmed',
+                                f'You have successfully registered for "{event.title}".', event))
+
+        for event in events:
+            # Organizer edits, then the one-hour reminder
+            for _ in range(rng.poisson(2)):
+                actions.append((hour(8, (event.start_datetime - day).total_seconds() / 3600 - 1),
+                                registrants[event.id], 'event_update', 'Event Updated',
+                                f'"{event.title}" has new details.', event))
+            actions.append((event.start_datetime - timedelta(hours=1), registrants[event.id], 'event_reminder',
+                            'Upcoming Event Reminder', f'Event "{event.title}" starts in 1 hour.', event))
+
+        # Group chats of five: bursts of a few messages minutes apart, notifying the other members
+        for i, thread in enumerate(threads):
+            members = users[i * 5:i * 5 + 5]
+            for _ in range(rng.poisson(4)):
+                burst = hour(8, 23)
+                for offset in np.sort(rng.uniform(0, 8, rng.poisson(5) + 1)):
+                    sender = members[rng.integers(len(members))]
+                    actions.append((burst + timedelta(minutes=float(offset)),
+                                    [member for member in members if member is not sender],
+                                    'message', 'New Message', f'{sender.username} sent a message.', thread))
+
+        # Club announcements to a tenth of the users each
+        for club in clubs:
+            members = [users[i] for i in rng.choice(user_count, size=user_count // 10, replace=False)]
+            for _ in range(rng.poisson(1.5)):
+                actions.append((hour(8, 20), members, 'announcement', 'New Announcement',
+                                f'{club.name} posted an announcement.', club))
+
+        actions.sort(key=lambda action: action[0])
+        return users, actions
+
+    def _use_digests(self, users, rng):
+        """Half of the email users switch to an hourly or daily digest."""
+        emailed = users[:len(users) // 2]
+        for digest, chunk in (('hourly', emailed[0::4]), ('daily', emailed[1::4])):
+            NotificationPreference.objects.filter(user__in=chunk).update(digest=digest)
+        for user in emailed:
+            preference_cache.invalidate(user.pk)
+
+    def _replay(self, label, actions):
+        Notification.objects.all().delete()
+        dispatched = 0
+        started = time.perf_counter()
+        for at, recipients, notification_type, title, message, related in actions:
+            notifications = []
+            for recipient in recipients:
+                notification = NotificationService.build_notification(
+                    recipient, notification_type, title, message, related_object=related
+                )
+                notification.created_at = at
+                notifications.append(notification)
+            dispatched += len(notifications)
+            NotificationService.dispatch(notifications)
+        elapsed = time.perf_counter() - started
+
+        rows = Notification.objects.count()
+        immediate = NotificationDelivery.objects.filter(digest='').count()
+
+        # A digest sends one message per recipient, channel and digest period
+        periods = set()
+        for recipient_id, channel, digest, created_at in NotificationDelivery.objects.exclude(digest='').values_list(
+            'notification__recipient_id', 'channel', 'digest', 'notification__created_at'
+        ):
+            local = timezone.localtime(created_at)
+            periods.add((recipient_id, channel, local.date(), local.hour if digest == 'hourly' else None))
+        digests = len(periods)
+
+        self.stdout.write(
+            f'{label:>22} {dispatched:>11,} {rows:>8,} {immediate:>10,} '
+            f'{digests:>8,} {immediate + digests:>9,} {elapsed:>8.2f}'
+        )
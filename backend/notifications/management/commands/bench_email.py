@@ -0,0 +1,97 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+import logging
+import socket
+import threading
+import time
+
+from notifications.mailer import RateLimiter, render_notification_emails, send_messages
+from notifications.models import Notification
+from users.models import User
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.received += 1
+        return '250 Message accepted for delivery'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark notification email throughput against a local aiosmtpd server: '
+        'one SMTP connection per message versus batched connections. Requires aiosmtpd.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--rate', type=float, default=0, help='Throttle for the batched run (messages/second).')
+
+    def handle(self, *args, **options):
+        # aiosmtpd logs every SMTP command at INFO
+        logging.getLogger('mail.log').setLevel(logging.WARNING)
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise CommandError('bench_email needs aiosmtpd (pip install aiosmtpd).')
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        handler = CountingHandler()
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        try:
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_USE_TLS=False,
+                EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            ):
+                self._bench(handler, options)
+        finally:
+            controller.stop()
+
+    def _bench(self, handler, options):
+        count = options['messages']
+        notifications = [
+            Notification(
+                recipient=User(username=f'bench{i}', email=f'bench{i}@example.com'),
+                notification_type='event_reminder',
+                title='Upcoming Event Reminder',
+                message='Event "Bench Event" starts in 1 hour.',
+            )
+            for i in range(count)
+        ]
+
+        started = time.perf_counter()
+        messages = render_notification_emails(notifications)
+        self.stdout.write(f'Rendered {count:,} messages in {(time.perf_counter() - started) * 1000:.0f} ms.')
+
+        self.stdout.write(f'\n{"mode":>22} {"delivered":>10} {"seconds":>8} {"msg/s":>8}')
+
+        handler.received = 0
+        started = time.perf_counter()
+        for message in messages:
+            get_connection().send_messages([message])
+        self._report('connection per message', handler, started)
+
+        handler.received = 0
+        started = time.perf_counter()
+        failures = send_messages(messages, options['batch_size'], RateLimiter(options['rate']))
+        label = f'batched ({options["batch_size"]}/conn)'
+        if options['rate']:
+            label = f'batched, {options["rate"]:g}/s cap'
+        self._report(label, handler, started)
+        if failures:
+            self.stdout.write(self.style.WARNING(f'{len(failures)} messages failed.'))
+
+    def _report(self, label, handler, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label:>22} {handler.received:>10,} {elapsed:>8.2f} {handler.received / elapsed:>8.0f}')
@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import time
+
+from notifications.models import Notification, NotificationPreference
+from notifications.services import NotificationService
+from users.models import User
+from clubs.models import Club
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark per-recipient notification sends against the bulk fan-out '
+        'in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10_000)
+        parser.add_argument('--email-share', type=float, default=0.5,
+                            help='Share of recipients who also have email enabled.')
+        parser.add_argument('--skip-legacy', action='store_true')
+
+    def handle(self, *args, **options):
+        # The placeholder channel senders log every delivery
+        logging.getLogger('notifications.services').setLevel(logging.WARNING)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            event = self._populate(options['recipients'], options['email_share'])
+            recipients = list(User.objects.exclude(pk=event.created_by_id))
+
+            self.stdout.write(f'\n{"path":>12} {"sent":>8} {"queries":>9} {"seconds":>9}')
+            if not options['skip_legacy']:
+                self._run('per-user', lambda: self._send_one_by_one(recipients, event))
+                Notification.objects.all().delete()
+            send_bulk = lambda: NotificationService.send_bulk(
+                recipients, 'event_reminder', 'Upcoming Event Reminder',
+                f'Event "{event.title}" starts in 1 hour.', related_object=event, expires_in_hours=2
+            )
+            self._run('bulk', send_bulk)
+            Notification.objects.all().delete()
+            # Preference masks are now cached
+            self._run('bulk warm', send_bulk)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, label, send):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            started = time.perf_counter()
+            send()
+            elapsed = time.perf_counter() - started
+        sent = Notification.objects.count()
+        self.stdout.write(f'{label:>12} {sent:>8,} {queries:>9,} {elapsed:>9.2f}')
+
+    def _populate(self, count, email_share):
+        now = timezone.now()
+        users = User.objects.bulk_create(
+            [User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(count + 1)],
+            batch_size=1000
+        )
+        preferences = []
+        for i, user in enumerate(users[1:]):
+            preferences.append(NotificationPreference(user=user, notification_type='event_reminder', channel='in_app'))
+            if i < count * email_share:
+                preferences.append(NotificationPreference(user=user, notification_type='event_reminder', channel='email'))
+        NotificationPreference.objects.bulk_create(preferences, batch_size=1000)
+
+        club = Club.objects.create(name='Bench Club', slug='bench-club', description='Benchmark')
+        return Event.objects.create(
+            title='Bench Event', slug='bench-event', description='Benchmark', primary_club=club,
+            location='Main hall', start_datetime=now + timedelta(minutes=30), end_datetime=now + timedelta(hours=2),
+            created_by=users[0], status='approved'
+        )
+
+    def _send_one_by_one(self, recipients, event):
+        """The previous send_notification flow: two preference queries, INSERT and per-channel save() per recipient."""
+        for recipient in recipients:
+            preferences = NotificationPreference.objects.filter(
+                user=recipient, notification_type='event_reminder', is_enabled=True
+            )
+            if not preferences.exists():
+                continue
+            notification = Notification.objects.create(
+                recipient=recipient,
+                notification_type='event_reminder',
+                title='Upcoming Event Reminder',
+                message=f'Event "{event.title}" starts in 1 hour.',
+                event=event,
+                expires_at=timezone.now() + timedelta(hours=2)
+            )
+            for preference in preferences:
+                NotificationService.send_via_channel(preference.channel, [notification])
+                notification.is_sent = True
+                notification.sent_at = timezone.now()
+                notification.save()
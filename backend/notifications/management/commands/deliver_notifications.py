@@ -0,0 +1,83 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import logging
+import threading
+
+from notifications import outbox
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_CHANNELS = ['email', 'push', 'sms']
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver queued notifications from the outbox with a thread pool per channel. '
+        'Safe to run in several processes at once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', choices=OUTBOX_CHANNELS,
+                            help='Channel to serve (repeatable, default: all).')
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads per channel.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds a claimed batch is reserved before other workers may retake it.')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling.')
+
+    def handle(self, *args, **options):
+        channels = options['channel'] or OUTBOX_CHANNELS
+        self._stop = threading.Event()
+        self._totals = Counter()
+        self._lock = threading.Lock()
+
+        pools = {
+            channel: ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix=f'deliver-{channel}')
+            for channel in channels
+        }
+        futures = [
+            pool.submit(self._work, channel, options)
+            for channel, pool in pools.items()
+            for _ in range(options['threads'])
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after current batches...')
+            self._stop.set()
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Delivered {self._totals['sent']}, scheduled {self._totals['retried']} retries, "
+            f"{self._totals['failed']} failed permanently."
+        ))
+
+    def _work(self, channel, options):
+        while not self._stop.is_set():
+            try:
+                token, deliveries = outbox.claim(channel, options['batch_size'], options['lease'])
+                if deliveries:
+                    self._add(outbox.process(channel, token, deliveries))
+                    continue
+                token, deliveries = outbox.claim_digests(channel, lease_seconds=options['lease'])
+                if deliveries:
+                    self._add(outbox.process_digests(channel, token, deliveries))
+                    continue
+            except Exception as e:
+                logger.error(f"{channel} delivery worker error: {e}")
+            finally:
+                close_old_connections()
+
+            if options['once']:
+                return
+            self._stop.wait(options['poll_interval'])
+
+    def _add(self, outcome):
+        with self._lock:
+            self._totals.update(outcome)
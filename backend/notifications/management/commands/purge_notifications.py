@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from notifications import retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired notifications and notifications read longer ago than the retention period, '
+        'in small batches (run from a scheduler).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--read-retention-days', type=int,
+                            help=f'Days to keep read notifications (default: {retention.READ_RETENTION_DAYS}).')
+        parser.add_argument('--batch-size', type=int, default=retention.PURGE_BATCH_SIZE,
+                            help='Rows deleted per transaction.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches; the next run continues.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between batches.')
+        parser.add_argument('--expired-only', action='store_true',
+                            help='Only delete expired notifications (the frequent expiry sweep).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted.')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            counts = retention.count_due(
+                read_retention_days=options['read_retention_days'], expired_only=options['expired_only']
+            )
+            self.stdout.write(
+                f"Would purge {counts.get('expired', 0)} expired and {counts.get('read', 0)} read notifications."
+            )
+            return
+
+        metrics = retention.purge(
+            read_retention_days=options['read_retention_days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+            expired_only=options['expired_only'],
+        )
+        rate = (metrics['expired'] + metrics['read']) / metrics['seconds'] if metrics['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {metrics['expired']} expired and {metrics['read']} read notifications "
+            f"({metrics['deliveries']} outbox rows) in {metrics['batches']} batches, "
+            f"{metrics['seconds']}s ({rate:.0f} rows/s)."
+        ))
+        self.stdout.write(f"Removed {metrics['tombstones']} expired sync tombstones.")
+        if not metrics['complete']:
+            self.stdout.write(self.style.WARNING('Stopped at --max-batches; more rows are due.'))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from notifications.counters import count_notifications
+from notifications.models import NotificationCounter
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user notification counters from the notification table and repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users checked per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = drifted = 0
+        last_pk = None
+
+        while True:
+            users = User.objects.order_by('pk')
+            if last_pk is not None:
+                users = users.filter(pk__gt=last_pk)
+            user_ids = list(users.values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            checked += len(user_ids)
+
+            with transaction.atomic():
+                # Lock the batch's counters so concurrent deltas land before or after the recount
+                stored = {
+                    row[0]: row[1:]
+                    for row in NotificationCounter.objects.select_for_update().filter(
+                        user_id__in=user_ids
+                    ).values_list('user_id', 'unread', 'total')
+                }
+                actual = count_notifications(Q(recipient_id__in=user_ids))
+
+                fixes = []
+                for user_id in user_ids:
+                    expected = actual.get(user_id, (0, 0))
+                    current = stored.get(user_id)
+                    if current == expected or (current is None and expected == (0, 0)):
+                        continue
+                    drifted += 1
+                    self.stdout.write(f'{user_id}: stored {current}, actual {expected}')
+                    fixes.append(NotificationCounter(
+                        user_id=user_id, unread=expected[0], total=expected[1], updated_at=timezone.now()
+                    ))
+
+                if fixes and not options['dry_run']:
+                    NotificationCounter.objects.bulk_create(
+                        fixes,
+                        update_conflicts=True,
+                        unique_fields=['user'],
+                        update_fields=['unread', 'total', 'updated_at'],
+                    )
+                    # A new version makes delta-sync clients fetch the corrected counts
+                    NotificationCounter.objects.filter(
+                        user_id__in=[fix.user_id for fix in fixes]
+                    ).update(version=F('version') + 1)
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {drifted} drifted counters across {checked} users.'))
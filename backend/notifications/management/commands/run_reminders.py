@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import threading
+
+from notifications import reminders
+
+
+class Command(BaseCommand):
+    help = (
+        'Send scheduled event and booking reminders as they fall due. '
+        'Safe to run in several processes at once; each reminder is sent exactly once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, default=300,
+                            help='Seconds ahead to load due reminders into memory.')
+        parser.add_argument('--refresh-interval', type=float, default=15,
+                            help='Seconds between re-reads of the reminder table.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--resync', action='store_true',
+                            help='First recompute reminders for all upcoming events and bookings.')
+        parser.add_argument('--once', action='store_true', help='Send what is due now and exit.')
+
+    def handle(self, *args, **options):
+        if options['resync']:
+            created = reminders.resync()
+            self.stdout.write(f'Scheduled {created} new reminders.')
+
+        if options['once']:
+            totals = reminders.fire_due(batch_size=options['batch_size'])
+        else:
+            dispatcher = reminders.ReminderDispatcher(
+                horizon=options['horizon'],
+                refresh_interval=options['refresh_interval'],
+                batch_size=options['batch_size'],
+            )
+            stop = threading.Event()
+            try:
+                dispatcher.run(stop)
+            except KeyboardInterrupt:
+                stop.set()
+            finally:
+                close_old_connections()
+            totals = dispatcher.totals
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {totals['sent']} reminders, cancelled {totals['cancelled']} that no longer apply."
+        ))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:21
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notification_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='coalesce_key',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='digest',
+            field=models.CharField(blank=True, choices=[('', 'Immediately'), ('hourly', 'Hourly Digest'), ('daily', 'Daily Digest')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='notificationpreference',
+            name='digest',
+            field=models.CharField(blank=True, choices=[('', 'Immediately'), ('hourly', 'Hourly Digest'), ('daily', 'Daily Digest')], default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'coalesce_key', 'is_read'], name='notificatio_recipie_6d1579_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationdelivery',
+            index=models.Index(fields=['channel', 'digest', 'status', 'next_attempt_at'], name='notificatio_channel_69f700_idx'),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
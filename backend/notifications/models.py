@@ -51,15 +51,40 @@ class Notification(models.Model):
     # Expiry
     expires_at = models.DateTimeField(null=True, blank=True)
     
+    # Coalescing: similar notifications within a window merge into one row
+    count = models.PositiveIntegerField(default=1)
+    coalesce_key = models.CharField(max_length=100, blank=True)
+    
+    # Recipient's change version at the last write, for delta sync
+    version = models.PositiveBigIntegerField(default=0)
+    
     # Metadata
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         indexes = [
-            models.Index(fields=['recipient', 'is_read', 'created_at']),
+            models.Index(fields=['recipient', '-updated_at'], name='notification_inbox_idx'),
+            models.Index(fields=['recipient', 'version', 'id'], name='notification_sync_idx'),
+            # Partial indexes stay proportional to the live working set, not the whole table
+            models.Index(
+                fields=['recipient', '-updated_at'], name='notification_unread_idx',
+                condition=models.Q(is_read=False)
+            ),
+            models.Index(
+                fields=['recipient', 'coalesce_key'], name='notification_coalesce_idx',
+                condition=models.Q(is_read=False)
+            ),
+            models.Index(
+                fields=['expires_at'], name='notification_expiry_idx',
+                condition=models.Q(expires_at__isnull=False)
+            ),
+            models.Index(
+                fields=['read_at'], name='notification_read_idx',
+                condition=models.Q(is_read=True)
+            ),
             models.Index(fields=['notification_type']),
             models.Index(fields=['priority']),
-            models.Index(fields=['expires_at']),
         ]
         ordering = ['-created_at']
     
@@ -76,6 +101,12 @@ class Notification(models.Model):
     def should_send(self):
         return not self.is_sent and not self.is_expired
 
+DIGEST_CHOICES = (
+    ('', 'Immediately'),
+    ('hourly', 'Hourly Digest'),
+    ('daily', 'Daily Digest'),
+)
+
 class NotificationPreference(models.Model):
     CHANNEL_CHOICES = (
         ('email', 'Email'),
@@ -89,9 +120,132 @@ class NotificationPreference(models.Model):
     notification_type = models.CharField(max_length=50, choices=Notification.NOTIFICATION_TYPES)
     channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES)
     is_enabled = models.BooleanField(default=True)
+    digest = models.CharField(max_length=10, choices=DIGEST_CHOICES, blank=True, default='')
+    # Minutes before the start to remind at (event and booking reminders only); empty uses the defaults
+    reminder_offsets = models.JSONField(default=list, blank=True)
     
     class Meta:
         unique_together = ['user', 'notification_type', 'channel']
     
     def __str__(self):
-        return f"{self.user.email} - {self.notification_type} via {self.channel}"
\ No newline at end of file
+        return f"{self.user.email} - {self.notification_type} via {self.channel}"
+
+class NotificationDelivery(models.Model):
+    """Outbox row: one external channel delivery of a notification, processed by deliver_notifications."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='deliveries')
+    channel = models.CharField(max_length=20, choices=NotificationPreference.CHANNEL_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    digest = models.CharField(max_length=10, choices=DIGEST_CHOICES, blank=True, default='')
+    
+    # Retry state
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    # Claim held by a worker while processing
+    claim_token = models.UUIDField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'channel'], name='unique_notification_delivery_channel'),
+        ]
+        indexes = [
+            models.Index(fields=['channel', 'status', 'next_attempt_at']),
+            models.Index(fields=['channel', 'digest', 'status', 'next_attempt_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_id} via {self.channel} ({self.status})"
+
+class NotificationCounter(models.Model):
+    """Per-user notification counts kept in step with the notification table, see notifications.counters."""
+    user = models.OneToOneField(
+        'users.User', on_delete=models.CASCADE, primary_key=True, related_name='notification_counter'
+    )
+    unread = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    # Bumped by every change to the user's notifications
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread of {self.total}"
+
+class NotificationTombstone(models.Model):
+    """Record of a deleted notification, so delta sync can tell clients to drop it."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipient = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='notification_tombstones')
+    notification_id = models.UUIDField()
+    version = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'version']),
+            models.Index(fields=['created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_id} deleted at version {self.version}"
+
+class ScheduledReminder(models.Model):
+    """One reminder due for one recipient at one offset before an event or booking, see notifications.reminders."""
+    KIND_CHOICES = (
+        ('event', 'Event'),
+        ('booking', 'Booking'),
+    )
+    
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('cancelled', 'Cancelled'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipient = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='scheduled_reminders')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    event = models.ForeignKey('events.Event', on_delete=models.CASCADE, null=True, blank=True)
+    resource_booking = models.ForeignKey('resources.ResourceBooking', on_delete=models.CASCADE, null=True, blank=True)
+    offset_minutes = models.PositiveIntegerField()
+    due_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # Stamped by the dispatcher that fired the reminder
+    claim_token = models.UUIDField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event', 'recipient', 'offset_minutes'], name='unique_event_reminder',
+                condition=models.Q(event__isnull=False)
+            ),
+            models.UniqueConstraint(
+                fields=['resource_booking', 'recipient', 'offset_minutes'], name='unique_booking_reminder',
+                condition=models.Q(resource_booking__isnull=False)
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['due_at'], name='reminder_due_idx', condition=models.Q(status='pending')),
+            models.Index(fields=['claim_token']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} reminder for {self.recipient_id} at {self.due_at} ({self.status})"
@@ -0,0 +1,199 @@
+"""
+Notification delivery outbox.
+
+dispatch() writes one NotificationDelivery row per external channel in the
+same transaction as the notifications, so nothing is sent inside the
+request. The deliver_notifications worker claims rows in batches, hands
+each batch to the channel's backend and records the outcome per row.
+
+Claims are a compare-and-set UPDATE that re-checks the claimable
+predicate and stamps a fresh token, so any number of worker threads and
+processes can poll the same table without double-sending. A claim is a
+lease: rows of a worker that died are reclaimed once it expires. Every
+write after the claim is conditional on the token, so a worker that
+overran its lease cannot clobber the new owner's result.
+
+Deliveries for pairs the recipient has set to an hourly or daily digest
+are due at the next digest boundary and are claimed a whole recipient at
+a time, so each recipient gets one combined message per channel.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from datetime import datetime, timedelta
+import logging
+import random
+import uuid
+
+from .backends import get_backend
+from .models import Notification, NotificationDelivery
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'NOTIFICATION_DELIVERY_MAX_ATTEMPTS', 5)
+RETRY_BASE_SECONDS = getattr(settings, 'NOTIFICATION_DELIVERY_RETRY_BASE', 30)
+RETRY_MAX_SECONDS = getattr(settings, 'NOTIFICATION_DELIVERY_RETRY_MAX', 3600)
+DIGEST_DAILY_HOUR = getattr(settings, 'NOTIFICATION_DIGEST_DAILY_HOUR', 8)
+
+
+def retry_delay(attempts):
+    """Exponential backoff with +/-20% jitter so failed batches don't retry in lockstep."""
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def next_digest_at(digest, reference=None):
+    """Start of the next hour, or the next NOTIFICATION_DIGEST_DAILY_HOUR o'clock local time."""
+    local = timezone.localtime(reference or timezone.now())
+    if digest == 'hourly':
+        return local.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    due = local.replace(hour=DIGEST_DAILY_HOUR, minute=0, second=0, microsecond=0)
+    return due if due > local else due + timedelta(days=1)
+
+
+def enqueue(deliveries, digest_for=None, batch_size=500, rearm=False):
+    """
+    Create outbox rows from {channel: [saved notifications]}. `digest_for`,
+    if given, maps (notification, channel) to '', 'hourly' or 'daily'.
+    With `rearm`, rows that already exist and have finished (sent or
+    failed) go back to pending, e.g. after their notification was merged.
+    """
+    now = timezone.now()
+    due = {'': now}
+    rows = []
+    for channel, notifications in deliveries.items():
+        for notification in notifications:
+            digest = digest_for(notification, channel) if digest_for else ''
+            if digest not in due:
+                due[digest] = next_digest_at(digest, now)
+            rows.append(NotificationDelivery(
+                notification=notification, channel=channel, digest=digest, next_attempt_at=due[digest]
+            ))
+    NotificationDelivery.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+
+    if rearm:
+        groups = {}
+        for row in rows:
+            groups.setdefault((row.channel, row.digest), []).append(row.notification_id)
+        for (channel, digest), ids in groups.items():
+            for i in range(0, len(ids), batch_size):
+                NotificationDelivery.objects.filter(
+                    notification_id__in=ids[i:i + batch_size], channel=channel, status__in=['sent', 'failed']
+                ).update(
+                    status='pending', digest=digest, next_attempt_at=due[digest], attempts=0,
+                    last_error='', claim_token=None, lease_expires_at=None, sent_at=None
+                )
+    return len(rows)
+
+
+def claim(channel, batch_size=100, lease_seconds=300, max_attempts=MAX_ATTEMPTS):
+    """Claim up to `batch_size` due deliveries for `channel`. Returns (token, deliveries)."""
+    now = timezone.now()
+
+    # Rows whose worker died on the last allowed attempt are given up on, not reclaimed
+    NotificationDelivery.objects.filter(
+        channel=channel,
+        status='processing',
+        lease_expires_at__lt=now,
+        attempts__gte=max_attempts
+    ).update(status='failed', claim_token=None, last_error='Lease expired on final attempt')
+
+    claimable = Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', lease_expires_at__lt=now)
+    ids = list(NotificationDelivery.objects.filter(
+        claimable, channel=channel, digest=''
+    ).order_by('next_attempt_at').values_list('id', flat=True)[:batch_size])
+    return _claim_ids(ids, claimable, now, lease_seconds)
+
+
+def claim_digests(channel, recipients=50, lease_seconds=300):
+    """Claim every due digest delivery of up to `recipients` recipients. Returns (token, deliveries)."""
+    now = timezone.now()
+    claimable = Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', lease_expires_at__lt=now)
+    due = NotificationDelivery.objects.filter(claimable, channel=channel).exclude(digest='')
+    recipient_ids = list(
+        due.order_by().values_list('notification__recipient_id', flat=True).distinct()[:recipients]
+    )
+    if not recipient_ids:
+        return None, []
+    ids = list(due.filter(notification__recipient_id__in=recipient_ids).values_list('id', flat=True))
+    return _claim_ids(ids, claimable, now, lease_seconds)
+
+
+def _claim_ids(ids, claimable, now, lease_seconds):
+    if not ids:
+        return None, []
+
+    token = uuid.uuid4()
+    claimed = NotificationDelivery.objects.filter(claimable, id__in=ids).update(
+        status='processing',
+        claim_token=token,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1
+    )
+    if not claimed:
+        return None, []
+
+    return token, list(NotificationDelivery.objects.filter(
+        claim_token=token, status='processing'
+    ).select_related('notification__recipient').order_by('notification__created_at'))
+
+
+def process(channel, token, deliveries, max_attempts=MAX_ATTEMPTS):
+    """Deliver a claimed batch and record the outcome of each row. Returns counts by outcome."""
+    by_notification = {delivery.notification_id: delivery for delivery in deliveries}
+    try:
+        failures = get_backend(channel).send_messages([delivery.notification for delivery in deliveries])
+    except Exception as e:
+        logger.error(f"Error delivering {len(deliveries)} {channel} notifications: {e}")
+        failures = {notification_id: str(e) for notification_id in by_notification}
+    return _record(channel, token, by_notification, failures, max_attempts)
+
+
+def process_digests(channel, token, deliveries, max_attempts=MAX_ATTEMPTS):
+    """Send one combined message per recipient for a claimed digest batch and record every row."""
+    groups = {}
+    for delivery in deliveries:
+        groups.setdefault(delivery.notification.recipient_id, []).append(delivery.notification)
+    try:
+        failed_recipients = get_backend(channel).send_digests(groups)
+    except Exception as e:
+        logger.error(f"Error delivering {len(groups)} {channel} digests: {e}")
+        failed_recipients = {recipient_id: str(e) for recipient_id in groups}
+
+    by_notification = {delivery.notification_id: delivery for delivery in deliveries}
+    failures = {
+        delivery.notification_id: failed_recipients[delivery.notification.recipient_id]
+        for delivery in deliveries if delivery.notification.recipient_id in failed_recipients
+    }
+    return _record(channel, token, by_notification, failures, max_attempts)
+
+
+def _record(channel, token, by_notification, failures, max_attempts):
+    now = timezone.now()
+    sent = [notification_id for notification_id in by_notification if notification_id not in failures]
+    outcome = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    with transaction.atomic():
+        if sent:
+            outcome['sent'] = NotificationDelivery.objects.filter(
+                claim_token=token, notification_id__in=sent
+            ).update(status='sent', sent_at=now, claim_token=None, lease_expires_at=None, last_error='')
+            Notification.objects.filter(id__in=sent, is_sent=False).update(is_sent=True, sent_at=now)
+
+        for notification_id, error in failures.items():
+            delivery = by_notification.get(notification_id)
+            if delivery is None:
+                continue
+            if delivery.attempts >= max_attempts:
+                status, updates = 'failed', {}
+            else:
+                status, updates = 'retried', {'next_attempt_at': now + retry_delay(delivery.attempts)}
+            outcome[status] += NotificationDelivery.objects.filter(id=delivery.id, claim_token=token).update(
+                status='failed' if status == 'failed' else 'pending',
+                claim_token=None, lease_expires_at=None, last_error=str(error)[:1000], **updates
+            )
+
+    if outcome['failed']:
+        logger.warning(f"{outcome['failed']} {channel} deliveries failed permanently after {max_attempts} attempts")
+    return outcome
@@ -0,0 +1,197 @@
+"""
+Cached per-user notification preferences.
+
+Each user's preferences are packed into one integer: bit
+``type_index * len(CHANNELS) + channel_index`` is set when that
+notification type is delivered on that channel. Masks are kept in a small
+in-process LRU in front of the shared Django cache, so a fan-out to
+thousands of recipients costs at most one ``get_many`` and one query for
+the misses.
+
+Pairs with no NotificationPreference row fall back to
+``NOTIFICATION_DEFAULT_CHANNELS`` (in-app only by default); an explicit
+row, enabled or not, always wins. Two more masks of the same shape record
+which pairs the user wants as an hourly or daily digest.
+
+Shared entries are keyed by a per-user version. Writes through
+NotificationPreferenceViewSet call ``invalidate()``, which clears this
+process's copy and bumps the version. A reader that loaded the old rows
+concurrently stores them under the version it started with, which nobody
+reads any more. Other processes may serve their local copy for up to
+``NOTIFICATION_PREFERENCE_LOCAL_TTL`` seconds. The cache is only shared
+when CACHE_REDIS_URL is set. Without it, each process has its own, and
+shared entries expire after the local TTL as well.
+"""
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import time
+
+from .models import Notification, NotificationPreference
+
+TYPES = [notification_type for notification_type, _ in Notification.NOTIFICATION_TYPES]
+CHANNELS = [channel for channel, _ in NotificationPreference.CHANNEL_CHOICES]
+
+
+def bit(notification_type, channel):
+    return 1 << (TYPES.index(notification_type) * len(CHANNELS) + CHANNELS.index(channel))
+
+
+def channels_for(mask, notification_type):
+    """Channels enabled in `mask` for `notification_type`, in CHANNELS order."""
+    row = mask >> (TYPES.index(notification_type) * len(CHANNELS))
+    return [channel for i, channel in enumerate(CHANNELS) if row & (1 << i)]
+
+
+def digest_for(digests, notification_type, channel):
+    """'hourly', 'daily' or '' (immediate) for one pair, given a user's (hourly, daily) masks."""
+    flag = bit(notification_type, channel)
+    hourly, daily = digests
+    if hourly & flag:
+        return 'hourly'
+    if daily & flag:
+        return 'daily'
+    return ''
+
+
+def default_mask(channels):
+    mask = 0
+    for notification_type in TYPES:
+        for channel in channels:
+            mask |= bit(notification_type, channel)
+    return mask
+
+
+class PreferenceCache:
+    def __init__(self, default_channels=('in_app',), max_local=10000, local_ttl=30, shared_timeout=3600):
+        self.default = default_mask(default_channels)
+        self.max_local = max_local
+        self.local_ttl = local_ttl
+        self.shared_timeout = shared_timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_mask(self, user_id):
+        return self.get_masks([user_id])[user_id]
+
+    def get_masks(self, user_ids):
+        """Map each user id to its enabled-channels mask."""
+        return {user_id: entry[0] for user_id, entry in self.get_entries(user_ids).items()}
+
+    def get_digests(self, user_ids):
+        """Map each user id to its (hourly, daily) digest masks."""
+        return {user_id: entry[1:] for user_id, entry in self.get_entries(user_ids).items()}
+
+    def get_entries(self, user_ids):
+        """Map each user id to (enabled, hourly, daily) masks: local LRU, then shared cache, then one query."""
+        masks = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._local.get(user_id)
+                if entry and entry[1] > now:
+                    self._local.move_to_end(user_id)
+                    masks[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+        if not missing:
+            return masks
+
+        # Versions are read before the rows, so a concurrent invalidate() retires what we store
+        keys = {user_id: self._key(user_id, version) for user_id, version in self._versions(missing).items()}
+        shared = cache.get_many(keys.values())
+        loaded = []
+        for user_id in missing:
+            mask = shared.get(keys[user_id])
+            if mask is None:
+                loaded.append(user_id)
+            else:
+                masks[user_id] = mask
+
+        if loaded:
+            enabled, explicit = {}, {}
+            digests = {'hourly': {}, 'daily': {}}
+            for user_id, notification_type, channel, is_enabled, digest in NotificationPreference.objects.filter(
+                user_id__in=loaded
+            ).values_list('user_id', 'notification_type', 'channel', 'is_enabled', 'digest'):
+                if notification_type not in TYPES or channel not in CHANNELS:
+                    continue
+                flag = bit(notification_type, channel)
+                explicit[user_id] = explicit.get(user_id, 0) | flag
+                if is_enabled:
+                    enabled[user_id] = enabled.get(user_id, 0) | flag
+                if digest in digests:
+                    digests[digest][user_id] = digests[digest].get(user_id, 0) | flag
+
+            # Explicit rows replace the default for their (type, channel) pairs
+            fresh = {
+                user_id: (
+                    (self.default & ~explicit.get(user_id, 0)) | enabled.get(user_id, 0),
+                    digests['hourly'].get(user_id, 0),
+                    digests['daily'].get(user_id, 0),
+                )
+                for user_id in loaded
+            }
+            cache.set_many({keys[user_id]: mask for user_id, mask in fresh.items()}, self.shared_timeout)
+            masks.update(fresh)
+
+        self._remember({user_id: masks[user_id] for user_id in missing})
+        return masks
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+        key = self._version_key(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _remember(self, masks):
+        expires = time.monotonic() + self.local_ttl
+        with self._lock:
+            for user_id, mask in masks.items():
+                self._local[user_id] = (mask, expires)
+                self._local.move_to_end(user_id)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
+
+    def _versions(self, user_ids):
+        keys = {user_id: self._version_key(user_id) for user_id in user_ids}
+        found = cache.get_many(keys.values())
+        versions = {}
+        for user_id, key in keys.items():
+            version = found.get(key)
+            if version is None:
+                # Seed from the clock so an evicted version never reuses an old one
+                cache.add(key, int(time.time() * 1000), timeout=None)
+                version = cache.get(key)
+            versions[user_id] = version
+        return versions
+
+    @staticmethod
+    def _version_key(user_id):
+        return f'notification_prefs:version:{user_id}'
+
+    @staticmethod
+    def _key(user_id, version):
+        return f'notification_prefs:v3:{user_id}:{version}'
+
+
+def cache_is_shared():
+    return not settings.CACHES['default']['BACKEND'].endswith(('LocMemCache', 'DummyCache'))
+
+
+LOCAL_TTL = getattr(settings, 'NOTIFICATION_PREFERENCE_LOCAL_TTL', 30)
+
+preference_cache = PreferenceCache(
+    default_channels=getattr(settings, 'NOTIFICATION_DEFAULT_CHANNELS', ('in_app',)),
+    local_ttl=LOCAL_TTL,
+    shared_timeout=getattr(settings, 'NOTIFICATION_PREFERENCE_SHARED_TIMEOUT', 3600) if cache_is_shared() else LOCAL_TTL,
+)
@@ -0,0 +1,87 @@
+"""
+Real-time notification push over the channel layer.
+
+dispatch() hands every notification it creates or coalesces to
+push_on_commit(), which defers the push until the surrounding transaction
+commits, so clients are never told about rows a rollback removed. Each
+recipient gets one channel-layer message per dispatch no matter how many
+of their notifications it touched: ``notification`` for a single one (the
+REST representation, as before) or ``notification_batch`` for several,
+both carrying the recipient's unread count so the badge needs no polling.
+All group sends of one dispatch run concurrently on a single event loop
+instead of one blocking async_to_sync round trip per user.
+
+Push is best effort: clients reconnecting fetch the list over REST, so a
+missing or failing channel layer is logged and never fails the write.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+import asyncio
+import logging
+
+from .models import NotificationCounter
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+SEND_CONCURRENCY = getattr(settings, 'NOTIFICATION_PUSH_CONCURRENCY', 100)
+
+
+def user_group(user_id):
+    """Channel-layer group every websocket consumer of a user joins."""
+    return f'user_{user_id}'
+
+
+def push_on_commit(notifications):
+    if not notifications:
+        return
+    notifications = list(notifications)
+    transaction.on_commit(lambda: push(notifications))
+
+
+def build_messages(notifications):
+    """{user_id: channel-layer message} for one push."""
+    by_user = {}
+    for notification, payload in zip(notifications, NotificationSerializer(notifications, many=True).data):
+        by_user.setdefault(notification.recipient_id, []).append(payload)
+
+    unread = dict(NotificationCounter.objects.filter(user_id__in=by_user).values_list('user_id', 'unread'))
+
+    messages = {}
+    for user_id, payloads in by_user.items():
+        if len(payloads) == 1:
+            messages[user_id] = {'type': 'notification', 'notification': payloads[0]}
+        else:
+            messages[user_id] = {'type': 'notification_batch', 'notifications': payloads}
+        messages[user_id]['unread'] = unread.get(user_id, 0)
+    return messages
+
+
+def push(notifications):
+    """Send `notifications` to their recipients' websocket groups. Returns the number of groups reached."""
+    layer = get_channel_layer()
+    if layer is None:
+        logger.debug("No channel layer configured; skipping notification push")
+        return 0
+
+    try:
+        messages = build_messages(notifications)
+        async_to_sync(_group_send_all)(layer, messages)
+    except Exception as e:
+        logger.error(f"Error pushing {len(notifications)} notifications: {e}")
+        return 0
+    return len(messages)
+
+
+async def _group_send_all(layer, messages):
+    items = list(messages.items())
+    for i in range(0, len(items), SEND_CONCURRENCY):
+        results = await asyncio.gather(
+            *(layer.group_send(user_group(user_id), message) for user_id, message in items[i:i + SEND_CONCURRENCY]),
+            return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures:
+            logger.warning(f"{len(failures)} notification group sends failed: {failures[0]}")
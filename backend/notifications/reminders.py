@@ -0,0 +1,318 @@
+"""
+Scheduled event and booking reminders.
+
+Reminder jobs are precomputed into ScheduledReminder rows, one per
+recipient and offset, whenever an event or booking (or its registrations,
+collaborators, or a recipient's reminder preferences) changes. A row is
+due ``offset_minutes`` before the start; offsets come from the recipient's
+``reminder_offsets`` preferences, falling back to
+NOTIFICATION_REMINDER_OFFSETS. Rescheduling moves the due time of
+existing rows, and rows that no longer apply are cancelled.
+
+ReminderDispatcher, run by the run_reminders command, loads pending rows
+due within a short horizon into a heap and sleeps until the earliest one,
+re-reading the table every few seconds to pick up new or moved jobs.
+Firing is a compare-and-set UPDATE from pending to sent in the same
+transaction that creates the notifications, so each reminder is sent
+exactly once however many dispatchers run. A reminder whose event or
+booking is no longer approved or has already started is cancelled
+instead.
+"""
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.timesince import timeuntil
+from datetime import timedelta
+import heapq
+import logging
+import threading
+import time
+import uuid
+
+from events.models import Event, EventCollaborator, EventRegistration
+from resources.models import ResourceBooking
+from .models import NotificationPreference, ScheduledReminder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OFFSETS = {'event_reminder': [60], 'booking_reminder': [30]}
+REMINDER_TYPES = {'event': 'event_reminder', 'booking': 'booking_reminder'}
+MAX_OFFSETS = 5
+MAX_OFFSET_MINUTES = 14 * 24 * 60
+
+ORGANIZER_ROLES = ['organizer', 'coordinator']
+ACTIVE_REGISTRATION_STATUSES = ['registered', 'attended']
+ACTIVE_BOOKING_STATUSES = ['approved', 'confirmed']
+
+
+def default_offsets(notification_type):
+    return getattr(settings, 'NOTIFICATION_REMINDER_OFFSETS', DEFAULT_OFFSETS).get(notification_type, [])
+
+
+def offsets_for(user_ids, notification_type):
+    """{user_id: sorted offsets in minutes}: the union over the user's preference rows, or the defaults."""
+    chosen = {}
+    for user_id, offsets in NotificationPreference.objects.filter(
+        user_id__in=user_ids, notification_type=notification_type
+    ).values_list('user_id', 'reminder_offsets'):
+        if offsets:
+            chosen.setdefault(user_id, set()).update(offsets)
+    defaults = default_offsets(notification_type)
+    return {user_id: sorted(chosen.get(user_id) or defaults) for user_id in user_ids}
+
+
+def event_recipients(event):
+    if event.status != 'approved':
+        return set()
+    recipients = {event.created_by_id}
+    recipients.update(EventCollaborator.objects.filter(
+        event=event, role__in=ORGANIZER_ROLES
+    ).values_list('user_id', flat=True))
+    recipients.update(EventRegistration.objects.filter(
+        event=event, status__in=ACTIVE_REGISTRATION_STATUSES
+    ).values_list('user_id', flat=True))
+    return recipients
+
+
+def booking_recipients(booking):
+    return {booking.user_id} if booking.status in ACTIVE_BOOKING_STATUSES else set()
+
+
+def sync_event(event, user_ids=None):
+    """Bring the event's reminder rows (only those of `user_ids`, if given) in line with its current state."""
+    return _sync('event', event, event.start_datetime, event_recipients(event), user_ids)
+
+
+def sync_booking(booking):
+    return _sync('booking', booking, booking.start_time, booking_recipients(booking), None)
+
+
+def sync_user(user_id):
+    """Reschedule a user's upcoming reminders, e.g. after their reminder offsets changed."""
+    now = timezone.now()
+    events = Event.objects.filter(
+        Q(created_by_id=user_id)
+        | Q(collaborators__user_id=user_id, collaborators__role__in=ORGANIZER_ROLES)
+        | Q(registrations__user_id=user_id, registrations__status__in=ACTIVE_REGISTRATION_STATUSES),
+        status='approved',
+        start_datetime__gt=now
+    ).distinct()
+    for event in events:
+        sync_event(event, user_ids=[user_id])
+    for booking in ResourceBooking.objects.filter(
+        user_id=user_id, status__in=ACTIVE_BOOKING_STATUSES, start_time__gt=now
+    ):
+        sync_booking(booking)
+
+
+def _sync(kind, target, start, recipients, user_ids):
+    target_field = 'event' if kind == 'event' else 'resource_booking'
+    existing = ScheduledReminder.objects.filter(**{target_field: target})
+    if user_ids is not None:
+        existing = existing.filter(recipient_id__in=user_ids)
+        recipients = recipients & set(user_ids)
+    existing = {(row.recipient_id, row.offset_minutes): row for row in existing}
+
+    now = timezone.now()
+    desired = {}
+    if start > now:
+        for user_id, offsets in offsets_for(recipients, REMINDER_TYPES[kind]).items():
+            for offset in offsets:
+                due_at = start - timedelta(minutes=offset)
+                # Of the offsets already behind us only the closest to the start still fires
+                if due_at > now or offset == offsets[0]:
+                    desired[(user_id, offset)] = due_at
+
+    new, moved = [], {}
+    for (user_id, offset), due_at in desired.items():
+        row = existing.get((user_id, offset))
+        if row is None:
+            new.append(ScheduledReminder(
+                recipient_id=user_id, kind=kind, offset_minutes=offset, due_at=due_at, **{target_field: target}
+            ))
+        elif row.due_at != due_at or row.status == 'cancelled':
+            # A sent reminder whose start time moved is due again for the new time
+            moved.setdefault(due_at, []).append(row.pk)
+    stale = [row.pk for key, row in existing.items() if key not in desired and row.status == 'pending']
+
+    if new:
+        ScheduledReminder.objects.bulk_create(new, ignore_conflicts=True)
+    for due_at, ids in moved.items():
+        ScheduledReminder.objects.filter(pk__in=ids).update(due_at=due_at, status='pending', updated_at=now)
+    if stale:
+        ScheduledReminder.objects.filter(pk__in=stale, status='pending').update(status='cancelled', updated_at=now)
+    return len(new)
+
+
+def _starts_in(start, now):
+    minutes = max(round((start - now).total_seconds() / 60), 1)
+    return timeuntil(start, start - timedelta(minutes=minutes), depth=2).replace('\xa0', ' ')
+
+
+def build_reminder(row, now):
+    """The notification for a fired reminder, or None if it no longer applies."""
+    from .services import NotificationService
+
+    if row.kind == 'event':
+        event = row.event
+        if event is None or event.status != 'approved' or event.start_datetime <= now:
+            return None
+        start, related = event.start_datetime, event
+        title, subject = 'Upcoming Event', f'Event "{event.title}"'
+    else:
+        booking = row.resource_booking
+        if booking is None or booking.status not in ACTIVE_BOOKING_STATUSES or booking.start_time <= now:
+            return None
+        start, related = booking.start_time, booking
+        title, subject = 'Upcoming Booking', f'Your booking for {booking.resource.name}'
+
+    notification = NotificationService.build_notification(
+        row.recipient,
+        notification_type=REMINDER_TYPES[row.kind],
+        title=title,
+        message=f'{subject} starts in {_starts_in(start, now)}.',
+        data={'offset_minutes': row.offset_minutes},
+        related_object=related,
+        priority='medium',
+        expires_in_hours=None
+    )
+    notification.expires_at = start
+    return notification
+
+
+def fire(ids, now=None):
+    """
+    Send the reminders in `ids` that are still pending and due. Returns
+    {'sent': n, 'cancelled': n}; reminders another dispatcher fired first
+    are skipped.
+    """
+    from .services import NotificationService
+
+    now = now or timezone.now()
+    token = uuid.uuid4()
+    with transaction.atomic():
+        claimed = ScheduledReminder.objects.filter(
+            pk__in=ids, status='pending', due_at__lte=now
+        ).update(status='sent', claim_token=token, sent_at=now, updated_at=now)
+        if not claimed:
+            return {'sent': 0, 'cancelled': 0}
+
+        rows = ScheduledReminder.objects.filter(claim_token=token).select_related(
+            'recipient', 'event', 'resource_booking__resource'
+        )
+        notifications, stale = [], []
+        for row in rows:
+            notification = build_reminder(row, now)
+            if notification is None:
+                stale.append(row.pk)
+            else:
+                notifications.append(notification)
+
+        if stale:
+            ScheduledReminder.objects.filter(pk__in=stale).update(status='cancelled')
+        NotificationService.dispatch(notifications, fail_silently=False)
+    return {'sent': len(notifications), 'cancelled': len(stale)}
+
+
+def fire_due(kind=None, batch_size=200):
+    """Fire everything due now in one pass, without the dispatcher."""
+    totals = {'sent': 0, 'cancelled': 0}
+    due = ScheduledReminder.objects.filter(status='pending', due_at__lte=timezone.now())
+    if kind:
+        due = due.filter(kind=kind)
+    while True:
+        ids = list(due.order_by('due_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return totals
+        result = fire(ids)
+        if not any(result.values()):
+            return totals
+        for key, value in result.items():
+            totals[key] += value
+
+
+def resync(now=None):
+    """Recompute reminders for every upcoming approved event and booking. Returns rows created."""
+    now = now or timezone.now()
+    created = 0
+    for event in Event.objects.filter(status='approved', start_datetime__gt=now).iterator():
+        created += sync_event(event)
+    for booking in ResourceBooking.objects.filter(
+        status__in=ACTIVE_BOOKING_STATUSES, start_time__gt=now
+    ).iterator():
+        created += sync_booking(booking)
+    return created
+
+
+class ReminderDispatcher:
+    """
+    In-process reminder clock: a heap of (due_at, id) for pending rows
+    due within `horizon` seconds, refreshed from the table every
+    `refresh_interval` seconds. Stale heap entries are harmless because
+    fire() re-checks every row.
+    """
+
+    def __init__(self, horizon=300, refresh_interval=15, batch_size=200, max_loaded=10000):
+        self.horizon = horizon
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.max_loaded = max_loaded
+        self._heap = []
+        self._queued = set()
+        self._next_refresh = 0
+        self._truncated = False
+        self.totals = {'sent': 0, 'cancelled': 0}
+
+    def refresh(self, now=None):
+        now = now or timezone.now()
+        rows = list(ScheduledReminder.objects.filter(
+            status='pending', due_at__lte=now + timedelta(seconds=self.horizon)
+        ).order_by('due_at').values_list('due_at', 'pk')[:self.max_loaded])
+        for entry in rows:
+            if entry[1] not in self._queued:
+                self._queued.add(entry[1])
+                heapq.heappush(self._heap, entry)
+        self._truncated = len(rows) == self.max_loaded
+        self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def fire_due(self, now=None):
+        now = now or timezone.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[1])
+        for i in range(0, len(due), self.batch_size):
+            batch = due[i:i + self.batch_size]
+            try:
+                result = fire(batch, now)
+            except Exception as e:
+                # Rows stay pending and come back with the next refresh
+                logger.error(f"Error firing {len(batch)} reminders: {e}")
+                result = {}
+            finally:
+                self._queued.difference_update(batch)
+            for key, value in result.items():
+                self.totals[key] += value
+        if due and not self._heap and self._truncated:
+            self._next_refresh = 0
+        return len(due)
+
+    def seconds_until_next(self):
+        wait = self._next_refresh - time.monotonic()
+        if self._heap:
+            wait = min(wait, (self._heap[0][0] - timezone.now()).total_seconds())
+        return max(wait, 0)
+
+    def run(self, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            # A long-lived loop outside the request cycle must drop connections the server has closed
+            close_old_connections()
+            if time.monotonic() >= self._next_refresh:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Error loading due reminders: {e}")
+                    self._next_refresh = time.monotonic() + self.refresh_interval
+            self.fire_due()
+            stop.wait(self.seconds_until_next())
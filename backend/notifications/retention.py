@@ -0,0 +1,106 @@
+"""
+Notification retention.
+
+Expired notifications and notifications read more than
+``NOTIFICATION_READ_RETENTION_DAYS`` ago are deleted by the
+purge_notifications command. ``--expired-only`` runs just the expiry
+sweep, which is cheap enough to schedule every minute: it is what takes
+expired rows out of the unread counters and reports them to delta-sync
+clients, so its interval bounds how stale either can be. Rows go in bounded primary-key batches,
+each its own short transaction, so the purge never holds a long write
+lock or builds one huge delete; ``pause`` seconds between batches leave
+room for request traffic. Outbox rows of purged notifications cascade
+with them, and each batch adjusts the recipients' NotificationCounter and
+leaves sync tombstones in the same transaction. Tombstones past the sync
+horizon are purged at the end of a complete run.
+
+Each purge predicate is served by a partial index (expiry and read_at,
+see Notification.Meta), so finding the next batch stays cheap however
+large the unread working set is.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import time
+
+from . import counters, sync
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+READ_RETENTION_DAYS = getattr(settings, 'NOTIFICATION_READ_RETENTION_DAYS', 30)
+PURGE_BATCH_SIZE = getattr(settings, 'NOTIFICATION_PURGE_BATCH_SIZE', 1000)
+
+
+def purge_rules(now=None, read_retention_days=None):
+    """(metric, predicate) pairs for everything due for deletion at `now`."""
+    now = now or timezone.now()
+    if read_retention_days is None:
+        read_retention_days = READ_RETENTION_DAYS
+    cutoff = now - timedelta(days=read_retention_days)
+    return [
+        ('expired', Q(expires_at__lt=now)),
+        ('read', Q(is_read=True, read_at__lt=cutoff)),
+        # Rows marked read without a timestamp age out by creation time
+        ('read', Q(is_read=True, read_at__isnull=True, created_at__lt=cutoff)),
+    ]
+
+
+def count_due(now=None, read_retention_days=None, expired_only=False):
+    counts = {}
+    for metric, predicate in purge_rules(now, read_retention_days):
+        if expired_only and metric != 'expired':
+            continue
+        counts[metric] = counts.get(metric, 0) + Notification.objects.filter(predicate).count()
+    return counts
+
+
+def purge(now=None, read_retention_days=None, batch_size=None, max_batches=None, pause=0, expired_only=False):
+    """
+    Delete due notifications in batches of `batch_size`, stopping after
+    `max_batches` batches if given; with `expired_only`, just the expired
+    ones. Returns the run's metrics.
+    """
+    batch_size = batch_size or PURGE_BATCH_SIZE
+    started = time.monotonic()
+    metrics = {'expired': 0, 'read': 0, 'deliveries': 0, 'tombstones': 0, 'batches': 0, 'complete': True}
+
+    rules = purge_rules(now, read_retention_days)
+    if expired_only:
+        rules = [(metric, predicate) for metric, predicate in rules if metric == 'expired']
+    for metric, predicate in rules:
+        while True:
+            if max_batches is not None and metrics['batches'] >= max_batches:
+                metrics['complete'] = False
+                break
+
+            rows = list(
+                Notification.objects.filter(predicate).order_by().values_list('pk', 'recipient_id', 'is_read')[:batch_size]
+            )
+            if not rows:
+                break
+
+            with transaction.atomic():
+                _, deleted = Notification.objects.filter(pk__in=[row[0] for row in rows]).delete()
+                counters.record_deleted(rows)
+            metrics[metric] += deleted.get('notifications.Notification', 0)
+            metrics['deliveries'] += deleted.get('notifications.NotificationDelivery', 0)
+            metrics['batches'] += 1
+
+            if len(rows) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+
+    if metrics['complete'] and not expired_only:
+        metrics['tombstones'] = sync.purge_tombstones(batch_size)
+
+    metrics['seconds'] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"Purged {metrics['expired']} expired and {metrics['read']} read notifications "
+        f"({metrics['deliveries']} deliveries) in {metrics['batches']} batches, {metrics['seconds']}s"
+    )
+    return metrics
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Notification, NotificationPreference
+from .reminders import MAX_OFFSETS, MAX_OFFSET_MINUTES, REMINDER_TYPES
 
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,12 +9,30 @@ class NotificationSerializer(serializers.ModelSerializer):
             'id', 'notification_type', 'priority', 'title', 'message',
             'data', 'event', 'club', 'resource_booking', 'message_thread',
             'is_read', 'is_sent', 'sent_at', 'read_at', 'expires_at',
-            'created_at'
+            'count', 'version', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at']
+        read_only_fields = ['id', 'count', 'version', 'created_at', 'updated_at']
 
 class NotificationPreferenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = NotificationPreference
-        fields = ['id', 'notification_type', 'channel', 'is_enabled']
-        read_only_fields = ['id']
\ No newline at end of file
+        fields = ['id', 'notification_type', 'channel', 'is_enabled', 'digest', 'reminder_offsets']
+        read_only_fields = ['id']
+    
+    def validate_reminder_offsets(self, value):
+        if not isinstance(value, list) or not all(isinstance(offset, int) and not isinstance(offset, bool) for offset in value):
+            raise serializers.ValidationError("Reminder offsets must be a list of minutes.")
+        if len(value) > MAX_OFFSETS:
+            raise serializers.ValidationError(f"At most {MAX_OFFSETS} reminder offsets are allowed.")
+        if any(offset <= 0 or offset > MAX_OFFSET_MINUTES for offset in value):
+            raise serializers.ValidationError(f"Reminder offsets must be between 1 and {MAX_OFFSET_MINUTES} minutes.")
+        return sorted(set(value))
+    
+    def validate(self, data):
+        channel = data.get('channel', getattr(self.instance, 'channel', None))
+        notification_type = data.get('notification_type', getattr(self.instance, 'notification_type', None))
+        if data.get('digest') and channel == 'in_app':
+            raise serializers.ValidationError("In-app notifications can't be delivered as a digest.")
+        if data.get('reminder_offsets') and notification_type not in REMINDER_TYPES.values():
+            raise serializers.ValidationError("Reminder offsets only apply to event and booking reminders.")
+        return data
\ No newline at end of file
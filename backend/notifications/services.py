@@ -1,10 +1,17 @@
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
-from .models import Notification, NotificationPreference
+from .models import Notification
+from .preferences import preference_cache, channels_for, digest_for
+from .backends import get_backend
+from .mailer import build_message, render_email, send_messages
+from . import coalescing, counters, outbox, push
 from users.models import User
 from events.models import Event, EventRegistration
 from clubs.models import ClubInvitation, Club
 from resources.models import ResourceBooking
+from messaging.models import MessageThread
+import copy
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,96 +23,227 @@ class NotificationService:
         """
         Create and send a notification to a user.
         """
+        notifications = NotificationService.send_bulk(
+            [recipient], notification_type, title, message, data=data,
+            related_object=related_object, priority=priority, expires_in_hours=expires_in_hours
+        )
+        return notifications[0] if notifications else None
+    
+    @staticmethod
+    def send_bulk(recipients, notification_type, title, message, data=None,
+                  related_object=None, priority='medium', expires_in_hours=24):
+        """
+        Create and send the same notification to many users.
+        Returns the notifications that were created (recipients who have the
+        type disabled on every channel are skipped).
+        """
+        seen = set()
+        notifications = []
+        for recipient in recipients:
+            if recipient is None or recipient.pk in seen:
+                continue
+            seen.add(recipient.pk)
+            notifications.append(NotificationService.build_notification(
+                recipient, notification_type, title, message, data=data,
+                related_object=related_object, priority=priority, expires_in_hours=expires_in_hours
+            ))
+        return NotificationService.dispatch(notifications)
+    
+    @staticmethod
+    def build_notification(recipient, notification_type, title, message, data=None,
+                           related_object=None, priority='medium', expires_in_hours=24):
+        """Build an unsaved notification for dispatch()."""
+        notification = Notification(
+            recipient=recipient,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            priority=priority,
+            data=data or {},
+        )
+        
+        # Add related object
+        if related_object:
+            if isinstance(related_object, Event):
+                notification.event = related_object
+            elif isinstance(related_object, Club):
+                notification.club = related_object
+            elif isinstance(related_object, ResourceBooking):
+                notification.resource_booking = related_object
+            elif isinstance(related_object, MessageThread):
+                notification.message_thread = related_object
+        
+        # Set expiry
+        if expires_in_hours:
+            notification.expires_at = timezone.now() + timedelta(hours=expires_in_hours)
+        
+        return notification
+    
+    @staticmethod
+    def enabled_channels(pairs):
+        """
+        Map (user_id, notification_type) -> set of enabled channels for all
+        `pairs`, with one cached preference lookup for every user involved.
+        """
+        pairs = set(pairs)
+        masks = preference_cache.get_masks({user_id for user_id, _ in pairs})
+        channels = {}
+        for user_id, notification_type in pairs:
+            enabled = channels_for(masks[user_id], notification_type)
+            if enabled:
+                channels[(user_id, notification_type)] = set(enabled)
+        return channels
+    
+    @staticmethod
+    def dispatch(notifications, batch_size=500, fail_silently=True):
+        """
+        Save unsaved notifications in bulk and queue their deliveries: one
+        preference query, one query for open rows to coalesce into, batched
+        INSERTs for the notifications and their outbox rows, and one UPDATE
+        marking in-app ones as sent. External channels are delivered by the
+        deliver_notifications worker; connected clients get a websocket push
+        once the transaction commits. Returns new and coalesced rows.
+
+        If the batch fails, it is retried one notification at a time, each
+        in its own savepoint, so one bad recipient costs only their own
+        notification; their errors are logged and swallowed. With
+        fail_silently=False the batch error is raised instead, for callers
+        that roll back their own work with it.
+        """
+        # Pristine copies for the row-by-row retry: a failed batch may have stamped or merged the originals
+        originals = [copy.copy(notification) for notification in notifications]
         try:
-            # Check user preferences
-            if not NotificationService.should_send_notification(recipient, notification_type):
-                logger.debug(f"Notification blocked by user preference: {recipient.email} - {notification_type}")
-                return None
-            
-            # Create notification
-            notification_data = {
-                'recipient': recipient,
-                'notification_type': notification_type,
-                'title': title,
-                'message': message,
-                'priority': priority,
-                'data': data or {},
-            }
-            
-            # Add related object
-            if related_object:
-                if isinstance(related_object, Event):
-                    notification_data['event'] = related_object
-                elif isinstance(related_object, Club):
-                    notification_data['club'] = related_object
-                elif isinstance(related_object, ResourceBooking):
-                    notification_data['resource_booking'] = related_object
-            
-            # Set expiry
-            if expires_in_hours:
-                notification_data['expires_at'] = timezone.now() + timedelta(hours=expires_in_hours)
-            
-            notification = Notification.objects.create(**notification_data)
-            
-            # Send via enabled channels
-            NotificationService.send_via_channels(recipient, notification_type, notification)
+            return NotificationService._dispatch_batch(notifications, batch_size)
+        except Exception as e:
+            if not fail_silently or len(originals) < 2:
+                logger.error(f"Error sending notifications: {e}")
+                if not fail_silently:
+                    raise
+                return []
+            logger.error(f"Error sending {len(originals)} notifications as a batch, retrying one at a time: {e}")
+        
+        sent = []
+        for notification in originals:
+            try:
+                sent.extend(NotificationService._dispatch_batch([notification], batch_size))
+            except Exception as e:
+                logger.error(f"Error sending notification to {notification.recipient_id}: {e}")
+        return sent
+    
+    @staticmethod
+    def _dispatch_batch(notifications, batch_size):
+        channels = NotificationService.enabled_channels(
+            (notification.recipient_id, notification.notification_type) for notification in notifications
+        )
+        
+        # Check user preferences
+        allowed = []
+        for notification in notifications:
+            if (notification.recipient_id, notification.notification_type) in channels:
+                allowed.append(notification)
+            else:
+                logger.debug(
+                    f"Notification blocked by user preference: {notification.recipient_id} - "
+                    f"{notification.notification_type}"
+                )
+        if not allowed:
+            return []
+        
+        with transaction.atomic():
+            new, merged = coalescing.coalesce(allowed)
             
-            return notification
+            # Coalesced notifications ride on their row's existing deliveries,
+            # unless their rule has every merge delivered again
+            rules = coalescing.get_rules()
+            deliveries, redeliveries = {}, {}
+            for notification in new:
+                for channel in channels[(notification.recipient_id, notification.notification_type)]:
+                    deliveries.setdefault(channel, []).append(notification)
+            for notification in merged:
+                if rules[notification.notification_type].get('redeliver'):
+                    for channel in channels[(notification.recipient_id, notification.notification_type)]:
+                        redeliveries.setdefault(channel, []).append(notification)
             
-        except Exception as e:
-            logger.error(f"Error sending notification: {e}")
-            return None
+            counters.record_created(new, merged)
+            Notification.objects.bulk_create(new, batch_size=batch_size)
+            coalescing.save_merged(merged)
+            NotificationService.queue_deliveries(deliveries, batch_size=batch_size)
+            if redeliveries:
+                NotificationService.queue_deliveries(redeliveries, batch_size=batch_size, rearm=True)
+            push.push_on_commit(new + merged)
+        
+        return new + merged
+    
+    @staticmethod
+    def queue_deliveries(deliveries, batch_size=500, rearm=False):
+        """
+        Queue saved notifications from {channel: [notifications]}: in-app ones
+        are delivered simply by existing, everything else goes to the outbox.
+        With `rearm`, outbox rows the notifications already have are sent again.
+        """
+        in_app = deliveries.get('in_app', [])
+        if in_app:
+            now = timezone.now()
+            sent_ids = [notification.pk for notification in in_app]
+            for i in range(0, len(sent_ids), batch_size):
+                Notification.objects.filter(id__in=sent_ids[i:i + batch_size]).update(is_sent=True, sent_at=now)
+            for notification in in_app:
+                notification.is_sent = True
+                notification.sent_at = now
+        
+        external = {channel: batch for channel, batch in deliveries.items() if channel != 'in_app'}
+        digests = preference_cache.get_digests({
+            notification.recipient_id for batch in external.values() for notification in batch
+        })
+        outbox.enqueue(
+            external,
+            digest_for=lambda notification, channel: digest_for(
+                digests[notification.recipient_id], notification.notification_type, channel
+            ),
+            batch_size=batch_size,
+            rearm=rearm
+        )
+    
+    @staticmethod
+    def send_via_channel(channel, notifications):
+        """
+        Deliver a batch of notifications through one channel right away,
+        bypassing the outbox. Returns {notification_id: error} for failures.
+        """
+        if channel == 'in_app':
+            # In-app notifications are already created
+            return {}
+        return get_backend(channel).send_messages(notifications)
     
     @staticmethod
     def should_send_notification(user, notification_type):
         """
         Check if user wants to receive this type of notification via any channel.
         """
-        preferences = NotificationPreference.objects.filter(
-            user=user,
-            notification_type=notification_type,
-            is_enabled=True
-        )
-        return preferences.exists()
+        return bool(channels_for(preference_cache.get_mask(user.pk), notification_type))
     
     @staticmethod
     def send_via_channels(user, notification_type, notification):
         """
-        Send notification through all enabled channels for the user.
+        Queue a saved notification on all enabled channels for the user.
         """
-        preferences = NotificationPreference.objects.filter(
-            user=user,
-            notification_type=notification_type,
-            is_enabled=True
-        )
-        
-        for preference in preferences:
-            try:
-                if preference.channel == 'email':
-                    NotificationService.send_email_notification(user, notification)
-                elif preference.channel == 'push':
-                    NotificationService.send_push_notification(user, notification)
-                elif preference.channel == 'in_app':
-                    # In-app notifications are already created
-                    pass
-                elif preference.channel == 'sms':
-                    NotificationService.send_sms_notification(user, notification)
-                
-                notification.is_sent = True
-                notification.sent_at = timezone.now()
-                notification.save()
-                
-            except Exception as e:
-                logger.error(f"Error sending {preference.channel} notification: {e}")
+        NotificationService.queue_deliveries({
+            channel: [notification]
+            for channel in channels_for(preference_cache.get_mask(user.pk), notification_type)
+        })
     
     @staticmethod
     def send_email_notification(user, notification):
         """
         Send email notification.
-        TODO: Implement email sending
         """
-        # This is a placeholder - implement your email sending logic here
-        logger.info(f"Would send email to {user.email}: {notification.title}")
+        text, html = render_email('notification', {
+            'title': notification.title,
+            'message': notification.message,
+        })
+        failures = send_messages([build_message(notification.title, text, user.email, html)])
+        if failures:
+            raise RuntimeError(failures[0])
     
     @staticmethod
     def send_push_notification(user, notification):
@@ -163,48 +301,12 @@ class NotificationService:
     
     @staticmethod
     def send_event_reminders():
-        """Send reminders for upcoming events (to be called by a scheduled task)"""
-        from datetime import timedelta
-        
-        reminder_time = timezone.now() + timedelta(hours=1)
-        upcoming_events = Event.objects.filter(
-            start_datetime__range=[timezone.now(), reminder_time],
-            status='approved'
-        )
-        
-        for event in upcoming_events:
-            # Notify organizers
-            organizers = [event.created_by]
-            for collaborator in event.collaborators.filter(role__in=['organizer', 'coordinator']):
-                organizers.append(collaborator.user)
-            
-            for organizer in set(organizers):
-                NotificationService.send_notification(
-                    recipient=organizer,
-                    notification_type='event_reminder',
-                    title='Upcoming Event',
-                    message=f'Event "{event.title}" starts in 1 hour.',
-                    related_object=event,
-                    priority='medium',
-                    expires_in_hours=2
-                )
-            
-            # Notify registered participants
-            registrations = EventRegistration.objects.filter(
-                event=event,
-                status__in=['registered', 'attended']
-            )
-            
-            for registration in registrations:
-                NotificationService.send_notification(
-                    recipient=registration.user,
-                    notification_type='event_reminder',
-                    title='Upcoming Event Reminder',
-                    message=f'Event "{event.title}" starts in 1 hour.',
-                    related_object=event,
-                    priority='medium',
-                    expires_in_hours=2
-                )
+        """
+        Fire event reminders that are due now. Kept for schedulers that still
+        call it; the run_reminders command delivers them on time by itself.
+        """
+        from .reminders import fire_due
+        return fire_due(kind='event')
     
     # Club-related notifications
     @staticmethod
@@ -259,22 +361,6 @@ class NotificationService:
     
     @staticmethod
     def send_booking_reminders():
-        """Send reminders for upcoming bookings (to be called by a scheduled task)"""
-        from datetime import timedelta
-        
-        reminder_time = timezone.now() + timedelta(minutes=30)
-        upcoming_bookings = ResourceBooking.objects.filter(
-            start_time__range=[timezone.now(), reminder_time],
-            status='approved'
-        )
-        
-        for booking in upcoming_bookings:
-            NotificationService.send_notification(
-                recipient=booking.user,
-                notification_type='booking_reminder',
-                title='Upcoming Booking',
-                message=f'Your booking for {booking.resource.name} starts in 30 minutes.',
-                related_object=booking,
-                priority='medium',
-                expires_in_hours=1
-            )
\ No newline at end of file
+        """Fire booking reminders that are due now (see send_event_reminders)."""
+        from .reminders import fire_due
+        return fire_due(kind='booking')
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from . import reminders
+from .models import NotificationPreference
+from events.models import Event, EventCollaborator, EventRegistration
+from resources.models import ResourceBooking
+
+
+def sync_event_reminders(sender, instance, **kwargs):
+    reminders.sync_event(instance)
+
+
+def sync_booking_reminders(sender, instance, **kwargs):
+    reminders.sync_booking(instance)
+
+
+def sync_participant_reminders(sender, instance, **kwargs):
+    event = Event.objects.filter(pk=instance.event_id).first()
+    if event is not None:
+        reminders.sync_event(event, user_ids=[instance.user_id])
+
+
+def sync_preference_reminders(sender, instance, **kwargs):
+    if instance.notification_type in reminders.REMINDER_TYPES.values():
+        reminders.sync_user(instance.user_id)
+
+
+def after_commit(handler):
+    """Run a delete handler once the deletion commits, when a cascade has finished removing the parents too."""
+    def receiver(sender, instance, **kwargs):
+        transaction.on_commit(lambda: handler(sender, instance))
+    return receiver
+
+
+post_save.connect(sync_event_reminders, sender=Event, dispatch_uid='reminders_event_save')
+post_save.connect(sync_booking_reminders, sender=ResourceBooking, dispatch_uid='reminders_booking_save')
+post_save.connect(sync_preference_reminders, sender=NotificationPreference, dispatch_uid='reminders_preference_save')
+post_delete.connect(after_commit(sync_preference_reminders), sender=NotificationPreference, weak=False,
+                    dispatch_uid='reminders_preference_delete')
+
+for model in (EventRegistration, EventCollaborator):
+    post_save.connect(sync_participant_reminders, sender=model, dispatch_uid=f'reminders_save_{model.__name__}')
+    post_delete.connect(after_commit(sync_participant_reminders), sender=model, weak=False,
+                        dispatch_uid=f'reminders_delete_{model.__name__}')
@@ -0,0 +1,113 @@
+"""
+Delta sync for notification clients.
+
+Every write to a user's notifications bumps their version on
+NotificationCounter and stamps it on the rows it touched, and every
+delete leaves a NotificationTombstone at its version (see
+notifications.counters). A client cursor is a signed token holding the
+version it has seen, so "what changed" is a range scan on
+(recipient, version, id), and "nothing changed" is the counter
+primary-key lookup alone.
+
+The version covers new notifications, coalesced updates and read-state
+changes alike, so one watermark replaces separate created_at/id and
+read-state positions. Pages are ordered by (version, id); a cursor taken
+mid-page also carries the last id. Tombstones are kept for
+NOTIFICATION_SYNC_TOMBSTONE_DAYS, and a cursor older than that gets a
+full reset instead of a delta.
+
+Expiry is a delete like any other: the expiry sweep in
+notifications.retention removes expired rows, bumping the version and
+leaving tombstones, so a client at the current version learns about
+them on its next poll after the sweep.
+"""
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+
+from . import counters
+from .models import Notification, NotificationTombstone
+
+CURSOR_SALT = 'notifications.sync'
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 500
+TOMBSTONE_DAYS = getattr(settings, 'NOTIFICATION_SYNC_TOMBSTONE_DAYS', 30)
+
+
+def encode_cursor(version, last_id=None):
+    return signing.dumps(
+        {'v': version, 'id': str(last_id) if last_id else None, 't': int(timezone.now().timestamp())},
+        salt=CURSOR_SALT, compress=True
+    )
+
+
+def decode_cursor(token):
+    try:
+        cursor = signing.loads(token, salt=CURSOR_SALT)
+        return {'v': int(cursor['v']), 'id': cursor.get('id'), 't': int(cursor['t'])}
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValueError("Invalid sync cursor.")
+
+
+def changes(user, cursor=None, limit=PAGE_SIZE):
+    """
+    Changes to `user`'s notifications since `cursor` (a decoded cursor, or
+    None for a full listing), or None when there are none.
+    """
+    unread, total, current = counters.get_state(user)
+    horizon = (timezone.now() - timedelta(days=TOMBSTONE_DAYS)).timestamp()
+    reset = cursor is None or cursor['t'] < horizon or cursor['v'] > current
+
+    if reset:
+        rows = Notification.objects.filter(recipient=user)
+        since = None
+    else:
+        since = cursor['v']
+        if cursor['id'] is None and since == current:
+            return None
+        after = Q(version__gt=since)
+        if cursor['id']:
+            after |= Q(version=since, id__gt=cursor['id'])
+        rows = Notification.objects.filter(after, recipient=user)
+
+    rows = list(rows.order_by('version', 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    upper = rows[-1].version if has_more else current
+
+    deleted = []
+    if not reset:
+        deleted = [
+            str(notification_id) for notification_id in NotificationTombstone.objects.filter(
+                recipient=user, version__gt=since, version__lte=upper
+            ).values_list('notification_id', flat=True)
+        ]
+    # Expired rows are gone as far as the API is concerned
+    deleted += [str(row.pk) for row in rows if row.is_expired and not reset]
+
+    return {
+        'reset': reset,
+        'notifications': [row for row in rows if not row.is_expired],
+        'deleted': deleted,
+        'cursor': encode_cursor(rows[-1].version, rows[-1].pk) if has_more else encode_cursor(current),
+        'has_more': has_more,
+        'unread': unread,
+        'total': total,
+    }
+
+
+def purge_tombstones(batch_size=1000, now=None):
+    """Delete tombstones past the sync horizon in batches. Returns the number deleted."""
+    cutoff = (now or timezone.now()) - timedelta(days=TOMBSTONE_DAYS)
+    deleted = 0
+    while True:
+        ids = list(NotificationTombstone.objects.filter(
+            created_at__lt=cutoff
+        ).order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += NotificationTombstone.objects.filter(pk__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return deleted
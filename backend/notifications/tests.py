@@ -1,3 +1,621 @@
-from django.test import TestCase
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+from rest_framework.test import APIClient
+from unittest import mock
 
-# Create your tests here.
+from clubs.models import Club
+from events.models import Event
+from messaging.models import MessageThread
+from users.models import User
+from . import backends, counters, mailer, outbox, push, reminders, retention, sync
+from .models import (
+    Notification, NotificationCounter, NotificationDelivery, NotificationPreference, NotificationTombstone,
+    ScheduledReminder,
+)
+from .preferences import PreferenceCache, channels_for, preference_cache
+from .services import NotificationService
+
+
+def make_event(organizer, start, slug='launch'):
+    club = Club.objects.create(name=f'Club {slug}', slug=f'club-{slug}', description='Club')
+    return Event.objects.create(
+        title='Launch', slug=slug, description='Launch night', primary_club=club, location='Hall',
+        start_datetime=start, end_datetime=start + timedelta(hours=2), created_by=organizer, status='approved'
+    )
+
+
+class ReminderTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.user = User.objects.create(email='organizer@example.com', username='organizer')
+        for channel in ('in_app', 'email'):
+            NotificationPreference.objects.create(
+                user=self.user, notification_type='event_reminder', channel=channel, reminder_offsets=[60, 30]
+            )
+        self.start = timezone.now() + timedelta(hours=3)
+        self.event = make_event(self.user, self.start)
+
+    def test_every_offset_is_its_own_notification_and_delivery(self):
+        rows = ScheduledReminder.objects.filter(event=self.event, status='pending')
+        self.assertEqual(sorted(rows.values_list('offset_minutes', flat=True)), [30, 60])
+
+        # Both offsets come due in the same pass
+        result = reminders.fire(list(rows.values_list('pk', flat=True)), now=self.start - timedelta(minutes=20))
+        self.assertEqual(result, {'sent': 2, 'cancelled': 0})
+
+        notifications = Notification.objects.filter(recipient=self.user, notification_type='event_reminder')
+        self.assertEqual(notifications.count(), 2)
+        self.assertEqual(
+            sorted(notification.data['offset_minutes'] for notification in notifications), [30, 60]
+        )
+        self.assertTrue(all(notification.count == 1 for notification in notifications))
+        self.assertEqual(NotificationDelivery.objects.filter(channel='email').count(), 2)
+
+    def test_reminders_fire_once(self):
+        ids = list(ScheduledReminder.objects.filter(event=self.event).values_list('pk', flat=True))
+        now = self.start - timedelta(minutes=20)
+        self.assertEqual(reminders.fire(ids, now=now)['sent'], 2)
+        self.assertEqual(reminders.fire(ids, now=now), {'sent': 0, 'cancelled': 0})
+        self.assertEqual(Notification.objects.filter(notification_type='event_reminder').count(), 2)
+
+    @override_settings(NOTIFICATION_COALESCE_RULES={
+        'event_reminder': {'window': 7200, 'group_by': 'event', 'title': '{count} reminders', 'redeliver': True},
+    })
+    def test_redeliver_rule_sends_merged_reminders_again(self):
+        early, late = ScheduledReminder.objects.filter(event=self.event).order_by('-offset_minutes')
+        reminders.fire([early.pk], now=self.start - timedelta(minutes=50))
+        NotificationDelivery.objects.update(status='sent', sent_at=timezone.now())
+
+        reminders.fire([late.pk], now=self.start - timedelta(minutes=20))
+        notification = Notification.objects.get(notification_type='event_reminder')
+        self.assertEqual(notification.count, 2)
+        delivery = NotificationDelivery.objects.get(notification=notification, channel='email')
+        self.assertEqual(delivery.status, 'pending')
+        self.assertIsNone(delivery.sent_at)
+
+
+class ReminderDispatcherTests(TestCase):
+    def test_run_survives_a_failed_refresh(self):
+        dispatcher = reminders.ReminderDispatcher(refresh_interval=60)
+        stop = mock.Mock()
+        stop.is_set.side_effect = [False, True]
+        with mock.patch.object(dispatcher, 'refresh', side_effect=RuntimeError('database is gone')), \
+                mock.patch.object(reminders, 'close_old_connections') as close_old_connections:
+            dispatcher.run(stop)
+        close_old_connections.assert_called_once()
+        stop.wait.assert_called_once()
+        self.assertGreater(dispatcher.seconds_until_next(), 0)
+
+
+@override_settings(NOTIFICATION_CHANNEL_BACKENDS={'email': 'notifications.backends.LocmemBackend'})
+class OutboxTests(TestCase):
+    def setUp(self):
+        backends.outbox.clear()
+        backends.LocmemBackend.fail_recipients = set()
+        self.users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(3)]
+        self.notifications = [
+            Notification.objects.create(recipient=user, notification_type='system', title='Hello', message='Hi')
+            for user in self.users
+        ]
+        outbox.enqueue({'email': self.notifications})
+
+    def test_claims_never_overlap(self):
+        token, claimed = outbox.claim('email', batch_size=2)
+        self.assertEqual(len(claimed), 2)
+        other_token, rest = outbox.claim('email')
+        self.assertEqual(len(rest), 1)
+        self.assertNotEqual(token, other_token)
+        self.assertEqual(outbox.claim('email'), (None, []))
+
+        self.assertEqual(outbox.process('email', token, claimed), {'sent': 2, 'retried': 0, 'failed': 0})
+        self.assertEqual(len(backends.outbox), 2)
+        self.assertEqual(NotificationDelivery.objects.filter(status='sent').count(), 2)
+        self.assertEqual(Notification.objects.filter(is_sent=True).count(), 2)
+
+    def test_expired_lease_is_reclaimed_and_the_old_worker_is_fenced_off(self):
+        stale_token, stale = outbox.claim('email')
+        NotificationDelivery.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        token, claimed = outbox.claim('email')
+        self.assertEqual(len(claimed), 3)
+        self.assertTrue(all(delivery.attempts == 2 for delivery in claimed))
+
+        # The first worker finishing late records nothing
+        self.assertEqual(outbox.process('email', stale_token, stale), {'sent': 0, 'retried': 0, 'failed': 0})
+        self.assertEqual(outbox.process('email', token, claimed)['sent'], 3)
+
+    def test_failures_back_off_then_give_up(self):
+        backends.LocmemBackend.fail_recipients = {self.users[0].email}
+        token, claimed = outbox.claim('email')
+        self.assertEqual(outbox.process('email', token, claimed, max_attempts=2), {'sent': 2, 'retried': 1, 'failed': 0})
+        delivery = NotificationDelivery.objects.get(notification__recipient=self.users[0])
+        self.assertEqual((delivery.status, delivery.attempts), ('pending', 1))
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+        self.assertEqual(outbox.claim('email'), (None, []))
+
+        NotificationDelivery.objects.filter(pk=delivery.pk).update(next_attempt_at=timezone.now())
+        token, claimed = outbox.claim('email')
+        self.assertEqual(outbox.process('email', token, claimed, max_attempts=2)['failed'], 1)
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.last_error), ('failed', 'Simulated email failure'))
+
+    def test_lease_expiring_on_the_final_attempt_fails_the_row(self):
+        outbox.claim('email')
+        NotificationDelivery.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.claim('email', max_attempts=1), (None, []))
+        self.assertEqual(NotificationDelivery.objects.filter(status='failed').count(), 3)
+
+    def test_enqueue_is_idempotent(self):
+        outbox.enqueue({'email': self.notifications})
+        self.assertEqual(NotificationDelivery.objects.count(), 3)
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """Django's locmem backend, counting connections and refusing refused@example.com."""
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any('refused@example.com' in message.to for message in messages):
+            raise RuntimeError('Recipient refused')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='notifications.tests.CountingEmailBackend')
+class MailerTests(TestCase):
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        self.limiter = mailer.RateLimiter(0)
+
+    def messages(self, *recipients):
+        return [mailer.build_message('Hello', 'Hi', recipient) for recipient in recipients]
+
+    def test_one_connection_per_batch_and_failures_stay_alone(self):
+        recipients = [f'member{i}@example.com' for i in range(5)]
+        recipients[1] = 'refused@example.com'
+        failures = mailer.send_messages(self.messages(*recipients), batch_size=3, limiter=self.limiter)
+        self.assertEqual(failures, {1: 'Recipient refused'})
+        self.assertEqual(len(mail.outbox), 4)
+        # Two batches, plus the reconnect after the refusal
+        self.assertEqual(CountingEmailBackend.opened, 3)
+
+    def test_notification_emails_render_once_per_content(self):
+        users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(3)]
+        notifications = [
+            Notification(recipient=user, notification_type='system', title='Hello', message='Hi') for user in users
+        ]
+        with mock.patch.object(mailer, 'render_email', wraps=mailer.render_email) as render_email:
+            messages = mailer.render_notification_emails(notifications)
+        self.assertEqual(render_email.call_count, 1)
+        self.assertEqual([message.to for message in messages], [[user.email] for user in users])
+
+    def test_background_queue_is_bounded(self):
+        background = mailer.BackgroundMailer(max_queued=2)
+        with mock.patch.object(background, '_ensure_started'):
+            results = [
+                background.send(message) for message in self.messages('a@example.com', 'b@example.com', 'c@example.com')
+            ]
+        self.assertEqual(results, [True, True, False])
+        background.flush()
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com']])
+
+
+@override_settings(NOTIFICATION_CHANNEL_BACKENDS={'email': 'notifications.backends.LocmemBackend'})
+class CoalescingTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        backends.outbox.clear()
+        self.user = User.objects.create(email='member@example.com', username='member')
+        self.sender = User.objects.create(email='sender@example.com', username='sender')
+        self.threads = [MessageThread.objects.create(thread_type='direct', created_by=self.sender) for _ in range(2)]
+
+    def notify(self, thread, text, **fields):
+        return NotificationService.dispatch([Notification(
+            recipient=self.user, notification_type='message', title='New message', message=text,
+            message_thread=thread, **fields
+        )], fail_silently=False)
+
+    def test_messages_in_one_thread_fold_into_one_row(self):
+        self.notify(self.threads[0], 'first')
+        self.notify(self.threads[0], 'second')
+        self.notify(self.threads[1], 'elsewhere')
+
+        row = Notification.objects.get(message_thread=self.threads[0])
+        self.assertEqual((row.count, row.title, row.message), (2, '2 new messages', 'second'))
+        self.assertEqual([item['message'] for item in row.data['items']], ['second', 'first'])
+        self.assertEqual(Notification.objects.get(message_thread=self.threads[1]).count, 1)
+
+    def test_read_or_old_rows_are_left_alone(self):
+        self.notify(self.threads[0], 'first')
+        Notification.objects.update(is_read=True)
+        self.notify(self.threads[0], 'after reading')
+        self.notify(self.threads[0], 'much later', created_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(
+            list(Notification.objects.order_by('created_at').values_list('count', flat=True)), [1, 1, 1]
+        )
+
+    def test_a_batch_coalesces_within_itself(self):
+        NotificationService.dispatch([
+            Notification(recipient=self.user, notification_type='message', title='New message',
+                         message=f'Message {i}', message_thread=self.threads[0])
+            for i in range(3)
+        ], fail_silently=False)
+        self.assertEqual(Notification.objects.get().count, 3)
+
+    def test_digest_deliveries_wait_and_combine_per_recipient(self):
+        NotificationPreference.objects.create(
+            user=self.user, notification_type='message', channel='email', digest='daily'
+        )
+        preference_cache.clear_local()
+        self.notify(self.threads[0], 'first')
+        self.notify(self.threads[1], 'second')
+
+        deliveries = NotificationDelivery.objects.filter(channel='email')
+        self.assertEqual(set(deliveries.values_list('digest', flat=True)), {'daily'})
+        self.assertEqual(outbox.claim_digests('email'), (None, []))
+
+        deliveries.update(next_attempt_at=timezone.now())
+        token, claimed = outbox.claim_digests('email')
+        self.assertEqual(outbox.process_digests('email', token, claimed), {'sent': 2, 'retried': 0, 'failed': 0})
+        self.assertEqual(len(backends.outbox), 1)
+        self.assertEqual(backends.outbox[0][1].title, 'You have 2 new notifications')
+
+
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(3)]
+        self.user = self.users[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, title='Hello', **options):
+        return NotificationService.send_bulk(self.users, 'system', title, 'Hi', **options)
+
+    def counts(self):
+        response = self.client.get('/api/notifications/count/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['unread'], response.data['total']
+
+    def version(self):
+        return counters.get_state(self.user)[2]
+
+    def test_fan_out_read_and_delete_keep_counts_exact(self):
+        self.send('First')
+        notifications = self.send('Second')
+        self.assertEqual(self.counts(), (2, 2))
+        self.assertEqual(NotificationCounter.objects.get(user=self.users[2]).unread, 2)
+
+        mine = next(notification for notification in notifications if notification.recipient_id == self.user.pk)
+        version = self.version()
+        self.client.post(f'/api/notifications/{mine.pk}/mark_read/')
+        self.client.post(f'/api/notifications/{mine.pk}/mark_read/')
+        self.assertEqual(self.counts(), (1, 2))
+        self.assertGreater(self.version(), version)
+
+        self.client.delete(f'/api/notifications/{mine.pk}/')
+        self.assertEqual(self.counts(), (1, 1))
+        self.client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(self.counts(), (0, 1))
+        # Other recipients are untouched
+        self.assertEqual(counters.get_counts(self.users[1]), (2, 2))
+
+    def test_badge_poll_is_one_query(self):
+        self.send()
+        self.counts()
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.get_counts(self.user), (1, 1))
+
+    def test_expiry_sweep_takes_expired_notifications_out_of_the_counts(self):
+        self.send('Fresh')
+        self.send('Stale')
+        Notification.objects.filter(title='Stale').update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(len(self.client.get('/api/notifications/').data), 1)
+        version = self.version()
+
+        call_command('purge_notifications', '--expired-only', '--pause=0', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 1)
+
+    def test_reconcile_repairs_drift_and_bumps_the_version(self):
+        self.send()
+        Notification.objects.filter(recipient=self.user).delete()  # behind the counter's back
+        version = self.version()
+        output = StringIO()
+        call_command('reconcile_notification_counters', stdout=output)
+        self.assertIn('Repaired 1 drifted counters across 3 users.', output.getvalue())
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertEqual(self.version(), version + 1)
+
+
+class NotificationSyncTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.user = User.objects.create(email='member@example.com', username='member')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.notifications = [self.send(f'Notification {i}') for i in range(3)]
+
+    def send(self, title):
+        return NotificationService.send_bulk([self.user], 'system', title, 'Hi')[0]
+
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get('/api/notifications/sync/', params)
+
+    def test_delta_since_cursor(self):
+        response = self.sync()
+        self.assertTrue(response.data['reset'])
+        self.assertEqual(len(response.data['notifications']), 3)
+        cursor = response.data['cursor']
+        self.assertEqual(self.sync(cursor).status_code, 304)
+
+        first, second, _ = self.notifications
+        self.client.post(f'/api/notifications/{first.pk}/mark_read/')
+        self.client.delete(f'/api/notifications/{second.pk}/')
+        new = self.send('Notification 3')
+
+        data = self.sync(cursor).data
+        self.assertFalse(data['reset'])
+        self.assertEqual([item['id'] for item in data['notifications']], [str(first.pk), str(new.pk)])
+        self.assertTrue(data['notifications'][0]['is_read'])
+        self.assertEqual(data['deleted'], [str(second.pk)])
+        self.assertEqual((data['unread'], data['total']), (2, 3))
+        self.assertEqual(self.sync(data['cursor']).status_code, 304)
+
+    def test_expiry_between_polls_is_reported(self):
+        cursor = self.sync().data['cursor']
+        expired = self.notifications[0]
+        Notification.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('purge_notifications', '--expired-only', '--pause=0', stdout=StringIO())
+
+        data = self.sync(cursor).data
+        self.assertEqual(data['deleted'], [str(expired.pk)])
+        self.assertEqual(data['notifications'], [])
+        self.assertEqual((data['unread'], data['total']), (2, 2))
+        with self.assertNumQueries(1):
+            self.assertIsNone(sync.changes(self.user, sync.decode_cursor(data['cursor'])))
+
+    def test_pages_resume_mid_version(self):
+        # One fan-out stamps all three rows with the same version
+        Notification.objects.update(version=counters.get_state(self.user)[2])
+        seen = []
+        data = self.sync(limit=2).data
+        seen += [item['id'] for item in data['notifications']]
+        self.assertTrue(data['has_more'])
+        data = self.sync(data['cursor'], limit=2).data
+        seen += [item['id'] for item in data['notifications']]
+        self.assertFalse(data['has_more'])
+        self.assertEqual(sorted(seen), sorted(str(notification.pk) for notification in self.notifications))
+
+    def test_stale_or_forged_cursors(self):
+        self.assertEqual(self.sync('not-a-cursor').status_code, 400)
+        with mock.patch.object(sync, 'TOMBSTONE_DAYS', -1):
+            self.assertTrue(self.sync(sync.encode_cursor(1)).data['reset'])
+        self.assertTrue(self.sync(sync.encode_cursor(10 ** 6)).data['reset'])
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+class NotificationPushTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(2)]
+        self.layer = RecordingLayer()
+        patcher = mock.patch.object(push, 'get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def notification(self, user, title):
+        return Notification(recipient=user, notification_type='system', title=title, message='Hi')
+
+    def test_one_message_per_recipient_after_commit(self):
+        first, second = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.dispatch([
+                self.notification(first, 'One'), self.notification(first, 'Two'), self.notification(second, 'Three')
+            ])
+            self.assertEqual(self.layer.sent, [])
+
+        sent = dict(self.layer.sent)
+        self.assertEqual(len(self.layer.sent), 2)
+        batch = sent[push.user_group(first.pk)]
+        self.assertEqual((batch['type'], batch['unread']), ('notification_batch', 2))
+        self.assertEqual([item['title'] for item in batch['notifications']], ['One', 'Two'])
+        single = sent[push.user_group(second.pk)]
+        self.assertEqual(
+            (single['type'], single['notification']['title'], single['unread']), ('notification', 'Three', 1)
+        )
+
+    def test_rolled_back_notifications_are_not_pushed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                NotificationService.dispatch([self.notification(self.users[0], 'Gone')], fail_silently=False)
+                raise RuntimeError('rollback')
+        self.assertEqual(self.layer.sent, [])
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(2)]
+        now = timezone.now()
+        for i in range(5):
+            NotificationService.send_bulk(self.users, 'system', f'Expired {i}', 'Hi')
+        for i in range(2):
+            NotificationService.send_bulk(self.users, 'system', f'Old read {i}', 'Hi')
+        NotificationService.send_bulk(self.users, 'system', 'Kept', 'Hi')
+        Notification.objects.filter(title__startswith='Expired').update(expires_at=now - timedelta(minutes=1))
+        Notification.objects.filter(title__startswith='Old read').update(is_read=True, read_at=now - timedelta(days=60))
+        # Keep the counters in step with the read-state change made behind their back
+        call_command('reconcile_notification_counters', stdout=StringIO())
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(retention.count_due(), {'expired': 10, 'read': 4})
+        self.assertEqual(retention.count_due(expired_only=True), {'expired': 10})
+        output = StringIO()
+        call_command('purge_notifications', '--dry-run', stdout=output)
+        self.assertIn('Would purge 10 expired and 4 read notifications.', output.getvalue())
+        self.assertEqual(Notification.objects.count(), 16)
+
+    def test_batches_stop_at_the_limit_and_resume(self):
+        metrics = retention.purge(batch_size=4, max_batches=2)
+        self.assertEqual((metrics['expired'], metrics['batches'], metrics['complete']), (8, 2, False))
+
+        metrics = retention.purge(batch_size=4)
+        # The last 2 expired rows in a short batch, then the 4 read ones in a full one
+        self.assertEqual((metrics['expired'], metrics['read'], metrics['batches']), (2, 4, 2))
+        self.assertTrue(metrics['complete'])
+        self.assertEqual(list(Notification.objects.values_list('title', flat=True)), ['Kept', 'Kept'])
+
+    def test_purge_feeds_counters_and_tombstones(self):
+        user = self.users[0]
+        version = counters.get_state(user)[2]
+        retention.purge(batch_size=3)
+        unread, total, new_version = counters.get_state(user)
+        self.assertEqual((unread, total), (1, 1))
+        self.assertGreater(new_version, version)
+        self.assertEqual(NotificationTombstone.objects.filter(recipient=user).count(), 7)
+        # The sweep leaves nothing for reconcile to repair
+        output = StringIO()
+        call_command('reconcile_notification_counters', '--dry-run', stdout=output)
+        self.assertIn('Found 0 drifted counters', output.getvalue())
+
+    def test_purge_batches_are_found_through_the_partial_indexes(self):
+        for metric, predicate in retention.purge_rules()[:2]:
+            plan = Notification.objects.filter(predicate).order_by().values_list('pk')[:10].explain()
+            self.assertIn('notification_expiry_idx' if metric == 'expired' else 'notification_read_idx', plan)
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, Notification._meta.db_table)
+        # The full (recipient, is_read, created_at) index gave way to the partial ones
+        self.assertNotIn('notificatio_recipie_86ea8b_idx', indexes)
+        self.assertIn('notification_unread_idx', indexes)
+
+
+class PreferenceCacheTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.user = User.objects.create(email='member@example.com', username='member')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def channels(self, cache=preference_cache, notification_type='event_update'):
+        return channels_for(cache.get_mask(self.user.pk), notification_type)
+
+    def test_users_without_rows_get_the_default_channels(self):
+        self.assertEqual(self.channels(), ['in_app'])
+        effective = self.client.get('/api/notifications/preferences/effective/').data
+        self.assertEqual(set(map(tuple, effective.values())), {('in_app',)})
+
+        NotificationPreference.objects.create(
+            user=self.user, notification_type='event_update', channel='in_app', is_enabled=False
+        )
+        preference_cache.invalidate(self.user.pk)
+        # An explicit row wins over the default, for its own pair only
+        self.assertEqual(self.channels(), [])
+        self.assertEqual(self.channels(notification_type='announcement'), ['in_app'])
+
+    def test_masks_are_served_from_memory(self):
+        self.channels()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.channels(), ['in_app'])
+
+    def test_a_write_invalidates_this_process(self):
+        self.assertEqual(self.channels(), ['in_app'])
+        response = self.client.post(
+            '/api/notifications/preferences/', {'notification_type': 'event_update', 'channel': 'email'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.channels(), ['email', 'in_app'])
+
+        url = f"/api/notifications/preferences/{response.data['id']}/"
+        self.client.patch(url, {'is_enabled': False}, format='json')
+        self.assertEqual(self.channels(), ['in_app'])
+        self.client.delete(url)
+        self.assertEqual(self.channels(), ['in_app'])
+
+    def test_a_write_elsewhere_retires_the_shared_entry(self):
+        # Another process: its own LRU (expiring at once here), the same shared cache
+        other = PreferenceCache(local_ttl=0)
+        self.assertEqual(self.channels(other), ['in_app'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.channels(other), ['in_app'])
+
+        self.client.post(
+            '/api/notifications/preferences/', {'notification_type': 'event_update', 'channel': 'email'}, format='json'
+        )
+        # The version bump makes the other process miss and reload
+        self.assertEqual(self.channels(other), ['email', 'in_app'])
+
+
+class FanOutTests(TestCase):
+    def setUp(self):
+        preference_cache.clear_local()
+        self.users = [User.objects.create(email=f'member{i}@example.com', username=f'member{i}') for i in range(4)]
+
+    def test_one_bad_recipient_does_not_sink_the_batch(self):
+        bad = self.users[2]
+        record_created = counters.record_created
+
+        def fail_for_bad(notifications, merged=()):
+            if any(notification.recipient_id == bad.pk for notification in notifications):
+                raise RuntimeError('constraint failed')
+            return record_created(notifications, merged)
+
+        with mock.patch.object(counters, 'record_created', side_effect=fail_for_bad), \
+                self.assertLogs('notifications.services', 'ERROR') as logs:
+            sent = NotificationService.send_bulk(self.users, 'system', 'Hello', 'Hi')
+
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(
+            set(Notification.objects.values_list('recipient_id', flat=True)), {user.pk for user in self.users} - {bad.pk}
+        )
+        self.assertIn(str(bad.pk), logs.output[-1])
+        self.assertEqual(counters.get_counts(self.users[0]), (1, 1))
+        self.assertEqual(counters.get_counts(bad), (0, 0))
+
+    def test_batch_merges_are_not_applied_twice_on_retry(self):
+        thread = MessageThread.objects.create(thread_type='direct', created_by=self.users[1])
+        notifications = [
+            Notification(recipient=self.users[0], notification_type='message', title='New message',
+                         message=f'Message {i}', message_thread=thread)
+            for i in range(2)
+        ] + [Notification(recipient=self.users[1], notification_type='system', title='Hello', message='Hi')]
+        queue_deliveries = NotificationService.queue_deliveries
+        calls = []
+
+        def fail_first_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise RuntimeError('outbox unavailable')
+            return queue_deliveries(*args, **kwargs)
+
+        with mock.patch.object(NotificationService, 'queue_deliveries', side_effect=fail_first_batch):
+            NotificationService.dispatch(notifications)
+        self.assertEqual(Notification.objects.get(recipient=self.users[0]).count, 2)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_errors_propagate_when_asked(self):
+        with mock.patch.object(counters, 'record_created', side_effect=RuntimeError('constraint failed')):
+            with self.assertRaises(RuntimeError):
+                NotificationService.dispatch([
+                    Notification(recipient=user, notification_type='system', title='Hello', message='Hi')
+                    for user in self.users
+                ], fail_silently=False)
+        self.assertFalse(Notification.objects.exists())
@@ -2,10 +2,13 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
 
 from .models import Notification, NotificationPreference
 from .serializers import NotificationSerializer, NotificationPreferenceSerializer
+from . import counters, sync
+from .preferences import preference_cache, channels_for, TYPES
 
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
@@ -13,10 +16,24 @@ class NotificationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         return Notification.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gte=timezone.now()),
             recipient=self.request.user
-        ).exclude(
-            Q(expires_at__lt=timezone.now()) & Q(expires_at__isnull=False)
-        ).order_by('-created_at')
+        ).order_by('-updated_at')
+    
+    def perform_update(self, serializer):
+        was_read = serializer.instance.is_read
+        is_read = serializer.validated_data.get('is_read', was_read)
+        with transaction.atomic():
+            version = counters.bump(
+                serializer.instance.recipient_id, unread=0 if is_read == was_read else (1 if was_read else -1)
+            )
+            serializer.save(version=version)
+    
+    def perform_destroy(self, instance):
+        row = (instance.pk, instance.recipient_id, instance.is_read)
+        with transaction.atomic():
+            instance.delete()
+            counters.record_deleted([row])
     
     @action(detail=False, methods=['get'])
     def unread(self, request):
@@ -26,30 +43,57 @@ class NotificationViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        notifications = self.get_queryset().filter(is_read=False)
-        notifications.update(is_read=True, read_at=timezone.now())
+        # Expired rows are included so they stop counting as unread too
+        with transaction.atomic():
+            version = counters.bump(request.user.pk)
+            updated = Notification.objects.filter(
+                recipient=request.user, is_read=False
+            ).update(is_read=True, read_at=timezone.now(), version=version)
+            counters.apply(unread={request.user.pk: -updated}, bump_version=False)
         
         return Response(
-            {'message': f'Marked {notifications.count()} notifications as read.'},
+            {'message': f'Marked {updated} notifications as read.'},
             status=status.HTTP_200_OK
         )
     
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.read_at = timezone.now()
-        notification.save()
+        if not notification.is_read:
+            with transaction.atomic():
+                version = counters.bump(request.user.pk)
+                if Notification.objects.filter(pk=notification.pk, is_read=False).update(
+                    is_read=True, read_at=timezone.now(), version=version
+                ):
+                    counters.apply(unread={request.user.pk: -1}, bump_version=False)
         
         return Response(
             {'message': 'Notification marked as read.'},
             status=status.HTTP_200_OK
         )
     
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """Changes since ?cursor= (everything when omitted); 304 when there are none."""
+        cursor = request.query_params.get('cursor')
+        try:
+            cursor = sync.decode_cursor(cursor) if cursor else None
+            limit = min(int(request.query_params.get('limit', sync.PAGE_SIZE)), sync.MAX_PAGE_SIZE)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = sync.changes(request.user, cursor, limit)
+        if result is None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        
+        result['notifications'] = self.get_serializer(result['notifications'], many=True).data
+        return Response(result)
+    
     @action(detail=False, methods=['get'])
     def count(self, request):
-        unread_count = self.get_queryset().filter(is_read=False).count()
-        total_count = self.get_queryset().count()
+        unread_count, total_count = counters.get_counts(request.user)
         
         return Response({
             'unread': unread_count,
@@ -64,4 +108,22 @@ class NotificationPreferenceViewSet(viewsets.ModelViewSet):
         return NotificationPreference.objects.filter(user=self.request.user)
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
\ No newline at end of file
+        serializer.save(user=self.request.user)
+        preference_cache.invalidate(self.request.user.pk)
+    
+    def perform_update(self, serializer):
+        serializer.save()
+        preference_cache.invalidate(self.request.user.pk)
+    
+    def perform_destroy(self, instance):
+        instance.delete()
+        preference_cache.invalidate(self.request.user.pk)
+    
+    @action(detail=False, methods=['get'])
+    def effective(self, request):
+        """Enabled channels per notification type, including defaults for types with no rows"""
+        mask = preference_cache.get_mask(request.user.pk)
+        return Response({
+            notification_type: channels_for(mask, notification_type)
+            for notification_type in TYPES
+        })
\ No newline at end of file
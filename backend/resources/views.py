@@ -13,6 +13,7 @@ from .serializers import (
 )
 from users.permissions import IsAdmin, IsAdminOrOrganizer
 from clubs.models import ClubMembership
+from analytics.counters import activity_counter
 
 class ResourceCategoryViewSet(viewsets.ModelViewSet):
     queryset = ResourceCategory.objects.all()
@@ -180,6 +181,7 @@ class ResourceBookingViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             booking = serializer.save()
+            activity_counter.increment(request.user, 'resource_bookings')
             return Response(
                 ResourceBookingSerializer(booking).data,
                 status=status.HTTP_201_CREATED
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='is_email_verified',
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='purpose',
+            field=models.CharField(choices=[('password_reset', 'Password Reset'), ('login', 'Login')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='username',
+            field=models.CharField(max_length=150, unique=True),
+        ),
+    ]
@@ -14,6 +14,8 @@ from .serializers import UserProfileSerializer, UserSerializer  # Add UserSerial
 from .serializers import OTPRequestSerializer, OTPVerifySerializer
 from .serializers import PasswordResetSerializer, UserUpdateSerializer
 from .permissions import IsAdmin, IsOrganizer
+from analytics.counters import activity_counter
+from notifications.mailer import background_mailer, build_message, render_email
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
@@ -90,8 +92,10 @@ class AuthViewSet(viewsets.GenericViewSet):
                 user_agent=request.META.get('HTTP_USER_AGENT', '')
             )
             
-            # TODO: Send OTP via email (implement email service)
-            # For now, return in response (remove in production)
+            text, html = render_email('otp', {'otp_code': otp_code, 'expires_in': '10 minutes'})
+            background_mailer.send(build_message('Your verification code', text, user.email, html))
+            
+            # For now, also return in response (remove in production)
             return Response({
                 'message': 'OTP sent successfully.',
                 'otp': otp_code,  # Remove this in production
@@ -114,6 +118,7 @@ class AuthViewSet(viewsets.GenericViewSet):
             
             if purpose == 'login':
                 token, created = Token.objects.get_or_create(user=user)
+                activity_counter.increment(user, 'login_count')
                 
                 # Create activity log
                 UserActivityLog.objects.create(
@@ -148,6 +153,7 @@ class AuthViewSet(viewsets.GenericViewSet):
             user = serializer.validated_data['user']
             
             token, created = Token.objects.get_or_create(user=user)
+            activity_counter.increment(user, 'login_count')
             
             # Create activity log
             UserActivityLog.objects.create(
@@ -1,9 +1,13 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authtoken.models import Token
+from .presence import presence, thread_participant_ids
+from .typing_indicators import typing_coalescer
 import jwt
 
 User = get_user_model()
@@ -14,17 +18,20 @@ class BaseConsumer(AsyncWebsocketConsumer):
         if self.user and self.user.is_authenticated:
             await self.accept()
             await self.add_to_groups()
+            await presence.connect(self.user.id, self.channel_name, self.channel_layer)
         else:
             await self.close()
 
     async def disconnect(self, close_code):
+        if getattr(self, 'user', None) and self.user.is_authenticated:
+            await presence.disconnect(self.user.id, self.channel_name)
         await self.remove_from_groups()
 
     async def get_user(self):
         token = None
         
         # Check query parameters
-        token = self.scope.get('query_string').decode().split('token=')[-1]
+        token = self.query_param('token')
         
         if not token:
             # Check headers
@@ -37,7 +44,7 @@ class BaseConsumer(AsyncWebsocketConsumer):
         if token:
             try:
                 # Try Token authentication
-                token_obj = await database_sync_to_async(Token.objects.get)(key=token)
+                token_obj = await database_sync_to_async(Token.objects.select_related('user').get)(key=token)
                 return token_obj.user
             except Token.DoesNotExist:
                 try:
@@ -51,6 +58,10 @@ class BaseConsumer(AsyncWebsocketConsumer):
         
         return AnonymousUser()
 
+    def query_param(self, name):
+        """A parameter of the connection URL's query string, '' if absent"""
+        return parse_qs(self.scope.get('query_string', b'').decode()).get(name, [''])[0]
+
     async def add_to_groups(self):
         # User group
         await self.channel_layer.group_add(
@@ -89,6 +100,16 @@ class BaseConsumer(AsyncWebsocketConsumer):
                 await self.handle_mark_read(data)
             elif event_type == 'typing':
                 await self.handle_typing(data)
+            elif event_type == 'sync':
+                await self.handle_sync(data)
+            elif event_type == 'heartbeat':
+                if not presence.heartbeat(self.user.id, self.channel_name):
+                    # Expired for missing heartbeats: reconnecting registers the connection again
+                    await self.close()
+            elif event_type == 'presence_subscribe':
+                await self.handle_presence_subscribe(data)
+            elif event_type == 'presence_unsubscribe':
+                await self.handle_presence_unsubscribe(data)
             
         except json.JSONDecodeError:
             await self.send_error('Invalid JSON')
@@ -99,6 +120,13 @@ class BaseConsumer(AsyncWebsocketConsumer):
             'message': message
         }))
 
+    async def presence_diff(self, event):
+        """Online/offline changes among the users this connection watches"""
+        await self.send(text_data=json.dumps({
+            'type': 'presence_diff',
+            'changes': event['changes']
+        }))
+
 class NotificationConsumer(BaseConsumer):
     async def add_to_groups(self):
         await super().add_to_groups()
@@ -133,7 +161,16 @@ class NotificationConsumer(BaseConsumer):
         """Send notification to user"""
         await self.send(text_data=json.dumps({
             'type': 'notification',
-            'notification': event['notification']
+            'notification': event['notification'],
+            'unread': event.get('unread')
+        }))
+
+    async def notification_batch(self, event):
+        """Send several notifications from one fan-out in a single frame"""
+        await self.send(text_data=json.dumps({
+            'type': 'notification_batch',
+            'notifications': event['notifications'],
+            'unread': event.get('unread')
         }))
 
     async def event_update(self, event):
@@ -151,6 +188,11 @@ class NotificationConsumer(BaseConsumer):
         }))
 
 class MessageConsumer(BaseConsumer):
+    async def connect(self):
+        # `?compact=1` selects the compact message frames, as on the REST API
+        self.compact = self.query_param('compact').lower() in ('1', 'true', 'yes')
+        await super().connect()
+
     async def add_to_groups(self):
         await super().add_to_groups()
         
@@ -188,7 +230,8 @@ class MessageConsumer(BaseConsumer):
     async def handle_send_message(self, data):
         """Handle sending a message"""
         from messaging.models import MessageThread, Message
-        from messaging.serializers import MessageSerializer
+        from messaging.serializers import message_event
+        from analytics.counters import activity_counter
         
         thread_id = data.get('thread_id')
         content = data.get('content')
@@ -210,28 +253,16 @@ class MessageConsumer(BaseConsumer):
                 attachments=attachments
             )
             
-            # Serialize message
-            serializer = MessageSerializer(message)
-            message_data = serializer.data
+            activity_counter.increment(self.user, 'messages_sent')
+            
+            # Serialize message once in both formats; each participant's consumer picks one
+            event = await database_sync_to_async(message_event)(message)
             
             # Send to thread participants
-            await self.channel_layer.group_send(
-                f'thread_{thread_id}',
-                {
-                    'type': 'message',
-                    'message': message_data
-                }
-            )
+            await self.channel_layer.group_send(f'thread_{thread_id}', event)
             
-            # Send typing stopped event
-            await self.channel_layer.group_send(
-                f'thread_{thread_id}',
-                {
-                    'type': 'typing',
-                    'user_id': str(self.user.id),
-                    'is_typing': False
-                }
-            )
+            # Sending ends the sender's typing indicator in the next coalesced frame
+            await typing_coalescer.update(self.channel_layer, thread_id, self.user.id, is_typing=False)
             
         except MessageThread.DoesNotExist:
             await self.send_error('Thread not found or access denied')
@@ -262,27 +293,67 @@ class MessageConsumer(BaseConsumer):
         except Message.DoesNotExist:
             await self.send_error('Message not found')
 
-    async def handle_typing(self, data):
-        """Handle typing indicator"""
+    async def handle_sync(self, data):
+        """Replay messages missed while disconnected: `threads` maps thread ids to the last seq the client has"""
+        from messaging.services import MessageSyncService
+        
+        try:
+            positions = MessageSyncService.parse_positions(data.get('threads') or {})
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+        
+        batches = await database_sync_to_async(MessageSyncService.replay)(self.user, positions)
+        for batch in batches:
+            await self.send(text_data=json.dumps({'type': 'sync_batch', **batch}))
+        await self.send(text_data=json.dumps({'type': 'sync_complete'}))
+
+    async def handle_presence_subscribe(self, data):
+        """Watch a thread's participants: replies with who is online now, then sends presence_diff frames"""
         thread_id = data.get('thread_id')
-        is_typing = data.get('is_typing')
+        participant_ids = await database_sync_to_async(thread_participant_ids)(thread_id, self.user)
+        if participant_ids is None:
+            await self.send_error('Thread not found or access denied')
+            return
         
-        # Broadcast typing status to thread (except sender)
-        await self.channel_layer.group_send(
-            f'thread_{thread_id}',
-            {
-                'type': 'typing',
-                'user_id': str(self.user.id),
-                'is_typing': is_typing
-            }
+        await self.send(text_data=json.dumps({
+            'type': 'presence_state',
+            'thread_id': thread_id,
+            'users': presence.subscribe(self.channel_name, participant_ids)
+        }))
+
+    async def handle_presence_unsubscribe(self, data):
+        """Stop watching a thread's participants (or everyone, without a thread_id)"""
+        thread_id = data.get('thread_id')
+        participant_ids = None
+        if thread_id:
+            participant_ids = await database_sync_to_async(thread_participant_ids)(thread_id, self.user)
+            if participant_ids is None:
+                return
+        presence.unsubscribe(self.channel_name, participant_ids)
+
+    async def handle_typing(self, data):
+        """Handle typing indicator: throttled and coalesced per thread, see websocket.typing_indicators"""
+        thread_id = data.get('thread_id')
+        if not thread_id:
+            return
+        await typing_coalescer.update(
+            self.channel_layer, thread_id, self.user.id, is_typing=data.get('is_typing', True) is not False
         )
 
     async def message(self, event):
-        """Receive a message"""
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message': event['message']
-        }))
+        """Receive a message, in the format this connection asked for"""
+        if self.compact:
+            await self.send(text_data=json.dumps({
+                'type': 'message',
+                'message': event['compact']['message'],
+                'users': event['compact']['users']
+            }))
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'message',
+                'message': event['message']
+            }))
 
     async def message_read(self, event):
         """Receive message read receipt"""
@@ -292,12 +363,17 @@ class MessageConsumer(BaseConsumer):
             'user_id': event['user_id']
         }))
 
-    async def typing(self, event):
-        """Receive typing indicator"""
-        # Don't send typing indicator to the user who is typing
-        if event['user_id'] != str(self.user.id):
+    async def typing_batch(self, event):
+        """Receive the coalesced typing state of a thread"""
+        # Don't echo the user's own typing back to them
+        me = str(self.user.id)
+        typing = [user_id for user_id in event['typing'] if user_id != me]
+        stopped = [user_id for user_id in event['stopped'] if user_id != me]
+        if typing or stopped:
             await self.send(text_data=json.dumps({
-                'type': 'typing',
-                'user_id': event['user_id'],
-                'is_typing': event['is_typing']
-            }))
\ No newline at end of file
+                'type': 'typing_batch',
+                'thread_id': event['thread_id'],
+                'typing': typing,
+                'stopped': stopped,
+                'expires_in': event['expires_in']
+            }))
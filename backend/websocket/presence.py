@@ -0,0 +1,280 @@
+"""
+Online/last-seen presence for websocket users.
+
+Every worker keeps a PresenceStore in memory: its own open connections
+per user (from BaseConsumer.connect/disconnect, refreshed by client
+heartbeats) plus the online users other workers last reported. Workers
+share their online sets over the channel layer: each one listens on its
+own channel in the ``presence_workers`` group and publishes a snapshot
+whenever its local set changes, and every PRESENCE_SNAPSHOT_INTERVAL
+seconds regardless. A worker that stops publishing drops out after three
+intervals; a connection without a heartbeat for PRESENCE_CONNECTION_TIMEOUT
+seconds is treated as closed, and later heartbeats on it are ignored (the
+consumer closes the socket so the client reconnects). With the in-memory
+channel layer this all stays within the one process.
+
+Consumers subscribe to the users they display (typically a thread's
+participants). Online/offline transitions are collected and flushed every
+PRESENCE_FLUSH_INTERVAL seconds as one ``presence_diff`` frame per
+subscribed channel, listing only the users that channel watches.
+"""
+from django.conf import settings
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+WORKERS_GROUP = 'presence_workers'
+FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 2.0)
+SNAPSHOT_INTERVAL = getattr(settings, 'PRESENCE_SNAPSHOT_INTERVAL', 15.0)
+CONNECTION_TIMEOUT = getattr(settings, 'PRESENCE_CONNECTION_TIMEOUT', 90.0)
+
+
+class PresenceStore:
+    """Presence state of one worker. Not thread-safe; used from the worker's event loop."""
+
+    def __init__(self, connection_timeout=CONNECTION_TIMEOUT, worker_timeout=SNAPSHOT_INTERVAL * 3):
+        self.connection_timeout = connection_timeout
+        self.worker_timeout = worker_timeout
+        self._connections = {}   # user_id -> {channel_name: last heartbeat}
+        self._remote = {}        # worker_id -> (user_ids online there, time of the snapshot)
+        self._remote_count = {}  # user_id -> number of other workers reporting them online
+        self._last_seen = {}     # user_id -> time they were last online
+        self._watchers = {}      # user_id -> channel names subscribed to them
+        self._watching = {}      # channel_name -> user_ids it is subscribed to
+        self._pending = {}       # user_id -> online, transitions not yet flushed
+        self.local_changed = False
+
+    def is_online(self, user_id):
+        return user_id in self._connections or self._remote_count.get(user_id, 0) > 0
+
+    def last_seen(self, user_id):
+        return self._last_seen.get(user_id)
+
+    def online_among(self, user_ids):
+        return [user_id for user_id in user_ids if self.is_online(user_id)]
+
+    def local_online(self):
+        return list(self._connections)
+
+    def _transition(self, user_id, was_online, now):
+        online = self.is_online(user_id)
+        if online != was_online:
+            self._last_seen[user_id] = now
+            if user_id in self._watchers:
+                self._pending[user_id] = online
+        elif online:
+            self._last_seen[user_id] = now
+
+    def connect(self, user_id, channel_name, now):
+        was_online = self.is_online(user_id)
+        connections = self._connections.setdefault(user_id, {})
+        self.local_changed |= not connections
+        connections[channel_name] = now
+        self._transition(user_id, was_online, now)
+
+    def heartbeat(self, user_id, channel_name, now):
+        """Refresh an open connection. Returns False for a channel that never connected or has been expired."""
+        connections = self._connections.get(user_id)
+        if connections is None or channel_name not in connections:
+            return False
+        connections[channel_name] = now
+        self._last_seen[user_id] = now
+        return True
+
+    def disconnect(self, user_id, channel_name, now):
+        connections = self._connections.get(user_id)
+        if not connections or connections.pop(channel_name, None) is None:
+            return
+        if not connections:
+            del self._connections[user_id]
+            self.local_changed = True
+        self._transition(user_id, True, now)
+
+    def apply_snapshot(self, worker_id, user_ids, now):
+        """Replace what `worker_id` reported before with its current online `user_ids`."""
+        user_ids = set(user_ids)
+        previous = self._remote.get(worker_id, (set(), now))[0]
+        self._remote[worker_id] = (user_ids, now)
+        for user_id in user_ids - previous:
+            was_online = self.is_online(user_id)
+            self._remote_count[user_id] = self._remote_count.get(user_id, 0) + 1
+            self._transition(user_id, was_online, now)
+        for user_id in previous - user_ids:
+            self._drop_remote(user_id, now)
+
+    def _drop_remote(self, user_id, now):
+        count = self._remote_count.get(user_id, 0) - 1
+        if count > 0:
+            self._remote_count[user_id] = count
+            return
+        self._remote_count.pop(user_id, None)
+        self._transition(user_id, True, now)
+
+    def expire(self, now):
+        """Close connections that stopped heartbeating and forget workers that stopped reporting."""
+        cutoff = now - self.connection_timeout
+        stale = [
+            (user_id, channel_name)
+            for user_id, connections in self._connections.items()
+            for channel_name, beat in connections.items() if beat < cutoff
+        ]
+        for user_id, channel_name in stale:
+            self.disconnect(user_id, channel_name, now)
+
+        for worker_id in [w for w, (_, seen) in self._remote.items() if seen < now - self.worker_timeout]:
+            for user_id in self._remote.pop(worker_id)[0]:
+                self._drop_remote(user_id, now)
+        return len(stale)
+
+    def subscribe(self, channel_name, user_ids):
+        """Watch `user_ids` from `channel_name`. Returns their current state."""
+        watching = self._watching.setdefault(channel_name, set())
+        for user_id in user_ids:
+            watching.add(user_id)
+            self._watchers.setdefault(user_id, set()).add(channel_name)
+        return self.state(user_ids)
+
+    def unsubscribe(self, channel_name, user_ids=None):
+        watching = self._watching.get(channel_name, set())
+        for user_id in list(watching if user_ids is None else watching & set(user_ids)):
+            watching.discard(user_id)
+            watchers = self._watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(channel_name)
+                if not watchers:
+                    del self._watchers[user_id]
+                    self._pending.pop(user_id, None)
+        if not watching:
+            self._watching.pop(channel_name, None)
+
+    def state(self, user_ids):
+        return [
+            {'user_id': user_id, 'online': self.is_online(user_id), 'last_seen': self._last_seen.get(user_id)}
+            for user_id in user_ids
+        ]
+
+    def drain(self):
+        """{channel_name: [changes]} for the transitions since the last drain, one entry per subscriber."""
+        pending, self._pending = self._pending, {}
+        frames = {}
+        for user_id, online in pending.items():
+            change = {'user_id': user_id, 'online': online, 'last_seen': self._last_seen.get(user_id)}
+            for channel_name in self._watchers.get(user_id, ()):
+                frames.setdefault(channel_name, []).append(change)
+        return frames
+
+
+class PresenceService:
+    """Drives a PresenceStore from consumers and the channel layer."""
+
+    def __init__(self, store=None, flush_interval=FLUSH_INTERVAL, snapshot_interval=SNAPSHOT_INTERVAL,
+                 clock=time.time):
+        self.store = store or PresenceStore()
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self.worker_id = uuid.uuid4().hex
+        self.layer = None
+        self.channel = None
+        self._tasks = []
+        self._next_snapshot = 0
+
+    async def start(self, layer):
+        """Join the worker group and start the flush loop; later calls are no-ops."""
+        if self.layer is not None:
+            return
+        self.layer = layer
+        if layer is not None:
+            self.channel = await layer.new_channel()
+            await layer.group_add(WORKERS_GROUP, self.channel)
+            self._tasks.append(asyncio.ensure_future(self._receive()))
+        self._tasks.append(asyncio.ensure_future(self._run()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.layer is not None and self.channel is not None:
+            await self.layer.group_discard(WORKERS_GROUP, self.channel)
+        self.layer = self.channel = None
+
+    async def connect(self, user_id, channel_name, layer=None):
+        await self.start(layer)
+        self.store.connect(str(user_id), channel_name, self.clock())
+
+    async def disconnect(self, user_id, channel_name):
+        self.store.disconnect(str(user_id), channel_name, self.clock())
+        self.store.unsubscribe(channel_name)
+
+    def heartbeat(self, user_id, channel_name):
+        return self.store.heartbeat(str(user_id), channel_name, self.clock())
+
+    def subscribe(self, channel_name, user_ids):
+        return self.store.subscribe(channel_name, [str(user_id) for user_id in user_ids])
+
+    def unsubscribe(self, channel_name, user_ids=None):
+        self.store.unsubscribe(channel_name, None if user_ids is None else [str(user_id) for user_id in user_ids])
+
+    async def flush(self):
+        """Expire stale state, publish this worker's snapshot if due and push diffs to subscribers."""
+        now = self.clock()
+        self.store.expire(now)
+        if self.channel is not None and (self.store.local_changed or now >= self._next_snapshot):
+            self.store.local_changed = False
+            self._next_snapshot = now + self.snapshot_interval
+            await self._safe(self.layer.group_send(WORKERS_GROUP, {
+                'type': 'presence.snapshot', 'worker': self.worker_id, 'online': self.store.local_online(),
+            }))
+
+        frames = self.store.drain()
+        if frames and self.layer is not None:
+            await asyncio.gather(*(
+                self._safe(self.layer.send(channel_name, {'type': 'presence_diff', 'changes': changes}))
+                for channel_name, changes in frames.items()
+            ))
+        return len(frames)
+
+    async def _safe(self, send):
+        try:
+            await send
+        except Exception as e:
+            logger.warning(f"Presence send failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing presence: {e}")
+
+    async def _receive(self):
+        while True:
+            try:
+                message = await self.layer.receive(self.channel)
+                if message.get('type') == 'presence.snapshot' and message.get('worker') != self.worker_id:
+                    self.store.apply_snapshot(message['worker'], message.get('online', []), self.clock())
+            except Exception as e:
+                # Keep listening; back off so a broken layer doesn't spin the loop
+                logger.error(f"Error receiving presence snapshot: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+
+def thread_participant_ids(thread_id, user):
+    """Participant ids of a thread `user` belongs to, or None."""
+    from django.core.exceptions import ValidationError
+    from messaging.models import MessageThread
+
+    try:
+        thread = MessageThread.objects.filter(id=thread_id, participants=user).first()
+    except (ValidationError, ValueError):
+        return None
+    if thread is None:
+        return None
+    return [str(user_id) for user_id in thread.participants.values_list('id', flat=True)]
+
+
+presence = PresenceService()
@@ -0,0 +1,129 @@
+"""
+Typing indicators, throttled and coalesced per thread.
+
+Clients may report typing on every keystroke; none of that reaches the
+channel layer directly. Each worker keeps who is typing in which thread
+and sends at most one ``typing_batch`` frame per thread every
+MESSAGING_TYPING_INTERVAL seconds, listing everyone typing through this
+worker plus those who just stopped. Someone starting to type in a quiet
+thread goes out at once (leading edge); later changes wait for the end
+of the interval (trailing edge).
+
+A typer expires MESSAGING_TYPING_TTL seconds after their last keystroke,
+or as soon as they send a message, so clients need not report stopping.
+Frames carry ``expires_in`` and ongoing typers are re-announced before
+then, so clients can drop anyone not re-announced, and frames from
+several workers combine cleanly.
+"""
+from django.conf import settings
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = getattr(settings, 'MESSAGING_TYPING_INTERVAL', 1.0)
+TTL = getattr(settings, 'MESSAGING_TYPING_TTL', 6.0)
+
+
+def thread_group(thread_id):
+    return f'thread_{thread_id}'
+
+
+class _ThreadTyping:
+    def __init__(self):
+        self.expires = {}     # user_id -> monotonic time the indicator lapses
+        self.announced = {}   # user_id -> monotonic time of the last frame listing them
+        self.stopped = set()
+        self.last_sent = 0.0
+        self.task = None
+
+
+class TypingCoalescer:
+    def __init__(self, interval=INTERVAL, ttl=TTL, clock=time.monotonic):
+        self.interval = interval
+        self.ttl = ttl
+        self.clock = clock
+        self._threads = {}
+
+    async def update(self, layer, thread_id, user_id, is_typing=True):
+        """Record a typing report (or stop) and send whatever is due now."""
+        thread_id, user_id = str(thread_id), str(user_id)
+        state = self._threads.get(thread_id)
+        if state is None:
+            if not is_typing:
+                return
+            state = self._threads[thread_id] = _ThreadTyping()
+
+        now = self.clock()
+        if is_typing:
+            new = user_id not in state.expires
+            state.expires[user_id] = now + self.ttl
+            state.stopped.discard(user_id)
+            if new and now - state.last_sent >= self.interval:
+                await self._send(layer, thread_id, state, now)
+        elif state.expires.pop(user_id, None) is not None:
+            state.announced.pop(user_id, None)
+            state.stopped.add(user_id)
+
+        if state.task is None or state.task.done():
+            state.task = asyncio.ensure_future(self._run(layer, thread_id, state))
+
+    def typing_in(self, thread_id):
+        state = self._threads.get(str(thread_id))
+        if state is None:
+            return []
+        now = self.clock()
+        return sorted(user_id for user_id, expires in state.expires.items() if expires > now)
+
+    def frame(self, thread_id, state):
+        return {
+            'type': 'typing_batch',
+            'thread_id': thread_id,
+            'typing': sorted(state.expires),
+            'stopped': sorted(state.stopped),
+            'expires_in': self.ttl,
+        }
+
+    def _due(self, state, now):
+        """Whether the thread has changes or typers about to lapse on clients."""
+        if state.stopped:
+            return True
+        return any(
+            now - state.announced.get(user_id, float('-inf')) >= self.ttl / 2 for user_id in state.expires
+        )
+
+    def _expire(self, state, now):
+        for user_id in [user_id for user_id, expires in state.expires.items() if expires <= now]:
+            del state.expires[user_id]
+            state.announced.pop(user_id, None)
+            state.stopped.add(user_id)
+
+    async def _send(self, layer, thread_id, state, now):
+        frame = self.frame(thread_id, state)
+        for user_id in state.expires:
+            state.announced[user_id] = now
+        state.stopped.clear()
+        state.last_sent = now
+        try:
+            await layer.group_send(thread_group(thread_id), frame)
+        except Exception as e:
+            logger.warning(f"Error sending typing frame for thread {thread_id}: {e}")
+
+    async def _run(self, layer, thread_id, state):
+        """Per-thread ticker: flush pending changes once per interval until nobody is typing."""
+        try:
+            while True:
+                await asyncio.sleep(max(state.last_sent + self.interval - self.clock(), 0) or self.interval)
+                now = self.clock()
+                self._expire(state, now)
+                if self._due(state, now):
+                    await self._send(layer, thread_id, state, now)
+                if not state.expires and not state.stopped:
+                    break
+        finally:
+            if self._threads.get(thread_id) is state and not state.expires:
+                del self._threads[thread_id]
+
+
+typing_coalescer = TypingCoalescer()